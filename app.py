@@ -10,21 +10,34 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import os
 import re
+import signal
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.middleware.sessions import SessionMiddleware
 
-from database import create_db_and_tables
+from database import close_db, create_db_and_tables, get_async_session
+from models.llm_usage import GROUP_BY_COLUMNS, summarize_llm_usage
 from routers import auth, chat, dl, memo
-from utils.utils import generate_ai_reply, initialize_clients
+from utils import metrics
+from utils.github import close_github_client
+from utils.llm_usage import usage_recorder
+from utils.loop_watchdog import LoopWatchdogMiddleware, loop_watchdog
+from utils.passwords import password_hasher
+from utils.settings import get_settings, settings_loader
+from utils.shared_state import get_shared_state
+from utils.utils import (
+    cached_ai_reply,
+    close_async_openai_client,
+    initialize_clients,
+)
 
 BASE_DIR = Path(__file__).resolve()
 BASE_DIR = BASE_DIR.parent
@@ -39,6 +52,9 @@ api_keys_and_clients = initialize_clients()
 ) = api_keys_and_clients
 
 
+# LLM の挨拶をキャッシュする秒数（同じ時間帯・同じユーザーなら使い回す）
+GREETING_CACHE_TTL = float(os.getenv("GREETING_CACHE_TTL", "3600"))
+
 # テンプレートディレクトリのパスを指定
 templates = Jinja2Templates(directory="templates")
 
@@ -55,12 +71,14 @@ def convert_urls_to_links(text: str) -> str:
 
 app = FastAPI()
 
-# データベーステーブルの作成
-create_db_and_tables()
-
 # ★セッション（署名付き Cookie）を有効化
 SESSION_SECRET_KEY = os.getenv("SESSION_SECRET_KEY")
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET_KEY)
+# ルートごとの処理時間などを記録（最後に追加して一番外側で計測する）
+app.add_middleware(metrics.MetricsMiddleware)
+# LOOP_WATCHDOG=1 のときだけ、ループを止めたリクエストを特定できるようにする
+if loop_watchdog.enabled:
+    app.add_middleware(LoopWatchdogMiddleware, watchdog=loop_watchdog)
 
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 
@@ -71,15 +89,123 @@ app.include_router(chat.router)
 app.include_router(dl.router)
 
 
+@app.on_event("startup")
+async def startup_event():
+    # データベーステーブルの作成（スキーマ設定・旧 memos.db の移行も含めて起動時に一度だけ）
+    create_db_and_tables()
+
+    # SIGHUP で config.json を読み込み直す
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, settings_loader.reload
+        )
+    except (NotImplementedError, AttributeError, RuntimeError):
+        pass  # Windows やメインスレッド以外のループなど SIGHUP が使えない環境
+
+    # メモ内リンクのタイトル取得ワーカーを開始
+    memo.link_title_worker.start()
+    # イベントループの遅れの計測を開始
+    metrics.loop_lag_monitor.start()
+    # 複数ワーカーのとき、ほかのワーカーの /metrics で合算できるよう値を書き出す
+    metrics.snapshot_writer.start()
+    loop_watchdog.start()
+    # LLM の使用量の定期保存を開始
+    usage_recorder.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 共有 OpenAI クライアントの接続プールを解放
+    await close_async_openai_client()
+    await usage_recorder.stop()
+    await metrics.loop_lag_monitor.stop()
+    await metrics.snapshot_writer.stop()
+    loop_watchdog.stop()
+    await memo.link_title_worker.stop()
+    await memo.memo_jobs.stop()
+    await dl.listing_cache.close()
+    await dl.page_fetcher.close()
+    dl.parser_executor.shutdown(wait=False, cancel_futures=True)
+    await close_github_client()
+    password_hasher.close()
+    await get_shared_state().close()
+    await close_db()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """
+    Prometheus 形式のメトリクス（METRICS_TOKEN が設定されていれば Bearer 認証）
+
+    METRICS_DIR が設定されていれば全ワーカーの合計を返します（書き出し間隔の
+    METRICS_SYNC_INTERVAL 秒だけ古い値を含む）。設定されていなければ、
+    応答したワーカーの値だけです。
+    """
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if metrics.METRICS_DIR:
+        body = await asyncio.to_thread(metrics.render)
+    else:
+        body = metrics.render()
+    return Response(body, media_type=metrics.CONTENT_TYPE)
+
+
+# スタックトレースやルートを含むので管理者だけに見せる
+@app.get(
+    "/debug/loop-stalls",
+    include_in_schema=False,
+    dependencies=[Depends(auth.login_required_yxfhy)],
+)
+async def get_loop_stalls():
+    """
+    イベントループを止めた処理の一覧（LOOP_WATCHDOG=1 のときだけ。管理者ユーザーのみ）
+
+    ループはワーカーごとにあるので、応答したワーカー（worker の pid）の分だけです。
+    """
+    if not loop_watchdog.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return loop_watchdog.summary()
+
+
+# 全ユーザーの使用量・費用を含むので管理者だけに見せる
+@app.get(
+    "/debug/llm-usage",
+    include_in_schema=False,
+    dependencies=[Depends(auth.login_required_yxfhy)],
+)
+async def get_llm_usage(
+    group_by: str = "route",
+    hours: float = 24,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    LLM の使用量（トークン数・費用・所要時間）の集計（管理者ユーザーのみ）
+
+    stored は SQLite に保存した全ワーカーの記録、process は応答したワーカー
+    （worker の pid）が起動してからの集計です。
+    """
+    if group_by not in GROUP_BY_COLUMNS:
+        raise HTTPException(status_code=400, detail="Invalid group_by")
+    # 保存待ちの記録も集計に含める
+    await usage_recorder.flush()
+    since = datetime.utcnow() - timedelta(hours=hours)
+    return {
+        "process": usage_recorder.summary(),
+        "group_by": group_by,
+        "since": since.isoformat(timespec="seconds"),
+        "stored": await summarize_llm_usage(session, group_by, since),
+    }
+
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    # config.jsonの読み込み
-    with open("config.json", "r") as f:
-        config = json.load(f)
-    show_llm_greeting = config.get("showLLMGreeting", True)
+    # config.json の設定（起動時に読み込み済み。更新されると自動で再読み込み）
+    show_llm_greeting = get_settings().show_llm_greeting
 
     jst = timezone(timedelta(hours=9))
-    now = datetime.now(jst).strftime("%Y-%m-%d %H:%M:%S")
+    # 挨拶は「時間帯 × ユーザー」単位でキャッシュするので、時刻は時単位に丸める
+    now = datetime.now(jst).strftime("%Y-%m-%d %H時台")
 
     if show_llm_greeting:
         username = request.session.get("username")  # ★セッション取得
@@ -89,7 +215,9 @@ async def read_root(request: Request):
             + (f"。ユーザー名「{username}」に呼びかけて" if username else "")
         )
         try:
-            ai_message: str = await asyncio.to_thread(generate_ai_reply, prompt, 0.99)
+            ai_message: str = await cached_ai_reply(
+                prompt, 0.99, ttl=GREETING_CACHE_TTL
+            )
             ai_message = convert_urls_to_links(ai_message)
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,228 @@
+"""負荷試験用の外部サービスの偽サーバー
+
+アプリが呼び出す外部サービスを 1 つのサーバーで置き換えます。応答時間は
+オプションで指定でき、実際のサービスに近い待ち時間でアプリの振る舞いを測れます。
+
+    - /openai/v1/chat/completions: OpenAI API（ストリーミング・非ストリーミング）
+    - /github/repos/{owner}/{repo}/contents/...: GitHub の Contents API
+    - /nyaa/: スクレイピング対象の検索結果ページ（bench/fixtures の保存済みページ）
+
+アプリ側は次の環境変数で接続先を切り替えます（bench.loadtest が設定します）:
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/openai/v1
+    GITHUB_API_URL=http://127.0.0.1:<port>/github
+    DL_BASE_URL=http://127.0.0.1:<port>/nyaa
+
+単体での実行方法（リポジトリのルートで）:
+    python -m bench.fake_upstreams [--port 9900]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+LISTING_FIXTURE = FIXTURES_DIR / "sukebei_listing.html"
+
+
+def _chunk(model: str, **fields) -> bytes:
+    """ストリーミング応答の 1 チャンク（SSE の data 行）"""
+    body = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        **fields,
+    }
+    return f"data: {json.dumps(body)}\n\n".encode()
+
+
+def _count_tokens(messages) -> int:
+    """プロンプトのトークン数の概算（4 文字で 1 トークン）"""
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+
+
+class FakeUpstreams:
+    """偽サーバーの状態と応答時間の設定"""
+
+    def __init__(
+        self,
+        openai_latency: float = 0.5,
+        openai_tokens: int = 60,
+        openai_token_interval: float = 0.02,
+        github_latency: float = 0.15,
+        scrape_latency: float = 0.4,
+    ):
+        """
+        Args:
+            openai_latency (float, optional): 非ストリーミング応答・最初のトークンまでの秒数
+            openai_tokens (int, optional): 1 回の応答で返すトークン数
+            openai_token_interval (float, optional): ストリーミングのトークン間隔（秒）
+            github_latency (float, optional): GitHub API の応答時間（秒）
+            scrape_latency (float, optional): 検索結果ページの応答時間（秒）
+        """
+        self.openai_latency = openai_latency
+        self.openai_tokens = openai_tokens
+        self.openai_token_interval = openai_token_interval
+        self.github_latency = github_latency
+        self.scrape_latency = scrape_latency
+        self.listing_html = LISTING_FIXTURE.read_bytes()
+        self.files = {}  # GitHub のファイル（パス → Base64 の内容）
+        self.hits = {"openai": 0, "github": 0, "nyaa": 0}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self.chat_completions)
+        app.router.add_get(
+            "/github/repos/{owner}/{repo}/contents/{path:.*}", self.get_contents
+        )
+        app.router.add_put(
+            "/github/repos/{owner}/{repo}/contents/{path:.+}", self.put_contents
+        )
+        app.router.add_delete(
+            "/github/repos/{owner}/{repo}/contents/{path:.+}", self.delete_contents
+        )
+        app.router.add_get("/nyaa/", self.listing)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    # --------------------------------------------------------------
+    # OpenAI
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.hits["openai"] += 1
+        body = await request.json()
+        model = body.get("model", "gpt-4.1")
+        prompt_tokens = _count_tokens(body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.openai_tokens,
+            "total_tokens": prompt_tokens + self.openai_tokens,
+        }
+        await asyncio.sleep(self.openai_latency)
+
+        if not body.get("stream"):
+            content = " ".join(f"token{i}" for i in range(self.openai_tokens))
+            return web.json_response(
+                {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(self.openai_tokens):
+            delta = {
+                "index": 0,
+                "delta": {"content": f"token{i} "},
+                "finish_reason": None,
+            }
+            await response.write(_chunk(model, choices=[delta]))
+            await asyncio.sleep(self.openai_token_interval)
+        finish = {"index": 0, "delta": {}, "finish_reason": "stop"}
+        await response.write(_chunk(model, choices=[finish]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await response.write(_chunk(model, choices=[], usage=usage))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    # --------------------------------------------------------------
+    # GitHub Contents API
+
+    async def get_contents(self, request: web.Request) -> web.Response:
+        self.hits["github"] += 1
+        await asyncio.sleep(self.github_latency)
+        path = request.match_info["path"]
+        if path in self.files:
+            content = self.files[path]
+            return web.json_response(
+                {"name": path, "path": path, "sha": _sha(content), "content": content}
+            )
+        listing = [
+            {"name": name, "path": name, "sha": _sha(content), "type": "file"}
+            for name, content in self.files.items()
+            if name.startswith(path)
+        ]
+        return web.json_response(listing)
+
+    async def put_contents(self, request: web.Request) -> web.Response:
+        self.hits["github"] += 1
+        await asyncio.sleep(self.github_latency)
+        owner, repo, path = (request.match_info[k] for k in ("owner", "repo", "path"))
+        data = await request.json()
+        if path in self.files and data.get("sha") != _sha(self.files[path]):
+            return web.json_response({"message": "sha wasn't supplied"}, status=422)
+        self.files[path] = data["content"]
+        html_url = f"https://github.com/{owner}/{repo}/blob/main/{path}"
+        return web.json_response(
+            {
+                "content": {
+                    "path": path,
+                    "sha": _sha(data["content"]),
+                    "html_url": html_url,
+                }
+            },
+            status=201,
+        )
+
+    async def delete_contents(self, request: web.Request) -> web.Response:
+        self.hits["github"] += 1
+        await asyncio.sleep(self.github_latency)
+        if self.files.pop(request.match_info["path"], None) is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        return web.json_response({"commit": {}})
+
+    # --------------------------------------------------------------
+    # スクレイピング対象
+
+    async def listing(self, request: web.Request) -> web.Response:
+        self.hits["nyaa"] += 1
+        await asyncio.sleep(self.scrape_latency)
+        return web.Response(body=self.listing_html, content_type="text/html")
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.hits)
+
+
+def _sha(content: str) -> str:
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-tokens", type=int, default=60)
+    parser.add_argument("--openai-token-interval", type=float, default=0.02)
+    parser.add_argument("--github-latency", type=float, default=0.15)
+    parser.add_argument("--scrape-latency", type=float, default=0.4)
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(
+        openai_latency=args.openai_latency,
+        openai_tokens=args.openai_tokens,
+        openai_token_interval=args.openai_token_interval,
+        github_latency=args.github_latency,
+        scrape_latency=args.scrape_latency,
+    )
+    web.run_app(upstreams.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,674 @@
+"""アプリ全体の負荷試験
+
+外部サービスを偽サーバー（bench.fake_upstreams）に置き換えて app:app を起動し、
+シナリオごとに仮想ユーザーからリクエストを送り続けて次の値を測ります。
+
+    - スループット（1 秒あたりに完了した操作数）
+    - 操作ごとのレイテンシ（p50 / p95 / p99 / 最大）
+    - サーバープロセスのメモリ使用量（RSS。開始時・最大・終了時）
+
+シナリオごとにアプリを起動し直し、一時ディレクトリの空の DB から始めるので、
+同じオプションで実行すれば同じ条件で測れます。結果は bench/baselines に保存でき、
+次回以降の結果と比較して性能の変化を確認できます。
+
+実行方法（リポジトリのルートで）:
+    python -m bench.loadtest                          # 全シナリオを実行
+    python -m bench.loadtest -s chat_stream -s dl     # シナリオを選んで実行
+    python -m bench.loadtest --save-baseline default  # 結果を基準として保存
+    python -m bench.loadtest --compare default        # 保存した基準と比較
+    python -m bench.loadtest --workers 4              # gunicorn で 4 ワーカー起動して測る
+
+シナリオ:
+    home / memo / chat_stream / login / dl / mixed（全操作を実際の利用に近い比率で混ぜる）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BASELINES_DIR = Path(__file__).parent / "baselines"
+
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+ADMIN_PASSWORD = "bench-admin"
+
+# シナリオ → 操作の重み
+SCENARIOS: Dict[str, Dict[str, int]] = {
+    "home": {"home": 1},
+    "memo": {"memo_list": 6, "memo_search": 2, "memo_create": 2, "memo_push": 1},
+    "chat_stream": {"chat_stream": 1},
+    "login": {"login": 1},
+    "dl": {"dl": 1},
+    "mixed": {
+        "home": 30,
+        "memo_list": 20,
+        "memo_search": 5,
+        "memo_create": 8,
+        "memo_push": 2,
+        "chat_stream": 20,
+        "login": 5,
+        "dl": 10,
+    },
+}
+
+MEMO_ID_PATTERN = re.compile(r'action="/memo/delete/([0-9a-f-]{36})"')
+
+
+class OperationError(Exception):
+    """期待した応答が返らなかった"""
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近傍順位法によるパーセンタイル（values は昇順に並んでいること）"""
+    if not values:
+        return 0.0
+    rank = max(int(len(values) * q / 100 + 0.999999) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Recorder:
+    """操作ごとのレイテンシとエラーを記録する"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+        self.enabled = False  # ウォームアップ中は記録しない
+
+    @contextmanager
+    def measure(self, operation: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if self.enabled:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(f"{operation}: {type(e).__name__}: {e}")
+            return
+        self.observe(operation, time.perf_counter() - started)
+
+    def observe(self, operation: str, seconds: float) -> None:
+        if self.enabled:
+            self.latencies.setdefault(operation, []).append(seconds)
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        operations = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(name, []))
+            operations[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "throughput": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round((values[-1] if values else 0.0) * 1000, 1),
+            }
+        # 最初のバイトまでの時間（".ttfb"）は操作数に含めない
+        completed = [v for k, v in operations.items() if "." not in k]
+        return {
+            "duration": round(duration, 2),
+            "requests": sum(op["count"] for op in completed),
+            "errors": sum(op["errors"] for op in completed),
+            "throughput": round(sum(op["count"] for op in completed) / duration, 2),
+            "operations": operations,
+            "error_samples": self.error_samples,
+        }
+
+
+class VirtualUser:
+    """1 人分の利用者（Cookie を持ち、操作を順に実行する）"""
+
+    def __init__(self, base_url: str, recorder: Recorder, rng: random.Random):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.memo_ids: List[str] = []
+        self.session = aiohttp.ClientSession(
+            # unsafe=True: 127.0.0.1 のような IP アドレスでも Cookie を保持する
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=120),
+        )
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def _expect(self, response: aiohttp.ClientResponse, *statuses: int) -> str:
+        body = await response.text()
+        if response.status not in statuses:
+            raise OperationError(f"HTTP {response.status}")
+        return body
+
+    async def login(self) -> None:
+        async with self.session.post(
+            f"{self.base_url}/login",
+            data={"username": BENCH_USERNAME, "password": BENCH_PASSWORD},
+            allow_redirects=False,
+        ) as response:
+            await self._expect(response, 302, 303)
+
+    async def home(self) -> None:
+        async with self.session.get(f"{self.base_url}/") as response:
+            await self._expect(response, 200)
+
+    async def memo_list(self, search: Optional[str] = None) -> None:
+        params = {"search": search} if search else {}
+        async with self.session.get(f"{self.base_url}/memo", params=params) as response:
+            body = await self._expect(response, 200)
+        self.memo_ids = MEMO_ID_PATTERN.findall(body) or self.memo_ids
+
+    async def memo_search(self) -> None:
+        await self.memo_list(search=self.rng.choice(["bench", "memo", "https"]))
+
+    async def memo_create(self) -> None:
+        content = f"bench memo {self.rng.random()} https://example.com/{self.rng.randint(0, 99)}"
+        async with self.session.post(
+            f"{self.base_url}/memo", data={"content": content}, allow_redirects=False
+        ) as response:
+            await self._expect(response, 303)
+
+    async def memo_push(self) -> None:
+        if not self.memo_ids:
+            raise OperationError("プッシュするメモがありません")
+        memo_id = self.rng.choice(self.memo_ids)
+        async with self.session.post(
+            f"{self.base_url}/memo/push/{memo_id}"
+        ) as response:
+            await self._expect(response, 200)
+
+    async def chat_stream(self) -> None:
+        started = time.perf_counter()
+        async with self.session.post(
+            f"{self.base_url}/chat/send/stream",
+            json={"message": f"ベンチマークの質問 {self.rng.randint(0, 999)}"},
+        ) as response:
+            if response.status != 200:
+                raise OperationError(f"HTTP {response.status}")
+            first = True
+            async for line in response.content:
+                if first and line.startswith(b"data:"):
+                    self.recorder.observe(
+                        "chat_stream.ttfb", time.perf_counter() - started
+                    )
+                    first = False
+            if first:
+                raise OperationError("応答が空です")
+
+    async def dl(self) -> None:
+        started = time.perf_counter()
+        url = self.base_url.replace("http", "ws", 1) + "/dl/ws/dl"
+        async with self.session.ws_connect(url) as ws:
+            first = True
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                data = json.loads(message.data)
+                if first and data["type"] == "rows":
+                    self.recorder.observe("dl.ttfb", time.perf_counter() - started)
+                    first = False
+                if data["type"] == "error":
+                    raise OperationError(data.get("message", "error"))
+                if data["type"] == "done":
+                    return
+            raise OperationError(f"done の前に切断されました ({ws.close_code})")
+
+    async def run(self, weights: Dict[str, int], deadline: float) -> None:
+        """deadline まで重みに従って操作を選び、続けて実行する"""
+        operations = list(weights)
+        ratios = list(weights.values())
+        while time.monotonic() < deadline:
+            operation = self.rng.choices(operations, ratios)[0]
+            if operation == "memo_push" and not self.memo_ids:
+                operation = "memo_list"  # まだメモの ID を知らない
+            with self.recorder.measure(operation):
+                await getattr(self, operation)()
+
+
+# ----------------------------------------------------------------------
+# プロセスの起動とメモリの計測
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    """プロセスとその子プロセスの RSS の合計（/proc が無い環境では None）"""
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    children: Dict[int, List[int]] = {}
+    for stat in proc.glob("[0-9]*/stat"):
+        try:
+            ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(stat.parent.name))
+    # ワーカーを起動する構成（gunicorn など）では子孫のプロセスも合計する
+    pids, stack = set(), [pid]
+    while stack:
+        current = stack.pop()
+        pids.add(current)
+        stack.extend(children.get(current, []))
+    total = 0
+    for child in pids:
+        try:
+            status = (proc / str(child) / "status").read_text()
+        except OSError:
+            continue
+        match = re.search(r"^VmRSS:\s+(\d+) kB", status, re.MULTILINE)
+        if match:
+            total += int(match.group(1)) * 1024
+    return total
+
+
+class MemorySampler:
+    """一定間隔でサーバーの RSS を測り、最大値を記録する"""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> Optional[int]:
+        rss = _rss_bytes(self.pid)
+        if rss is not None:
+            self.samples.append(rss)
+        return rss
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> Dict[str, Optional[float]]:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        end = self.sample()
+        if not self.samples:
+            return {"start_mb": None, "peak_mb": None, "end_mb": None}
+        to_mb = lambda value: round(value / 2**20, 1)  # noqa: E731
+        return {
+            "start_mb": to_mb(self.samples[0]),
+            "peak_mb": to_mb(max(self.samples)),
+            "end_mb": to_mb(end),
+        }
+
+
+async def _wait_until_ready(
+    url: str, process: subprocess.Popen, timeout: float = 30
+) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(
+                    f"{url} のプロセスが終了しました ({process.returncode})"
+                )
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} が起動しませんでした")
+
+
+def _stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _prepare_workdir(workdir: Path) -> None:
+    """アプリを起動するディレクトリ（DB などのファイルはここに作られる）"""
+    # テンプレートはカレントディレクトリからの相対パスで読み込まれる
+    try:
+        (workdir / "templates").symlink_to(ROOT_DIR / "templates")
+    except OSError:
+        shutil.copytree(ROOT_DIR / "templates", workdir / "templates")
+    config = json.loads((ROOT_DIR / "config.json").read_text(encoding="utf-8"))
+    config["showLLMGreeting"] = (
+        True  # トップページで LLM の挨拶（キャッシュ付き）を使う
+    )
+    (workdir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+
+
+def _app_env(upstream_url: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [str(ROOT_DIR), os.getenv("PYTHONPATH")])
+        ),
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{upstream_url}/openai/v1",
+        "GITHUB_TOKEN": "bench",
+        "GITHUB_API_URL": f"{upstream_url}/github",
+        "DL_BASE_URL": f"{upstream_url}/nyaa",
+        "ADMIN_PASSWORD": ADMIN_PASSWORD,
+        "SESSION_SECRET_KEY": "bench-secret",
+    }
+
+
+def _app_command(port: int, workers: int) -> List[str]:
+    if workers > 1:
+        # 本番と同じ gunicorn.conf.py で複数のワーカーを起動する
+        return [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            str(ROOT_DIR / "gunicorn.conf.py"),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+            "app:app",
+        ]
+    return [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "app:app",
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+    ]
+
+
+# ----------------------------------------------------------------------
+# シナリオの実行
+
+
+async def run_scenario(
+    name: str, upstream_url: str, args: argparse.Namespace
+) -> Dict[str, Any]:
+    """アプリを起動してシナリオを 1 つ実行し、結果を返す"""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        workdir = Path(tmp)
+        _prepare_workdir(workdir)
+        process = subprocess.Popen(
+            _app_command(port, args.workers), cwd=workdir, env=_app_env(upstream_url)
+        )
+        try:
+            await _wait_until_ready(f"{base_url}/login", process)
+            return await _drive(name, base_url, process.pid, args)
+        finally:
+            _stop(process)
+
+
+async def _drive(
+    name: str, base_url: str, pid: int, args: argparse.Namespace
+) -> Dict[str, Any]:
+    recorder = Recorder()
+    rng = random.Random(f"{args.seed}:{name}")
+    users = [
+        VirtualUser(base_url, recorder, random.Random(rng.random()))
+        for _ in range(args.users)
+    ]
+    try:
+        # 準備: ベンチマーク用のユーザーを作ってログインしておく
+        async with users[0].session.post(
+            f"{base_url}/signup",
+            data={
+                "username": BENCH_USERNAME,
+                "password": BENCH_PASSWORD,
+                "admin_password": ADMIN_PASSWORD,
+            },
+        ) as response:
+            await users[0]._expect(response, 200)
+        await asyncio.gather(*(user.login() for user in users))
+
+        weights = SCENARIOS[name]
+        if args.warmup > 0:
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(*(user.run(weights, deadline) for user in users))
+
+        sampler = MemorySampler(pid)
+        recorder.enabled = True
+        sampler.start()
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(user.run(weights, deadline) for user in users))
+        duration = time.monotonic() - started
+        memory = await sampler.stop()
+    finally:
+        await asyncio.gather(*(user.close() for user in users))
+
+    result = recorder.summary(duration)
+    result["memory"] = memory
+    return result
+
+
+def print_result(name: str, result: Dict[str, Any]) -> None:
+    memory = result["memory"]
+    print(
+        f"\n== {name}: {result['requests']} ops, {result['errors']} errors, "
+        f"{result['throughput']:.1f} ops/s, RSS {memory['start_mb']} → "
+        f"peak {memory['peak_mb']} → {memory['end_mb']} MB"
+    )
+    print(
+        f"  {'operation':<18}{'count':>7}{'err':>5}{'ops/s':>8}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)"
+    )
+    for op, stats in result["operations"].items():
+        print(
+            f"  {op:<18}{stats['count']:>7}{stats['errors']:>5}{stats['throughput']:>8.1f}"
+            f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+            f"{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}"
+        )
+    for sample in result["error_samples"]:
+        print(f"  ! {sample}")
+
+
+# ----------------------------------------------------------------------
+# 基準との比較
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before if before else 0.0
+
+
+def compare(
+    baseline: Dict[str, Any], report: Dict[str, Any], threshold: float
+) -> List[str]:
+    """
+    基準と比べて結果を表示し、悪化した項目を返す
+
+    Args:
+        baseline (Dict[str, Any]): 保存した基準
+        report (Dict[str, Any]): 今回の結果
+        threshold (float): 悪化とみなす変化の割合（0.2 なら 20%）
+
+    Returns:
+        List[str]: 悪化した項目の説明
+    """
+    regressions = []
+    checks: List[tuple] = [
+        # (名前, 取り出し方, 大きいほど良いか)
+        ("throughput", lambda s: s["throughput"], True),
+        ("peak RSS", lambda s: s["memory"]["peak_mb"] or 0, False),
+    ]
+    print(
+        f"\n== 基準との比較（{baseline['created']} の結果。±{threshold:.0%} を超えたら !）"
+    )
+    for name, result in report["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"  {name}: 基準がありません")
+            continue
+        items = [
+            (label, get(base), get(result), higher) for label, get, higher in checks
+        ]
+        for op, stats in result["operations"].items():
+            if op in base["operations"]:
+                for key in ("p50_ms", "p95_ms", "p99_ms"):
+                    items.append(
+                        (
+                            f"{op} {key[:3]}",
+                            base["operations"][op][key],
+                            stats[key],
+                            False,
+                        )
+                    )
+        for label, before, after, higher_is_better in items:
+            change = _change(before, after)
+            worse = -change if higher_is_better else change
+            mark = "!" if worse > threshold else " "
+            print(
+                f" {mark} {name:<12}{label:<24}{before:>10.1f} → {after:>10.1f} ({change:+.0%})"
+            )
+            if worse > threshold:
+                regressions.append(
+                    f"{name} {label}: {before} → {after} ({change:+.0%})"
+                )
+    return regressions
+
+
+def _environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    upstream_port = _free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    upstream = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "bench.fake_upstreams",
+            "--port",
+            str(upstream_port),
+            "--openai-latency",
+            str(args.openai_latency),
+            "--scrape-latency",
+            str(args.scrape_latency),
+        ],
+        cwd=ROOT_DIR,
+    )
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "options": {
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "users": args.users,
+            "seed": args.seed,
+            "openai_latency": args.openai_latency,
+            "scrape_latency": args.scrape_latency,
+            "workers": args.workers,
+        },
+        "scenarios": {},
+    }
+    try:
+        await _wait_until_ready(f"{upstream_url}/stats", upstream)
+        for name in args.scenario or list(SCENARIOS):
+            result = await run_scenario(name, upstream_url, args)
+            report["scenarios"][name] = result
+            print_result(name, result)
+    finally:
+        _stop(upstream)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        path = BASELINES_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        print(f"\n基準を保存しました: {path.relative_to(ROOT_DIR)}")
+    if args.compare:
+        path = BASELINES_DIR / f"{args.compare}.json"
+        baseline = json.loads(path.read_text())
+        if {"workers": 1, **baseline["options"]} != report["options"]:
+            print(f"\n注意: 基準と実行条件が異なります: {baseline['options']}")
+        regressions = compare(baseline, report, args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="実行するシナリオ（複数指定可。省略時はすべて）",
+    )
+    parser.add_argument("--duration", type=float, default=15, help="計測する秒数")
+    parser.add_argument("--warmup", type=float, default=3, help="計測前に流す秒数")
+    parser.add_argument(
+        "--users", type=int, default=20, help="同時に操作する仮想ユーザー数"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="アプリのワーカープロセス数（2 以上なら gunicorn.conf.py で起動）",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="操作の選び方の乱数シード")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--scrape-latency", type=float, default=0.4)
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    parser.add_argument(
+        "--save-baseline", metavar="NAME", help="結果を基準として保存する"
+    )
+    parser.add_argument("--compare", metavar="NAME", help="保存した基準と比較する")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="悪化とみなす変化の割合"
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="基準より悪化した項目があれば終了コード 1 で終わる",
+    )
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
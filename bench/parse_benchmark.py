@@ -0,0 +1,109 @@
+"""検索結果ページ解析のマイクロベンチマーク
+
+bench/fixtures の保存済みページを各バックエンドで解析し、1 ページあたりの
+処理時間を比較します。あわせて全バックエンドの結果が一致することを確認します。
+
+実行方法（リポジトリのルートで）:
+    python -m bench.parse_benchmark [--repeat 20]
+"""
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from utils.listing_parser import BACKENDS, parse_size
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+BASE_URL = "https://sukebei.nyaa.si/?f=2&c=2_2&q=-FC2&p=1"
+
+
+def legacy_parse(html: str, url: str) -> List[Dict]:
+    """変更前の scrape_sukebei と同じ解析処理（比較用）"""
+    soup = BeautifulSoup(html, "html.parser")
+    rows = soup.select("table tbody tr")
+
+    records = []
+    for r in rows:
+        tds = r.find_all("td")
+        if len(tds) < 7:
+            continue
+
+        name = tds[1].get_text(strip=True)
+        magnet_tag = tds[2].find("a", title="Magnet link")
+        link = (
+            magnet_tag["href"]
+            if magnet_tag
+            else (
+                urljoin(url, tds[2].find("a", href=True)["href"])
+                if tds[2].find("a", href=True)
+                else ""
+            )
+        )
+        records.append(
+            {
+                "Name": name,
+                "Link": link,
+                "Size": tds[3].get_text(strip=True),
+                "Date": tds[4].get_text(strip=True),
+                "Seeders": int(tds[5].get_text(strip=True)),
+                "Leechers": int(tds[6].get_text(strip=True)),
+                "Google_Search_URL": f"https://www.google.com/search?q={name}",
+            }
+        )
+    return records
+
+
+def as_lists(rows: List) -> List[List]:
+    """比較用に行データを ListingRow.FIELDS の順のリストにそろえる"""
+    if rows and isinstance(rows[0], dict):
+        return [
+            [
+                row["Name"],
+                row["Link"],
+                parse_size(row["Size"]),
+                row["Date"],
+                row["Seeders"],
+                row["Leechers"],
+            ]
+            for row in rows
+        ]
+    return [row.to_list() for row in rows]
+
+
+def measure(parse: Callable[[str, str], List[Dict]], html: str, repeat: int) -> float:
+    """repeat 回解析したときの 1 回あたりの処理時間の中央値（ミリ秒）"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(html, BASE_URL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    parsers = {"legacy": legacy_parse, **BACKENDS}
+    for fixture in sorted(FIXTURES_DIR.glob("*.html")):
+        html = fixture.read_text(encoding="utf-8")
+        expected = as_lists(legacy_parse(html, BASE_URL))
+        print(f"{fixture.name}: {len(html) // 1024} KiB, {len(expected)} rows")
+
+        baseline = None
+        for name, parse in parsers.items():
+            if as_lists(parse(html, BASE_URL)) != expected:
+                raise SystemExit(f"  {name}: 解析結果が legacy と一致しません")
+            elapsed = measure(parse, html, args.repeat)
+            baseline = baseline or elapsed
+            print(f"  {name:<11} {elapsed:8.2f} ms/page  x{baseline / elapsed:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
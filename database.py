@@ -1,14 +1,195 @@
 # database.py
-from sqlmodel import Session, SQLModel, create_engine
+import contextlib
+import os
+import sqlite3
+import time
+from typing import Iterator
 
-DATABASE_URL = "sqlite:///./web_app.db"  # ルート直下に SQLite ファイルを作成
-engine = create_engine(DATABASE_URL, echo=False)
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from utils.metrics import UPSTREAM_DURATION
+
+# SQLite ファイルのパス（デフォルトはルート直下）。本番ではマウントしたディレクトリに置く
+DATABASE_PATH = os.getenv("DATABASE_PATH", "./web_app.db")
+# ジャーナルモード。WAL は -wal / -shm ファイルを DB と同じディレクトリに作るので、
+# DB ファイルだけをマウントしている環境では使わない（コンテナの削除で未反映の
+# 書き込みが失われる）。ディレクトリごと永続化している場合だけ WAL にする
+DB_JOURNAL_MODE = (os.getenv("DB_JOURNAL_MODE") or "DELETE").upper()
+if DB_JOURNAL_MODE not in ("DELETE", "TRUNCATE", "PERSIST", "WAL"):
+    raise ValueError(f"未知の DB_JOURNAL_MODE です: {DB_JOURNAL_MODE}")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# ルーターからは aiosqlite 経由の非同期エンジンを使う（イベントループを止めない）
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+# 以前メモを保存していた DB ファイル（起動時に一度だけ web_app.db へ移行する）
+LEGACY_MEMO_DB = "./memos.db"
+
+_POOL_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": 30,
+}
+
+# User（SQLModel）と MemoModel（SQLAlchemy）の両方がこのエンジンを使う
+# 同期エンジンは起動時のテーブル作成・移行とスクリプト用
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    # セッションはスレッドプール上でも使われるのでスレッド間共有を許可
+    connect_args={"check_same_thread": False, "timeout": 30},
+    **_POOL_OPTIONS,
+)
+
+# リクエスト処理用の非同期エンジン（同じ DB ファイル・同じプラグマ）
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    connect_args={"timeout": 30},
+    **_POOL_OPTIONS,
+)
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """接続ごとに SQLite のプラグマを設定する"""
+    cursor = dbapi_connection.cursor()
+    # WAL なら読み込みが書き込みを待たない（DB_JOURNAL_MODE=WAL のときだけ）
+    cursor.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    if DB_JOURNAL_MODE == "WAL":
+        # WAL なら NORMAL でもクラッシュ時に DB が壊れない（fsync 回数を減らす）
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    else:
+        cursor.execute("PRAGMA synchronous=FULL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA cache_size=-16000")  # 約 16MB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=134217728")  # 128MB
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _observe_query(conn, statement: str, outcome: str) -> None:
+    started = conn.info["query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    UPSTREAM_DURATION.observe(
+        time.perf_counter() - started, "sqlite", operation, outcome
+    )
+
+
+@event.listens_for(engine, "after_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """SQL 1 文の実行時間を記録する（操作の種類は SELECT / INSERT などの先頭の語）"""
+    _observe_query(conn, statement, "ok")
+
+
+@event.listens_for(engine, "handle_error")
+@event.listens_for(async_engine.sync_engine, "handle_error")
+def _handle_error(exception_context) -> None:
+    # 失敗した文は after_cursor_execute が呼ばれないのでここで記録する
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        _observe_query(conn, exception_context.statement or "", "error")
+
+
+# commit 後に属性を読み直さない（読み直しのたびに await が必要になるため）
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+def _migrate_legacy_memo_db() -> None:
+    """memos.db のメモを web_app.db に移行する（一度だけ実行）"""
+    # ATTACH / DETACH はトランザクション外で行う必要があるので sqlite3 を直接使う
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY)"
+        )
+        done = conn.execute(
+            "SELECT 1 FROM schema_migrations WHERE name = 'legacy_memo_db'"
+        ).fetchone()
+        if done:
+            return
+
+        if os.path.exists(LEGACY_MEMO_DB):
+            conn.execute("ATTACH DATABASE ? AS legacy", (LEGACY_MEMO_DB,))
+            has_table = conn.execute(
+                "SELECT 1 FROM legacy.sqlite_master "
+                "WHERE type = 'table' AND name = 'memos'"
+            ).fetchone()
+            if has_table:
+                with conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO memos (id, content, created_at, username) "
+                        "SELECT id, content, created_at, username FROM legacy.memos"
+                    )
+            conn.execute("DETACH DATABASE legacy")
+
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO schema_migrations (name) "
+                "VALUES ('legacy_memo_db')"
+            )
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def _startup_lock() -> Iterator[None]:
+    """
+    複数のワーカープロセスが同時に起動しても、テーブル作成・移行を 1 つずつ行うためのロック
+
+    fcntl が使えない環境（Windows）ではロックしません。
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(f"{DATABASE_PATH}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 
 def create_db_and_tables() -> None:
-    SQLModel.metadata.create_all(engine)
+    # テーブル定義をメタデータに登録するため、ここでモデルを読み込む
+    from models.llm_usage import LLMUsage  # noqa: F401
+    from models.memo import MemoModel, init_memo_search
+    from models.user import User  # noqa: F401
+
+    with _startup_lock():
+        SQLModel.metadata.create_all(engine)
+        # create_all は既存テーブルにインデックスを追加しないので個別に作成する
+        for index in MemoModel.__table__.indexes:
+            index.create(engine, checkfirst=True)
+
+        _migrate_legacy_memo_db()
+        init_memo_search(engine)
+
+
+async def close_db() -> None:
+    """WAL の内容を DB 本体に書き戻してから（WAL のとき）接続プールを閉じる（アプリ終了時用）"""
+    # チェックポイントは他の接続が読み書き中だと完了しないので先に非同期側を閉じる
+    await async_engine.dispose()
+    if DB_JOURNAL_MODE == "WAL":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    engine.dispose()
 
 
-def get_session() -> Session:
-    with Session(engine) as session:
+async def get_async_session():
+    async with AsyncSessionLocal() as session:
         yield session
@@ -0,0 +1,62 @@
+"""gunicorn の設定（複数のワーカープロセスで起動する）
+
+    gunicorn -c gunicorn.conf.py app:app
+
+各ワーカーは uvicorn のイベントループで動く独立したプロセスです。
+ワーカー間で共有が必要な状態（チャット履歴・ジョブの進捗・スクレイピング結果）は
+SQLite ファイル（CHAT_STORE / SHARED_STATE）に置くので、同じマシンの全 CPU コアを
+使えます。複数のマシンで動かす場合は CHAT_STORE=redis / SHARED_STATE=redis にします。
+セッションは署名付き Cookie なので、全ワーカーで同じ SESSION_SECRET_KEY を使います。
+
+メトリクスは各ワーカーが METRICS_DIR に書き出し、/metrics で全ワーカー分を合算します。
+/debug/loop-stalls と /debug/llm-usage の process は応答したワーカーの分だけです。
+
+環境変数（任意）:
+    - WEB_CONCURRENCY: ワーカー数（デフォルトは CPU コア数）
+    - PORT: 待ち受けるポート（デフォルト 8000）
+    - GUNICORN_TIMEOUT: 応答しないワーカーを再起動するまでの秒数（デフォルト 120）
+    - GUNICORN_GRACEFUL_TIMEOUT: 終了の合図から終了処理を終えるまでの秒数（デフォルト 20）。
+      docker stop の猶予（deploy.yml の --stop-timeout 30）より短くする
+    - METRICS_DIR: ワーカーごとのメトリクスを書き出すディレクトリ
+      （デフォルトは一時ディレクトリの web-app-metrics。起動時に中身を消す）
+"""
+
+import glob
+import multiprocessing
+import os
+import tempfile
+
+# I/O 待ちはイベントループで並行に処理するので、ワーカーは CPU コアと同じ数で足りる
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# 処理中のリクエストを待つ時間を区切り、終了処理を graceful_timeout 内に終える
+worker_class = "utils.gunicorn_worker.AppUvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# ストリーミング応答（チャット・/dl の WebSocket）は長く続くので余裕を持たせる
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# docker stop の猶予を過ぎると SIGKILL され、終了処理（DB のチェックポイント・
+# LLM 使用量の保存など）が実行されないので、それより短くする
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = 5
+
+# アプリはワーカーごとに読み込む（DB の接続やスレッドを fork で共有しない）
+preload_app = False
+
+# ワーカーに設定を引き継ぐ（アプリ側で WEB_CONCURRENCY を参照する）
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# bcrypt のスレッドは全ワーカーの合計が CPU コア数程度になるよう割り振る
+os.environ.setdefault(
+    "PASSWORD_HASH_WORKERS",
+    str(max(1, min(4, multiprocessing.cpu_count() // workers))),
+)
+# ワーカーごとのメトリクスの書き出し先（/metrics で合算する）
+metrics_dir = os.environ.setdefault(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "web-app-metrics")
+)
+
+
+def on_starting(server):
+    # 前回の起動のワーカーが書き出したメトリクスを消す
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.json*")):
+        os.remove(path)
@@ -0,0 +1,105 @@
+# models/llm_usage.py
+import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlmodel import Field, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# 集計に使える列（URL パラメータなどから列名を受け取るので許可したものだけ）
+GROUP_BY_COLUMNS = ("username", "route", "conversation_id", "model", "operation")
+
+
+class LLMUsage(SQLModel, table=True):
+    """OpenAI API 呼び出し 1 回分の使用量と所要時間"""
+
+    __tablename__ = "llm_usage"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.utcnow, nullable=False, index=True
+    )
+    username: Optional[str] = Field(default=None, index=True)
+    route: str = Field(index=True)
+    conversation_id: Optional[str] = Field(default=None, index=True)
+    operation: str  # chat / chat_stream / reply / summary / search
+    model: str
+    status: str = "ok"  # ok / error / cancelled
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: Optional[float] = None  # 単価が設定されていないモデルは None
+    latency_seconds: float = 0.0
+    ttft_seconds: Optional[float] = None  # ストリーミングで最初のトークンが届くまで
+
+
+async def save_llm_usage(session: AsyncSession, records: List[LLMUsage]) -> None:
+    """使用量の記録をまとめて保存する"""
+    session.add_all(records)
+    await session.commit()
+
+
+async def summarize_llm_usage(
+    session: AsyncSession,
+    group_by: str,
+    since: Optional[datetime.datetime] = None,
+    limit: int = 20,
+) -> List[Dict[str, Any]]:
+    """
+    使用量を集計する（合計時間の長い順）
+
+    Args:
+        session (AsyncSession): DB セッション
+        group_by (str): 集計する列（GROUP_BY_COLUMNS のいずれか）
+        since (datetime, optional): この日時（UTC）以降の記録だけを集計する
+        limit (int, optional): 返す件数
+
+    Returns:
+        List[Dict[str, Any]]: 集計結果
+
+    Raises:
+        ValueError: group_by が集計できない列の場合
+    """
+    if group_by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"集計できない列です: {group_by}")
+    column = getattr(LLMUsage, group_by)
+    latency_total = func.sum(LLMUsage.latency_seconds)
+    stmt = (
+        select(
+            column,
+            func.count(),
+            func.sum(LLMUsage.prompt_tokens),
+            func.sum(LLMUsage.completion_tokens),
+            func.sum(LLMUsage.cost_usd),
+            latency_total,
+            func.max(LLMUsage.latency_seconds),
+            func.avg(LLMUsage.ttft_seconds),
+        )
+        .group_by(column)
+        .order_by(latency_total.desc())
+        .limit(limit)
+    )
+    if since is not None:
+        stmt = stmt.where(LLMUsage.created_at >= since)
+    result = await session.exec(stmt)
+    return [
+        {
+            group_by: key,
+            "calls": calls,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "cost_usd": cost,
+            "latency_seconds": round(total or 0.0, 3),
+            "max_latency_seconds": round(max_latency or 0.0, 3),
+            "avg_ttft_seconds": None if avg_ttft is None else round(avg_ttft, 3),
+        }
+        for (
+            key,
+            calls,
+            prompt_tokens,
+            completion_tokens,
+            cost,
+            total,
+            max_latency,
+            avg_ttft,
+        ) in result.all()
+    ]
@@ -1,15 +1,34 @@
+import html
+import re
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
-from sqlalchemy import Column, DateTime, String, create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    String,
+    column,
+    func,
+    literal_column,
+    select,
+    table,
+    text,
+    tuple_,
+)
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import declarative_base
+from sqlmodel import SQLModel
 
-Base = declarative_base()
+# User（SQLModel）と同じメタデータに登録し、database.py の共通エンジンで管理する
+Base = declarative_base(metadata=SQLModel.metadata)
 
 
 class MemoModel(Base):
     __tablename__ = "memos"
+    # ユーザーごとの一覧・ページングを作成日時順のインデックスで処理する
+    __table_args__ = (Index("ix_memos_username_created_at", "username", "created_at"),)
 
     id = Column(String, primary_key=True)
     content = Column(String, nullable=False)
@@ -17,49 +36,372 @@ class MemoModel(Base):
     username = Column(String, nullable=False)
 
 
-# データベースの初期化
-engine = create_engine("sqlite:///memos.db")
-Base.metadata.create_all(engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# ------------------------------------------------------------------
+# 全文検索（SQLite FTS5）
+#
+# memos_fts にはメモ本文から HTML タグを除いたプレーンテキストを登録します。
+# FTS の行は memos と同じ rowid で登録し、rowid で結合・更新します
+# （memo_id は UNINDEXED なので、memo_id で引くと FTS 全体を走査してしまう）。
+# trigram トークナイザを使うので日本語でも部分一致で検索でき、前方一致も含まれます。
+# ただし 3 文字未満の語は索引できないため、短い語は本文との部分一致で絞り込みます。
 
+FTS_MIN_TERM_LENGTH = 3
+# snippet() のハイライト区切り（HTML エスケープ後に <mark> へ置き換える）
+_MARK_OPEN = "\x02"
+_MARK_CLOSE = "\x03"
+
+# FTS5 が使えない SQLite の場合は False のまま（従来の LIKE 検索にフォールバック）
+fts_enabled = False
+
+# memos と rowid で結合するための FTS テーブル
+_memos_fts = table("memos_fts", column("rowid"), column("body"))
+_memos_rowid = literal_column("memos.rowid")
+
+# memo_id で memos の rowid を引く（memos.id の主キーのインデックスを使う）
+_MEMO_ROWID = "(SELECT rowid FROM memos WHERE id = :memo_id)"
+
+
+def memo_plain_text(content: str) -> str:
+    """メモ本文（HTML）からタグを除いたプレーンテキストを返す"""
+    return html.unescape(re.sub(r"<[^>]+>", "", content))
+
+
+def init_memo_search(engine) -> None:
+    """全文検索インデックスを作成し、メモと内容が合わなければ作り直す"""
+    global fts_enabled
 
-def get_db():
-    db = SessionLocal()
     try:
-        yield db
-    finally:
-        db.close()
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS memos_fts "
+                "USING fts5(body, memo_id UNINDEXED, tokenize='trigram')"
+            )
+            indexed = conn.exec_driver_sql("SELECT count(*) FROM memos_fts").scalar()
+            total = conn.exec_driver_sql("SELECT count(*) FROM memos").scalar()
+            # rowid がメモと対応しているか（旧形式の索引や VACUUM で rowid が
+            # 振り直された場合は対応しなくなる）
+            matched = conn.exec_driver_sql(
+                "SELECT count(*) FROM memos_fts "
+                "JOIN memos ON memos.rowid = memos_fts.rowid "
+                "AND memos.id = memos_fts.memo_id"
+            ).scalar()
+            if not indexed == total == matched:
+                conn.exec_driver_sql("DELETE FROM memos_fts")
+                rows = conn.exec_driver_sql(
+                    "SELECT rowid, id, content FROM memos"
+                ).fetchall()
+                if rows:
+                    conn.execute(
+                        text(
+                            "INSERT INTO memos_fts (rowid, body, memo_id) "
+                            "VALUES (:rowid, :body, :memo_id)"
+                        ),
+                        [
+                            {
+                                "rowid": rowid,
+                                "body": memo_plain_text(content),
+                                "memo_id": memo_id,
+                            }
+                            for rowid, memo_id, content in rows
+                        ],
+                    )
+    except OperationalError:
+        fts_enabled = False
+        return
+    fts_enabled = True
+
+
+def _split_search_terms(search_query: str) -> Tuple[List[str], List[str]]:
+    """検索語を FTS で引ける語（3 文字以上）と短い語に分ける"""
+    # "abc*" のような前方一致指定は trigram の部分一致に含まれるので * は取り除く
+    terms = [term.strip('"').rstrip("*") for term in search_query.split()]
+    terms = [term for term in terms if term]
+    long_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+    short_terms = [term for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+    return long_terms, short_terms
+
+
+def _fts_match_expression(terms: List[str]) -> str:
+    # 各語をフレーズとしてクォートし AND で結ぶ（FTS の演算子として解釈させない）
+    return " AND ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _short_term_clauses(short_terms: List[str]) -> Tuple[List[str], dict]:
+    # プレーンテキスト本文に対する部分一致（英字は大文字小文字を区別しない）
+    # memos_fts を rowid で memos に結合したクエリで使う
+    clauses = []
+    params = {}
+    for i, term in enumerate(short_terms):
+        clauses.append(f"instr(lower(memos_fts.body), lower(:short_term_{i})) > 0")
+        params[f"short_term_{i}"] = term
+    return clauses, params
+
 
+def _apply_search(stmt, search_query: Optional[str]):
+    """SELECT 文に検索条件を追加する"""
+    if not search_query:
+        return stmt
+    if not fts_enabled:
+        return stmt.where(MemoModel.content.ilike(f"%{search_query}%"))
 
-def create_memo(
-    db, memo_id: str, content: str, created_at: datetime, username: str
+    long_terms, short_terms = _split_search_terms(search_query)
+    if not (long_terms or short_terms):
+        return stmt
+    stmt = stmt.join_from(MemoModel, _memos_fts, _memos_fts.c.rowid == _memos_rowid)
+    if long_terms:
+        stmt = stmt.where(
+            text("memos_fts MATCH :fts_query").bindparams(
+                fts_query=_fts_match_expression(long_terms)
+            )
+        )
+    clauses, params = _short_term_clauses(short_terms)
+    if clauses:
+        stmt = stmt.where(text(" AND ".join(clauses)).bindparams(**params))
+    return stmt
+
+
+def _render_snippet(snippet: str) -> str:
+    """snippet() の結果をエスケープし、一致箇所を <mark> で囲む"""
+    escaped = html.escape(snippet)
+    return escaped.replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>")
+
+
+async def search_user_memos(
+    db: AsyncSession,
+    username: str,
+    search_query: str,
+    sort: str = "relevance",
+    limit: int = 10,
+    offset: int = 0,
+) -> List[MemoModel]:
+    """
+    全文検索インデックスでユーザーのメモを検索する
+
+    各メモには一致箇所をハイライトした snippet 属性（HTML）が付きます。
+
+    Args:
+        db (AsyncSession): DB セッション
+        username (str): ユーザー名
+        search_query (str): 検索クエリ（空白区切りで AND 検索）
+        sort (str, optional): "relevance"（関連度順）、"newest" または "oldest"
+        limit (int, optional): 取得件数
+        offset (int, optional): 読み飛ばす件数
+
+    Returns:
+        List[MemoModel]: 検索結果のメモ
+    """
+    long_terms, short_terms = _split_search_terms(search_query)
+    if not fts_enabled or not long_terms:
+        # 関連度を計算できないので作成日時順で返す
+        return await get_user_memos_page(
+            db,
+            username,
+            search_query,
+            sort="oldest" if sort == "oldest" else "newest",
+            limit=limit,
+            offset=offset,
+        )
+
+    if sort == "oldest":
+        order = "memos.created_at ASC, memos.id ASC"
+    elif sort == "newest":
+        order = "memos.created_at DESC, memos.id DESC"
+    else:
+        order = "bm25(memos_fts)"
+
+    clauses, params = _short_term_clauses(short_terms)
+    where = "".join(f" AND {clause}" for clause in clauses)
+    result = await db.execute(
+        text(
+            "SELECT memos.id, snippet(memos_fts, 0, :mark_open, :mark_close, '…', 24) "
+            "FROM memos_fts JOIN memos ON memos.rowid = memos_fts.rowid "
+            f"WHERE memos_fts MATCH :fts_query AND memos.username = :username{where} "
+            f"ORDER BY {order} LIMIT :limit OFFSET :offset"
+        ),
+        {
+            "mark_open": _MARK_OPEN,
+            "mark_close": _MARK_CLOSE,
+            "fts_query": _fts_match_expression(long_terms),
+            "username": username,
+            "limit": limit,
+            "offset": offset,
+            **params,
+        },
+    )
+    rows = result.fetchall()
+
+    found = await db.execute(
+        select(MemoModel).where(MemoModel.id.in_([memo_id for memo_id, _ in rows]))
+    )
+    memos = {memo.id: memo for memo in found.scalars()}
+    results = []
+    for memo_id, snippet in rows:
+        memo = memos.get(memo_id)
+        if memo is not None:
+            memo.snippet = _render_snippet(snippet)
+            results.append(memo)
+    return results
+
+
+async def create_memo(
+    db: AsyncSession, memo_id: str, content: str, created_at: datetime, username: str
 ) -> MemoModel:
     db_memo = MemoModel(
         id=memo_id, content=content, created_at=created_at, username=username
     )
     db.add(db_memo)
-    db.commit()
-    db.refresh(db_memo)
+    if fts_enabled:
+        # memos の行を先に書き込み、その rowid で登録する
+        await db.flush()
+        await db.execute(
+            text(
+                "INSERT INTO memos_fts (rowid, body, memo_id) "
+                f"VALUES ({_MEMO_ROWID}, :body, :memo_id)"
+            ),
+            {"body": memo_plain_text(content), "memo_id": memo_id},
+        )
+    await db.commit()
     return db_memo
 
 
-def get_user_memos(
-    db, username: str, search_query: Optional[str] = None
+def _user_memos_query(username: str, search_query: Optional[str] = None):
+    stmt = select(MemoModel).where(MemoModel.username == username)
+    return _apply_search(stmt, search_query)
+
+
+async def get_memo(db: AsyncSession, memo_id: str) -> Optional[MemoModel]:
+    return await db.get(MemoModel, memo_id)
+
+
+async def get_user_memos_by_ids(
+    db: AsyncSession, username: str, memo_ids: List[str]
+) -> List[MemoModel]:
+    """ユーザーのメモのうち指定した ID のものを作成日時順で取得する"""
+    result = await db.execute(
+        select(MemoModel)
+        .where(MemoModel.username == username, MemoModel.id.in_(memo_ids))
+        .order_by(MemoModel.created_at.asc(), MemoModel.id.asc())
+    )
+    return list(result.scalars())
+
+
+async def get_user_memos(
+    db: AsyncSession, username: str, search_query: Optional[str] = None
+) -> List[MemoModel]:
+    result = await db.execute(_user_memos_query(username, search_query))
+    return list(result.scalars())
+
+
+async def count_user_memos(
+    db: AsyncSession, username: str, search_query: Optional[str] = None
+) -> int:
+    """ユーザーのメモ件数を COUNT(*) で取得する"""
+    stmt = select(func.count(MemoModel.id)).where(MemoModel.username == username)
+    result = await db.execute(_apply_search(stmt, search_query))
+    return result.scalar_one()
+
+
+async def get_user_memos_page(
+    db: AsyncSession,
+    username: str,
+    search_query: Optional[str] = None,
+    sort: str = "newest",
+    limit: int = 10,
+    offset: int = 0,
 ) -> List[MemoModel]:
-    query = db.query(MemoModel).filter(MemoModel.username == username)
-    if search_query:
-        query = query.filter(MemoModel.content.ilike(f"%{search_query}%"))
-    return query.all()
+    """
+    ユーザーのメモを 1 ページ分だけ取得する（ORDER BY / LIMIT / OFFSET）
+
+    Args:
+        db (AsyncSession): DB セッション
+        username (str): ユーザー名
+        search_query (str, optional): 検索クエリ
+        sort (str, optional): "newest"（新しい順）または "oldest"（古い順）
+        limit (int, optional): 取得件数
+        offset (int, optional): 読み飛ばす件数
+
+    Returns:
+        List[MemoModel]: 1 ページ分のメモ
+    """
+    if sort == "oldest":
+        order = (MemoModel.created_at.asc(), MemoModel.id.asc())
+    else:
+        order = (MemoModel.created_at.desc(), MemoModel.id.desc())
+    result = await db.execute(
+        _user_memos_query(username, search_query)
+        .order_by(*order)
+        .limit(limit)
+        .offset(offset)
+    )
+    return list(result.scalars())
+
+
+async def get_user_memos_after(
+    db: AsyncSession,
+    username: str,
+    cursor: Optional[Tuple[datetime, str]] = None,
+    search_query: Optional[str] = None,
+    sort: str = "newest",
+    limit: int = 10,
+) -> List[MemoModel]:
+    """
+    カーソル（直前のページ末尾の (created_at, id)）以降のメモを取得する（キーセット方式）
+
+    OFFSET と違い、読み飛ばす件数に関係なくインデックスから直接続きを読み出せます。
+
+    Args:
+        db (AsyncSession): DB セッション
+        username (str): ユーザー名
+        cursor (Tuple[datetime, str], optional): 直前のページ末尾のメモの (created_at, id)。
+            None の場合は先頭から取得
+        search_query (str, optional): 検索クエリ
+        sort (str, optional): "newest"（新しい順）または "oldest"（古い順）
+        limit (int, optional): 取得件数
+
+    Returns:
+        List[MemoModel]: cursor 以降のメモ
+    """
+    stmt = _user_memos_query(username, search_query)
+    key = tuple_(MemoModel.created_at, MemoModel.id)
+    if sort == "oldest":
+        if cursor:
+            stmt = stmt.where(key > tuple_(*cursor))
+        stmt = stmt.order_by(MemoModel.created_at.asc(), MemoModel.id.asc())
+    else:
+        if cursor:
+            stmt = stmt.where(key < tuple_(*cursor))
+        stmt = stmt.order_by(MemoModel.created_at.desc(), MemoModel.id.desc())
+    result = await db.execute(stmt.limit(limit))
+    return list(result.scalars())
+
+
+async def update_memo_content(db: AsyncSession, memo_id: str, content: str) -> bool:
+    """メモ本文を書き換える（全文検索インデックスも更新）"""
+    memo = await db.get(MemoModel, memo_id)
+    if not memo:
+        return False
+    memo.content = content
+    if fts_enabled:
+        await db.execute(
+            text(f"UPDATE memos_fts SET body = :body WHERE rowid = {_MEMO_ROWID}"),
+            {"body": memo_plain_text(content), "memo_id": memo_id},
+        )
+    await db.commit()
+    return True
 
 
-def delete_memo(db, memo_id: str, username: str) -> bool:
-    memo = (
-        db.query(MemoModel)
-        .filter(MemoModel.id == memo_id, MemoModel.username == username)
-        .first()
+async def delete_memo(db: AsyncSession, memo_id: str, username: str) -> bool:
+    result = await db.execute(
+        select(MemoModel).where(MemoModel.id == memo_id, MemoModel.username == username)
     )
+    memo = result.scalars().first()
     if memo:
-        db.delete(memo)
-        db.commit()
+        if fts_enabled:
+            await db.execute(
+                text(f"DELETE FROM memos_fts WHERE rowid = {_MEMO_ROWID}"),
+                {"memo_id": memo_id},
+            )
+        await db.delete(memo)
+        await db.commit()
         return True
     return False
@@ -2,7 +2,8 @@
 import datetime
 from typing import Optional
 
-from sqlmodel import Field, SQLModel
+from sqlmodel import Field, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 
 class User(SQLModel, table=True):
@@ -12,3 +13,28 @@ class User(SQLModel, table=True):
     created_at: datetime.datetime = Field(
         default_factory=datetime.datetime.utcnow, nullable=False
     )
+
+
+async def get_user_by_username(session: AsyncSession, username: str) -> Optional[User]:
+    """ユーザー名でユーザーを取得する（存在しない場合は None）"""
+    result = await session.exec(select(User).where(User.username == username))
+    return result.first()
+
+
+async def create_user(
+    session: AsyncSession, username: str, hashed_password: str
+) -> User:
+    """ユーザーを登録する（ID は commit 時に採番される）"""
+    user = User(username=username, hashed_password=hashed_password)
+    session.add(user)
+    await session.commit()
+    return user
+
+
+async def update_user_password_hash(
+    session: AsyncSession, user: User, hashed_password: str
+) -> None:
+    """保存されているパスワードハッシュを置き換える（コスト変更時の作り直し用）"""
+    user.hashed_password = hashed_password
+    session.add(user)
+    await session.commit()
@@ -5,17 +5,24 @@ from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, Form, HTTPException, Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from passlib.context import CryptContext
-from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from database import get_session
-from models.user import User
+from database import get_async_session
+from models.user import (
+    User,
+    create_user,
+    get_user_by_username,
+    update_user_password_hash,
+)
+from utils.passwords import PasswordPoolBusy, password_hasher
 
 router = APIRouter(tags=["auth"])
 
 templates = Jinja2Templates(directory="templates")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# パスワード処理が混み合っているときにクライアントへ再試行を促す秒数
+BUSY_RETRY_AFTER = "2"
+BUSY_ERROR = "ただいま混み合っています。しばらくしてから再度お試しください。"
 
 # 環境変数の読み込み
 load_dotenv()
@@ -52,7 +59,7 @@ async def signup_post(
     username: str = Form(...),
     password: str = Form(...),
     admin_password: str = Form(...),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """ユーザー登録処理（重複チェック＋ハッシュ化保存）"""
 
@@ -63,16 +70,22 @@ async def signup_post(
             "signup.html", {"request": request, "error": error}, status_code=400
         )
 
-    if session.exec(select(User).where(User.username == username)).first():
+    if await get_user_by_username(session, username):
         error = "そのユーザー名は既に使われています。"
         return templates.TemplateResponse(
             "signup.html", {"request": request, "error": error}, status_code=400
         )
 
-    hashed_pw = pwd_context.hash(password)
-    user = User(username=username, hashed_password=hashed_pw)
-    session.add(user)
-    session.commit()
+    try:
+        hashed_pw = await password_hasher.hash(password)
+    except PasswordPoolBusy:
+        return templates.TemplateResponse(
+            "signup.html",
+            {"request": request, "error": BUSY_ERROR},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": BUSY_RETRY_AFTER},
+        )
+    user = await create_user(session, username, hashed_pw)
 
     # サインアップ成功時に自動的にログイン状態にする
     request.session["user_id"] = user.id
@@ -102,14 +115,28 @@ async def login_post(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """認証してトップへリダイレクト、失敗なら同ページにエラー"""
 
-    user: User | None = session.exec(
-        select(User).where(User.username == username)
-    ).first()
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    user: User | None = await get_user_by_username(session, username)
+    valid = False
+    if user:
+        try:
+            valid, new_hash = await password_hasher.verify_and_update(
+                password, user.hashed_password
+            )
+        except PasswordPoolBusy:
+            return templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": BUSY_ERROR},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": BUSY_RETRY_AFTER},
+            )
+        # コスト設定が変わった古いハッシュはログイン成功時に作り直す
+        if valid and new_hash:
+            await update_user_password_hash(session, user, new_hash)
+    if not valid:
         error = "ユーザー名またはパスワードが違います。"
         return templates.TemplateResponse(
             "login.html", {"request": request, "error": error}, status_code=400
@@ -131,6 +158,25 @@ async def logout(request: Request):
 
 
 def login_required_yxfhy(request: Request) -> bool:
-    if request.session.get("username") == "yxfhy":
+    """
+    管理者ユーザー（yxfhy）でログインしているかを確かめる（Depends 用）
+
+    Args:
+        request (Request): リクエスト
+
+    Returns:
+        bool: 管理者ユーザーなら True
+
+    Raises:
+        HTTPException: 未ログインなら 401、ほかのユーザーなら 403
+    """
+    username = request.session.get("username")
+    if not username:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized"
+        )
+    if username == "yxfhy":
         return True
-    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail="権限がありません"
+    )
@@ -1,14 +1,16 @@
 """チャットルーター"""
 
-import json
 import logging
+import uuid
 
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
-from utils.utils import SYSTEM_PROMPT, ChatBot, create_github_file
+from utils.chat_store import create_conversation_store
+from utils.streaming import coalesce_stream, sse_event
+from utils.utils import ChatBot, create_github_file
 
 # アプリ起動時に一度だけ設定
 logging.basicConfig(
@@ -18,8 +20,8 @@ logging.basicConfig(
 router = APIRouter(prefix="/chat", tags=["chat"])
 templates = Jinja2Templates(directory="templates")
 
-# グローバルなChatBotインスタンス
-chatbots = {}
+# 会話履歴はサーバー側のストアに保持し、Cookie には会話 ID だけを入れる
+conversation_store = create_conversation_store()
 
 
 class Message(BaseModel):
@@ -30,23 +32,28 @@ class PushData(BaseModel):
     markdownBuffer: str
 
 
+def get_conversation_id(request: Request) -> str:
+    """セッションから会話 ID を取得（なければ新規発行）"""
+    # 旧形式（Cookie に履歴を直接保存）の名残を削除して Cookie を小さくする
+    request.session.pop("chat_messages", None)
+    conversation_id = request.session.get("conversation_id")
+    if not conversation_id:
+        conversation_id = uuid.uuid4().hex
+        request.session["conversation_id"] = conversation_id
+    return conversation_id
+
+
+async def load_chatbot(conversation_id: str) -> ChatBot:
+    """ストアの履歴を引き継いだ ChatBot を生成"""
+    messages = await conversation_store.load(conversation_id)
+    return ChatBot(temperature=0.1, messages=messages)
+
+
 @router.get("/", response_class=HTMLResponse)
 async def chat_page(request: Request):
     """チャットページを表示"""
     username = request.session.get("username", "ゲスト")
-    # ChatBotインスタンスをユーザーごとに生成
-    if username not in chatbots:
-        chatbots[username] = ChatBot(temperature=0.1)
-        # ─────────────────────────────────────────────
-        logging.warning(
-            "⚠️ ChatBot new: 毎回インスタンス再生成中\n"
-            "   • モデル接続・メモリを都度確保します（負荷↑）\n"
-            "   • 同一ユーザーで別ウィンドウで開いたチャットも同一のインスタンスで処理されます！！！\n"
-            "   • 履歴は Cookie セッション依存 → サイズ超過で消失の恐れ\n"
-            "   • 多人数運用や長期保存が必要なら Redis / DB へ移行推奨\n"
-            "   • メモリリーク防止の GC or TTL 設計を忘れずに"
-        )
-        # ─────────────────────────────────────────────
+    get_conversation_id(request)
     return templates.TemplateResponse(
         "chat.html", {"request": request, "username": username}
     )
@@ -56,24 +63,10 @@ async def chat_page(request: Request):
 async def send_message(message: Message, request: Request):
     """メッセージを送信してAIの応答を取得"""
     try:
-        username = request.session.get("username", "ゲスト")
-        default_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        messages = request.session.get("chat_messages", default_messages)
-        if username not in chatbots:
-            chatbots[username] = ChatBot(temperature=0.1)
-
-            # ─────────────────────────────────────────────
-            logging.warning(
-                "⚠️ ChatBot new: 毎回インスタンス再生成中\n"
-                "   • モデル接続・メモリを都度確保します（負荷↑）\n"
-                "   • 履歴は Cookie セッション依存 → サイズ超過で消失の恐れ\n"
-                "   • 多人数運用や長期保存が必要なら Redis / DB へ移行推奨\n"
-                "   • メモリリーク防止の GC or TTL 設計を忘れずに"
-            )
-            # ─────────────────────────────────────────────
-        chatbots[username].messages = messages
-        response = chatbots[username].get_ai_messages(message.message)
-        request.session["chat_messages"] = chatbots[username].messages
+        conversation_id = get_conversation_id(request)
+        chatbot = await load_chatbot(conversation_id)
+        response = await chatbot.get_ai_messages(message.message)
+        await conversation_store.save(conversation_id, chatbot.messages)
         return {"response": response}
     except Exception as e:
         return {"response": f"エラーが発生しました: {str(e)}"}
@@ -83,20 +76,20 @@ async def send_message(message: Message, request: Request):
 async def send_message_stream(message: Message, request: Request):
     """メッセージを送信してAIの応答をストリーミング形式で取得"""
     try:
-        username = request.session.get("username", "ゲスト")
-        default_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        if username not in chatbots:
-            chatbots[username] = ChatBot(temperature=0.1)
+        # Cookie はレスポンスヘッダーで送られるので、ストリーム開始前に会話 ID を確定させる
+        conversation_id = get_conversation_id(request)
+        chatbot = await load_chatbot(conversation_id)
 
         async def generate():
             try:
-                async for chunk in chatbots[username].get_ai_messages_stream(
-                    message.message
+                # 細かいトークンはまとめて 1 フレームで送る。
+                # クライアントが切断するとここがキャンセルされ、上流も中断される
+                async for chunk in coalesce_stream(
+                    chatbot.get_ai_messages_stream(message.message)
                 ):
-                    data = {"chunk": chunk}
-                    yield f"data: {json.dumps(data)}\n\n"
+                    yield sse_event({"chunk": chunk})
             finally:
-                request.session["chat_messages"] = chatbots[username].messages
+                await conversation_store.save(conversation_id, chatbot.messages)
 
         return StreamingResponse(generate(), media_type="text/event-stream")
     except Exception as e:
@@ -109,10 +102,8 @@ async def send_message_stream(message: Message, request: Request):
 @router.post("/clear")
 async def clear_chat(request: Request):
     """チャット履歴をクリア"""
-    username = request.session.get("username", "ゲスト")
-    if username in chatbots:
-        chatbots[username].clear_messages()
-    request.session["chat_messages"] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    conversation_id = get_conversation_id(request)
+    await conversation_store.delete(conversation_id)
     return {"status": "success"}
 
 
@@ -126,7 +117,7 @@ async def push_to_github(request: Request, data: PushData):
 
     try:
         # GitHubにプッシュ
-        result = create_github_file("yxfhy", "memo", data.markdownBuffer)
+        result = await create_github_file("yxfhy", "memo", data.markdownBuffer)
         return {"status": "success", "url": result["content"]["html_url"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
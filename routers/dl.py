@@ -1,92 +1,309 @@
 import asyncio
-from typing import Dict, List
-from urllib.parse import urljoin
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Dict, List, Optional
 
-import aiohttp
-from bs4 import BeautifulSoup
-from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
+from utils.listing_parser import ListingRow, parse_listing
+from utils.metrics import Gauge
+from utils.scrape_cache import ListingCache, shared_scraper
+from utils.scraper import PageFetcher
+from utils.shared_state import get_shared_state
+
+try:
+    import orjson
+except ImportError:  # orjson はオプション（無ければ標準の json を使う）
+    orjson = None
+
 router = APIRouter(prefix="/dl", tags=["download"])
 templates = Jinja2Templates(directory="templates")
 
 
 class Config:
-    MAX_PAGES = 1
+    MAX_PAGES = int(os.getenv("DL_MAX_PAGES", "1"))
     CHUNK_SIZE = 10  # 一度に処理するデータ量を制限
+    CONCURRENCY = int(os.getenv("DL_CONCURRENCY", "4"))  # 同時に取得するページ数
+    HOST_MIN_INTERVAL = 0.2  # 同じホストへのリクエスト間隔（秒）
+    RETRIES = 2
+    PARSER_WORKERS = 2  # HTML を解析するスレッド数
+    SEND_QUEUE_SIZE = 64  # 接続ごとに溜めておける送信メッセージ数
+    SEND_TIMEOUT = 10.0  # 送信キューの空きを待つ最大秒数（超えたら切断）
+    CACHE_TTL = float(os.getenv("DL_CACHE_TTL", "60"))  # 結果を使い回す秒数
+    # TTL を過ぎた結果を（裏で取得し直しながら）返してよい秒数
+    CACHE_STALE_TTL = float(os.getenv("DL_CACHE_STALE_TTL", "600"))
+    # 取得先（ベンチマークではローカルの偽サーバーに差し替える）
+    BASE_URL = os.getenv("DL_BASE_URL", "https://sukebei.nyaa.si")
+    SEARCH_PARAMS = "?f=2&c=2_2&q=-FC2"
+
 
+# HTML の解析は CPU を使うので専用のスレッドプールで実行する
+parser_executor = ThreadPoolExecutor(
+    max_workers=Config.PARSER_WORKERS, thread_name_prefix="dl-parser"
+)
 
-async def scrape_sukebei(
-    session: aiohttp.ClientSession, url: str, params: dict | None = None
-) -> List[Dict]:
+# 全接続で共有するページ取得器（app.py の shutdown でセッションを閉じる）
+page_fetcher = PageFetcher(
+    concurrency=Config.CONCURRENCY,
+    min_interval=Config.HOST_MIN_INTERVAL,
+    retries=Config.RETRIES,
+)
+
+
+def parse_sukebei(html: str, url: str) -> List[ListingRow]:
+    """
+    Sukebei.nyaa.si の検索結果ページの HTML から行データを取り出します。
+    メモリ効率を考慮して、__slots__ を使った ListingRow のリストを返します。
     """
-    Sukebei.nyaa.si の検索結果ページからデータを取得します。
-    メモリ効率を考慮して、pandasの代わりにリストを使用します。
+    return parse_listing(html, url)
+
+
+async def parse_sukebei_async(html: str, url: str) -> List[ListingRow]:
+    """ページの解析をイベントループの外（解析用スレッドプール）で実行します。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(parser_executor, parse_sukebei, html, url)
+
+
+def _encode_default(obj):
+    # 行は列名を除いた値の配列として送る（列名は接続ごとに schema で 1 回だけ送る）
+    if isinstance(obj, ListingRow):
+        return obj.to_list()
+    raise TypeError(f"JSON に変換できない型です: {type(obj).__name__}")
+
+
+def encode_message(message: Dict) -> str:
+    """送信メッセージを JSON 文字列にする（orjson があれば orjson を使う）"""
+    if orjson is not None:
+        return orjson.dumps(
+            message, default=_encode_default, option=orjson.OPT_PASSTHROUGH_DATACLASS
+        ).decode()
+    return json.dumps(
+        message, default=_encode_default, ensure_ascii=False, separators=(",", ":")
+    )
+
+
+class SessionClosed(Exception):
+    """送信先のセッションが閉じている場合の例外"""
+
+
+# 送信ループに終了を伝える目印
+_CLOSE = object()
+
+
+class ScrapeSession:
+    """
+    1 つの WebSocket 接続に対応するスクレイピングのセッション
+
+    送信は接続ごとの有界キューに積み、専用タスクが順に送り出します。
+    遅いクライアントがいても、他の接続や共有のスクレイピング処理が待たされるのは
+    キューが一杯になったときの最大 send_timeout 秒だけです。
+
+    遅いクライアントへの対応:
+        - 進捗などの捨ててよいメッセージは、キューが一杯なら破棄する（send_nowait）
+        - 行データはキューに空きが出るまで最大 send_timeout 秒待ち、
+          それでも空かなければ接続を閉じる（send）
     """
-    headers = {"User-Agent": "Mozilla/5.0"}
-    async with session.get(url, params=params, headers=headers, timeout=30) as res:
-        res.raise_for_status()
-        html = await res.text()
-
-    soup = BeautifulSoup(html, "html.parser")
-    rows = soup.select("table tbody tr")
-
-    records = []
-    for r in rows:
-        tds = r.find_all("td")
-        if len(tds) < 7:
-            continue
-
-        name = tds[1].get_text(strip=True)
-        magnet_tag = tds[2].find("a", title="Magnet link")
-        link = (
-            magnet_tag["href"]
-            if magnet_tag
-            else (
-                urljoin(url, tds[2].find("a", href=True)["href"])
-                if tds[2].find("a", href=True)
-                else ""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, send_timeout: float):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.closed = asyncio.Event()
+        self.status = "running"  # running / failed / closed
+        self.dropped = 0
+        self._tasks: List[asyncio.Task] = []
+        # クライアント側から切断されたか（その場合は close を送らない）
+        self._disconnected = False
+        self._close_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._send_loop()),
+            asyncio.create_task(self._receive_loop()),
+        ]
+
+    async def _send_loop(self) -> None:
+        try:
+            while True:
+                message = await self.queue.get()
+                if message is _CLOSE:
+                    break
+                await self.websocket.send_text(encode_message(message))
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            self._disconnected = True  # 送信中に切断された
+        finally:
+            self.closed.set()
+
+    async def _receive_loop(self) -> None:
+        # クライアントからは何も送られてこないが、切断を検知するために受信を待つ
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            pass
+        self._disconnected = True
+        self.closed.set()
+
+    def send_nowait(self, message: Dict) -> bool:
+        """捨ててよいメッセージを送る（キューが一杯・接続が閉じている場合は破棄）"""
+        if self.closed.is_set():
+            return False
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def send(self, message: Dict) -> None:
+        """
+        メッセージを送る（キューの空きを最大 send_timeout 秒待つ）
+
+        Raises:
+            SessionClosed: 接続が閉じている、または遅すぎて接続を閉じた場合
+        """
+        if self.closed.is_set():
+            raise SessionClosed()
+        try:
+            await asyncio.wait_for(self.queue.put(message), self.send_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"dl: 受信が遅いクライアントとの接続を閉じます ({self.id})")
+            await self.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            raise SessionClosed()
+
+    async def run(self, job: Awaitable[None]) -> None:
+        """
+        ジョブを実行する（途中でクライアントが切断したらジョブをキャンセルする）
+
+        Raises:
+            SessionClosed: ジョブの完了前に接続が閉じた場合
+        """
+        job_task = asyncio.ensure_future(job)
+        closed_task = asyncio.create_task(self.closed.wait())
+        try:
+            await asyncio.wait(
+                {job_task, closed_task}, return_when=asyncio.FIRST_COMPLETED
             )
-        )
+        finally:
+            closed_task.cancel()
+            if not job_task.done():
+                job_task.cancel()
+                await asyncio.gather(job_task, return_exceptions=True)
+                raise SessionClosed()
+        job_task.result()
+
+    async def flush(self, timeout: float) -> None:
+        """キューに残っているメッセージを送り切るまで待つ"""
+        if self.closed.is_set():
+            return
+        try:
+            await asyncio.wait_for(self.queue.put(_CLOSE), timeout)
+            await asyncio.wait_for(asyncio.shield(self._tasks[0]), timeout)
+        except asyncio.TimeoutError:
+            pass
 
-        record = {
-            "Name": name,
-            "Link": link,
-            "Size": tds[3].get_text(strip=True),
-            "Date": tds[4].get_text(strip=True),
-            "Seeders": int(tds[5].get_text(strip=True)),
-            "Leechers": int(tds[6].get_text(strip=True)),
-            "Google_Search_URL": f"https://www.google.com/search?q={name}",
-        }
-        records.append(record)
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        """接続を閉じる（何度呼んでもよい。呼び出し元がキャンセルされても閉じ切る）"""
+        if self._close_task is None:
+            self._close_task = asyncio.create_task(self._close(code))
+        await asyncio.shield(self._close_task)
 
-    return records
+    async def _close(self, code: int) -> None:
+        if self.status == "running":
+            self.status = "closed"
+        self.closed.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if not self._disconnected:
+            try:
+                await self.websocket.close(code=code)
+            except (RuntimeError, OSError):
+                pass  # すでに閉じている
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    """接続中のスクレイピングセッションを管理するクラス"""
 
-    async def connect(self, websocket: WebSocket):
+    def __init__(
+        self,
+        queue_size: int = Config.SEND_QUEUE_SIZE,
+        send_timeout: float = Config.SEND_TIMEOUT,
+    ):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.sessions: Dict[str, ScrapeSession] = {}
+
+    async def connect(self, websocket: WebSocket) -> ScrapeSession:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        session = ScrapeSession(websocket, self.queue_size, self.send_timeout)
+        session.start()
+        self.sessions[session.id] = session
+        return session
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    async def disconnect(self, session: ScrapeSession) -> None:
+        """セッションを閉じて登録を外す（何度呼んでもよい）"""
+        self.sessions.pop(session.id, None)
+        await session.close()
 
-    async def send_progress(self, current: int, total: int):
-        for connection in self.active_connections:
-            await connection.send_json(
-                {"type": "progress", "current": current, "total": total}
-            )
 
-    async def send_complete(self, data: List[Dict]):
-        for connection in self.active_connections:
-            await connection.send_json({"type": "complete", "data": data})
+manager = ConnectionManager()
+Gauge(
+    "dl_sessions",
+    "/dl のスクレイピングセッション数",
+    callback=lambda: len(manager.sessions),
+)
 
 
-manager = ConnectionManager()
+async def scrape_listing(search_params: str) -> AsyncIterator[Dict]:
+    """
+    全ページを取得し、取得できたページから順に送信用のメッセージを返す
+
+    Args:
+        search_params (str): 検索条件のクエリ文字列（キャッシュのキー）
+
+    Yields:
+        Dict: rows / page_error / progress のメッセージ
+    """
+    urls = [
+        (page_id, f"{Config.BASE_URL}/{search_params}&p={page_id}")
+        for page_id in range(1, Config.MAX_PAGES + 1)
+    ]
+    pages_done = 0
+    async for page_id, url, html, error in page_fetcher.fetch_all(urls):
+        pages_done += 1
+        if error is not None:
+            yield {"type": "page_error", "page": page_id, "message": str(error)}
+        else:
+            records = await parse_sukebei_async(html, url)
+            for i in range(0, len(records), Config.CHUNK_SIZE):
+                chunk = records[i : i + Config.CHUNK_SIZE]
+                yield {"type": "rows", "page": page_id, "data": chunk}
+        yield {"type": "progress", "current": pages_done, "total": Config.MAX_PAGES}
+
+
+# 同じ検索条件の結果は全接続で共有する（app.py の shutdown で停止）。
+# 取得結果は共有ストアにも置き、別のワーカープロセスでも使い回す
+listing_cache = ListingCache(
+    shared_scraper(
+        scrape_listing,
+        get_shared_state(),
+        ttl=Config.CACHE_TTL,
+        encode_row=ListingRow.to_list,
+        decode_row=lambda values: ListingRow(*values),
+    ),
+    ttl=Config.CACHE_TTL,
+    stale_ttl=Config.CACHE_STALE_TTL,
+    chunk_size=Config.CHUNK_SIZE,
+)
 
 
 @router.get("/", response_class=HTMLResponse)
@@ -96,29 +313,16 @@ async def get_dl_page(request: Request):
 
 @router.websocket("/ws/dl")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    session = await manager.connect(websocket)
     try:
-        async with aiohttp.ClientSession() as session:
-            all_records = []
-            for page_id in range(1, Config.MAX_PAGES + 1):
-                base_url = "https://sukebei.nyaa.si"
-                params = "?f=2&c=2_2&q=-FC2"
-                target_url = f"{base_url}/{params}&p={page_id}"
-
-                records = await scrape_sukebei(session, target_url)
-                all_records.extend(records)
-
-                await manager.send_progress(page_id, Config.MAX_PAGES)
-                await asyncio.sleep(0.1)
-
-            # データを分割して送信
-            for i in range(0, len(all_records), Config.CHUNK_SIZE):
-                chunk = all_records[i : i + Config.CHUNK_SIZE]
-                await manager.send_complete(chunk)
-                await asyncio.sleep(0.1)  # クライアントの処理を待つ
-
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        await session.send({"type": "schema", "fields": ListingRow.FIELDS})
+        # キャッシュ済みの行をすぐに送り、以降は一覧が変わったときだけ差分を送る
+        await session.run(listing_cache.watch(Config.SEARCH_PARAMS, session))
+    except SessionClosed:
+        pass  # クライアントが切断した
     except Exception as e:
-        await websocket.send_json({"type": "error", "message": str(e)})
-        manager.disconnect(websocket)
+        session.status = "failed"
+        session.send_nowait({"type": "error", "message": str(e)})
+        await session.flush(Config.SEND_TIMEOUT)
+    finally:
+        await manager.disconnect(session)
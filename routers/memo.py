@@ -1,40 +1,74 @@
+import asyncio
 import re
 import uuid
 from datetime import datetime, timedelta, timezone
 from math import ceil
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-
-from models.memo import MemoModel, create_memo, delete_memo, get_db, get_user_memos
-from utils.utils import (
-    create_github_file,
-    delete_github_file,
-    get_github_repo_contents,
-    get_url_title,
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, get_async_session
+from models.memo import (
+    MemoModel,
+    count_user_memos,
+    create_memo,
+    delete_memo,
+    get_memo,
+    get_user_memos,
+    get_user_memos_by_ids,
+    get_user_memos_page,
+    search_user_memos,
+    update_memo_content,
 )
+from utils.github import get_github_client
+from utils.jobs import Job, JobManager
+from utils.link_titles import create_link_title_worker, render_links
+from utils.shared_state import get_shared_state
+from utils.streaming import sse_event
+from utils.utils import create_github_file
+
+# 一括プッシュで 1 コミットにまとめるメモの上限
+PUSH_BATCH_MAX_MEMOS = 1000
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 
 def convert_urls_to_links(text: str) -> str:
-    """テキスト内のURLをHTMLリンクに変換する"""
-    url_pattern = r'https?://[^\s<>"]+|www\.[^\s<>"]+'
-
-    def replace_url(match):
-        url = match.group(0)
-        title = get_url_title(url)
-        display_text = f"{title} ({url})" if title else url
-        return (
-            f'<a href="{url}" target="_blank" '
-            f'rel="noopener noreferrer">{display_text}</a>'
-        )
+    """テキスト内のURLをHTMLリンクに変換する（タイトルは後からワーカーが反映）"""
+    return render_links(text)
+
+
+async def _update_memo_content(memo_id: str, content: str) -> None:
+    async with AsyncSessionLocal() as db:
+        await update_memo_content(db, memo_id, content)
+
+
+# リンクタイトルを取得してメモ本文に反映するバックグラウンドワーカー
+# （app.py の startup / shutdown で開始・停止する）
+link_title_worker = create_link_title_worker(_update_memo_content)
+
+# GitHub への一括操作などのバックグラウンドジョブ（進捗はどのワーカーからも参照できる）
+memo_jobs = JobManager(get_shared_state())
+
+
+def memo_to_markdown(memo: MemoModel) -> str:
+    """メモをマークダウン形式に変換する"""
+    # HTMLタグを削除してプレーンテキストに変換
+    content = re.sub(r"<[^>]+>", "", memo.content)
+    # 作成日時を追加
+    created_at = memo.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    return f"# メモ\n\n{content}\n\n作成日時: {created_at}"
+
 
-    return re.sub(url_pattern, replace_url, text)
+def memo_github_path(memo: MemoModel) -> str:
+    """一括プッシュ時のファイル名（同じメモは同じファイルに上書きされる）"""
+    timestamp = memo.created_at.strftime("%Y_%m_%d_%H_%M_%S")
+    return f"memo_{timestamp}_{memo.id[:8]}.md"
 
 
 # メモのデータモデル（API用）
@@ -55,7 +89,7 @@ async def memo_page(
     limit: int = 10,  # デフォルトは10件
     page: int = 1,  # デフォルトは1ページ目
     search: str = None,  # 検索クエリ
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_session),
 ):
     # セッションからユーザー名を取得
     username = request.session.get("username")
@@ -70,27 +104,27 @@ async def memo_page(
     if page < 1:
         page = 1
 
-    # ユーザーのメモを取得（検索クエリがある場合は検索）
-    user_memos = get_user_memos(db, username, search)
-
-    # 並び替え
-    if sort == "oldest":
-        user_memos.sort(key=lambda x: x.created_at)
-    else:  # newest
-        user_memos.sort(key=lambda x: x.created_at, reverse=True)
+    # 件数は COUNT(*) で取得（検索クエリがある場合は検索結果の件数）
+    total_memos = await count_user_memos(db, username, search)
 
     # 総ページ数を計算
-    total_memos = len(user_memos)
     total_pages = ceil(total_memos / limit)
 
     # ページ番号の制限（最大ページ数以下）
     if page > total_pages and total_pages > 0:
         page = total_pages
 
-    # 表示するメモを取得
-    start_idx = (page - 1) * limit
-    end_idx = start_idx + limit
-    user_memos = user_memos[start_idx:end_idx]
+    # 表示するページのメモだけを並び替え済みで取得
+    # （検索時は全文検索インデックスを使い、関連度順とハイライト付き抜粋に対応）
+    offset = (page - 1) * limit
+    if search:
+        user_memos = await search_user_memos(
+            db, username, search, sort=sort, limit=limit, offset=offset
+        )
+    else:
+        user_memos = await get_user_memos_page(
+            db, username, sort=sort, limit=limit, offset=offset
+        )
 
     return templates.TemplateResponse(
         "memo.html",
@@ -109,7 +143,9 @@ async def memo_page(
 
 @router.post("/memo")
 async def create_memo_route(
-    request: Request, content: str = Form(...), db: Session = Depends(get_db)
+    request: Request,
+    content: str = Form(...),
+    db: AsyncSession = Depends(get_async_session),
 ):
     username = request.session.get("username")
     if not username:
@@ -119,22 +155,21 @@ async def create_memo_route(
     now = datetime.now(jst)
     memo_id = str(uuid.uuid4())
 
-    # URLをリンクに変換
-    content = convert_urls_to_links(content)
-
-    create_memo(db, memo_id, content, now, username)
+    # URLをリンクに変換して即座に保存し、タイトルはバックグラウンドで取得する
+    await create_memo(db, memo_id, convert_urls_to_links(content), now, username)
+    link_title_worker.enqueue(memo_id, content)
     return RedirectResponse(url="/memo", status_code=303)
 
 
 @router.post("/memo/delete/{memo_id}")
 async def delete_memo_route(
-    request: Request, memo_id: str, db: Session = Depends(get_db)
+    request: Request, memo_id: str, db: AsyncSession = Depends(get_async_session)
 ):
     username = request.session.get("username")
     if not username:
         raise HTTPException(status_code=401, detail="ログインが必要です")
 
-    if not delete_memo(db, memo_id, username):
+    if not await delete_memo(db, memo_id, username):
         raise HTTPException(
             status_code=404, detail="メモが見つからないか、削除権限がありません"
         )
@@ -144,52 +179,142 @@ async def delete_memo_route(
 
 @router.post("/memo/push/{memo_id}")
 async def push_memo_to_github(
-    request: Request, memo_id: str, db: Session = Depends(get_db)
+    request: Request, memo_id: str, db: AsyncSession = Depends(get_async_session)
 ):
     username = request.session.get("username")
     if not username:
         raise HTTPException(status_code=401, detail="ログインが必要です")
 
     # メモを取得
-    memo = db.query(MemoModel).filter(MemoModel.id == memo_id).first()
+    memo = await get_memo(db, memo_id)
     if not memo:
         raise HTTPException(status_code=404, detail="メモが見つかりません")
 
-    # メモの内容をマークダウン形式に変換
-    content = memo.content
-    # HTMLタグを削除してプレーンテキストに変換
-    content = re.sub(r"<[^>]+>", "", content)
-    # 作成日時を追加
-    created_at = memo.created_at.strftime("%Y-%m-%d %H:%M:%S")
-    content = f"# メモ\n\n{content}\n\n作成日時: {created_at}"
+    content = memo_to_markdown(memo)
 
     try:
         # GitHubにプッシュ
-        result = create_github_file("yxfhy", "memo", content)
+        result = await create_github_file("yxfhy", "memo", content)
         return {"status": "success", "url": result["content"]["html_url"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/memo/delete-all")
+class PushBatchRequest(BaseModel):
+    # 指定しない場合は search に一致するメモ（search もなければ全メモ）が対象
+    memo_ids: Optional[List[str]] = None
+    search: Optional[str] = None
+
+
+@router.post("/memo/push-batch")
+async def push_memos_to_github(
+    request: Request,
+    data: PushBatchRequest,
+    db: AsyncSession = Depends(get_async_session),
+):
+    """複数のメモを 1 コミットで GitHub にプッシュし、進捗を SSE で返す"""
+    username = request.session.get("username")
+    if not username:
+        raise HTTPException(status_code=401, detail="ログインが必要です")
+
+    if data.memo_ids is not None:
+        memos = await get_user_memos_by_ids(db, username, data.memo_ids)
+    else:
+        memos = await get_user_memos(db, username, data.search)
+    if not memos:
+        raise HTTPException(status_code=404, detail="メモが見つかりません")
+    if len(memos) > PUSH_BATCH_MAX_MEMOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一度にプッシュできるメモは {PUSH_BATCH_MAX_MEMOS} 件までです",
+        )
+    files = {memo_github_path(memo): memo_to_markdown(memo) for memo in memos}
+    try:
+        client = get_github_client()
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def generate():
+        progress: asyncio.Queue = asyncio.Queue()
+
+        def on_progress(stage: str, done: int, total: int) -> None:
+            progress.put_nowait({"stage": stage, "done": done, "total": total})
+
+        task = asyncio.create_task(
+            client.commit_files(
+                "yxfhy",
+                "memo",
+                files,
+                message=f"Add {len(files)} memo files",
+                on_progress=on_progress,
+            )
+        )
+        getter = None
+        try:
+            yield sse_event({"stage": "loaded", "done": 0, "total": len(files)})
+            # コミットが終わるまで進捗を中継する
+            while not task.done() or not progress.empty():
+                getter = asyncio.ensure_future(progress.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield sse_event(getter.result())
+                else:
+                    getter.cancel()
+                getter = None
+
+            try:
+                commit = task.result()
+            except Exception as e:
+                yield sse_event({"stage": "error", "detail": str(e)})
+                return
+            yield sse_event(
+                {
+                    "stage": "complete",
+                    "count": len(files),
+                    "url": f"https://github.com/yxfhy/memo/commit/{commit}",
+                }
+            )
+        finally:
+            # クライアントが切断した場合はコミット処理も止める
+            if getter is not None:
+                getter.cancel()
+            task.cancel()
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@router.post("/memo/delete-all", status_code=202)
 async def delete_all_memos(request: Request):
-    """yxfhy/memoリポジトリの全メモを削除する"""
+    """yxfhy/memoリポジトリの全メモを削除するジョブを開始する"""
     # セッションからユーザー名を取得
     username = request.session.get("username")
     if not username or username != "yxfhy":
         raise HTTPException(status_code=403, detail="権限がありません")
 
-    try:
-        # リポジトリの全ファイルを取得
-        contents = get_github_repo_contents("yxfhy", "memo")
+    async def run(job: Job) -> dict:
+        # memo_ で始まるファイルを Git Data API で 1 コミットにまとめて削除
+        deleted = await get_github_client().delete_files(
+            "yxfhy",
+            "memo",
+            lambda entry: entry["path"].startswith("memo_"),
+            message="Delete all memo files",
+            on_progress=job.update,
+        )
+        return {"deleted": deleted}
 
-        # 各ファイルを削除
-        for item in contents:
-            if item["type"] == "file" and item["name"].startswith("memo_"):
-                delete_github_file(
-                    owner="yxfhy", repo="memo", path=item["path"], sha=item["sha"]
-                )
+    job = await memo_jobs.start("delete-all", username, run)
+    return {
+        "status": "accepted",
+        "job_id": job.id,
+        "status_url": f"/memo/jobs/{job.id}",
+    }
 
-        return {"status": "success", "message": "全メモを削除しました"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/memo/jobs/{job_id}")
+async def memo_job_status(request: Request, job_id: str):
+    """メモ関連のバックグラウンドジョブの進捗を返す"""
+    username = request.session.get("username")
+    job = await memo_jobs.get(job_id)
+    if not job or job.owner != username:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job.to_dict()
@@ -0,0 +1,172 @@
+"""utils/scrape_cache.py のテスト
+
+python -m pytest tests
+"""
+
+import asyncio
+import json
+import time
+
+from utils import scrape_cache
+from utils.scrape_cache import ListingCache, shared_scraper
+from utils.shared_state import MemorySharedState
+
+REAL_SLEEP = asyncio.sleep
+
+
+class Row:
+    def __init__(self, link: str):
+        self.link = link
+
+
+class Subscriber:
+    """受け取ったメッセージを貯めるだけの購読者"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+
+    def send_nowait(self, message):
+        self.messages.append(message)
+
+
+class FakeClock:
+    """time.monotonic と asyncio.sleep の代わり（sleep は待たずに時計を進める）"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+        await REAL_SLEEP(0)
+
+
+def run_refreshes(monkeypatch, scrape, sleeps, **options):
+    """
+    購読者を 1 人つないで、取得し直しの待ち時間が sleeps 回記録されるまで動かす
+
+    Returns:
+        tuple: (記録された待ち時間, 購読者)
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(scrape_cache, "time", clock)
+    monkeypatch.setattr(scrape_cache.asyncio, "sleep", clock.sleep)
+
+    async def main():
+        cache = ListingCache(scrape, **options)
+        subscriber = Subscriber()
+        watcher = asyncio.create_task(cache.watch("q", subscriber))
+        while len(clock.sleeps) < sleeps:
+            await REAL_SLEEP(0)
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        await cache.close()
+        return clock.sleeps[:sleeps], subscriber
+
+    return asyncio.run(main())
+
+
+def test_refresh_backs_off_after_failure(monkeypatch):
+    """取得に失敗し続けると、待ち時間を ttl から倍々に延ばし max_retry_delay で止める"""
+    calls = 0
+
+    async def scrape(key):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            yield {"type": "rows", "page": 1, "data": [Row("a")]}
+        else:
+            yield {"type": "page_error", "page": 1, "message": "502"}
+
+    sleeps, _ = run_refreshes(monkeypatch, scrape, 6, ttl=10, max_retry_delay=60)
+    # 取得できた後は ttl、失敗 1 回目から ttl・2 倍・4 倍…（上限 60）
+    assert sleeps == [10, 10, 20, 40, 60, 60]
+
+
+def test_refresh_recovers_after_failure(monkeypatch):
+    """失敗の後に取得できれば、待ち時間は ttl に戻る"""
+    calls = 0
+
+    async def scrape(key):
+        nonlocal calls
+        calls += 1
+        if calls in (2, 3):
+            raise RuntimeError("timeout")
+        yield {"type": "rows", "page": 1, "data": [Row(str(calls))]}
+
+    sleeps, subscriber = run_refreshes(
+        monkeypatch, scrape, 5, ttl=10, max_retry_delay=60
+    )
+    assert sleeps == [10, 10, 20, 10, 10]
+    assert any(message["type"] == "diff" for message in subscriber.messages)
+
+
+def test_shared_scraper_keeps_lock_it_does_not_own():
+    """印を取れずに自分で取得したワーカーは、ほかのワーカーの印を消さない"""
+    state = MemorySharedState()
+
+    async def scrape(key):
+        yield {"type": "page_error", "page": 1, "message": "502"}
+
+    async def main():
+        await state.add("scrape-lock:q", "other-worker", 60)
+        shared = shared_scraper(
+            scrape,
+            state,
+            ttl=60,
+            encode_row=lambda row: row.link,
+            decode_row=Row,
+            lock_ttl=0.1,
+            poll_interval=0.05,
+        )
+        messages = [message async for message in shared("q")]
+        return messages, await state.get("scrape-lock:q")
+
+    messages, lock = asyncio.run(main())
+    assert messages == [{"type": "page_error", "page": 1, "message": "502"}]
+    assert lock == "other-worker"
+
+
+def test_shared_snapshot_keeps_fetch_time():
+    """ほかのワーカーが取得した結果は、その取得時刻から数える"""
+    state = MemorySharedState()
+    calls = 0
+
+    async def scrape(key):
+        nonlocal calls
+        calls += 1
+        yield {"type": "rows", "page": 1, "data": [Row("new")]}
+
+    async def main():
+        snapshot = {
+            "fetched_at": time.time() - 30,
+            "messages": [{"type": "rows", "page": 1, "data": ["a"]}],
+        }
+        await state.set("scrape:q", json.dumps(snapshot), 60)
+        shared = shared_scraper(
+            scrape, state, ttl=60, encode_row=lambda row: row.link, decode_row=Row
+        )
+        cache = ListingCache(shared, ttl=60)
+        subscriber = Subscriber()
+        watcher = asyncio.create_task(cache.watch("q", subscriber))
+        await asyncio.sleep(0.1)
+        stats = cache.stats()
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        await cache.close()
+        return stats, subscriber
+
+    stats, subscriber = asyncio.run(main())
+    assert calls == 0
+    assert stats["q"]["age"] >= 30
+    assert all(message["type"] != "fetched" for message in subscriber.messages)
@@ -0,0 +1,150 @@
+"""キャッシュヘルパ
+
+LLM の応答などを TTL 付きでキャッシュします。
+
+バックエンド:
+    - MemoryCache: プロセス内の LRU キャッシュ
+    - SQLiteCache: SQLite ファイル（プロセス再起動後も残る）
+
+SingleFlight を使うと、同じキーへの同時リクエストを 1 回の処理にまとめられます。
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def make_cache_key(*parts: Any) -> str:
+    """キーの構成要素を連結してハッシュ化したキャッシュキーを返す"""
+    raw = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """前後・連続する空白を畳んだプロンプトを返す（キャッシュキー用）"""
+    return " ".join(prompt.split())
+
+
+class Cache(ABC):
+    """TTL 付きキャッシュの基底クラス"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """値を取得する（存在しない・期限切れの場合は None）"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        """値を ttl 秒間保存する"""
+
+
+class MemoryCache(Cache):
+    """プロセス内メモリに保持する LRU キャッシュ"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        # key -> (有効期限, 値)。末尾ほど最近使われたもの
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteCache(Cache):
+    """SQLite ファイルに保持するキャッシュ（ブロッキング I/O はスレッドで実行）"""
+
+    # set 何回ごとに期限切れのエントリを掃除するか
+    PURGE_INTERVAL = 100
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sets = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+            self._sets += 1
+            if self._sets % self.PURGE_INTERVAL == 0:
+                self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+
+class SingleFlight:
+    """同じキーへの同時呼び出しを 1 回にまとめる"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        キーごとに fn を 1 回だけ実行し、同時に待っている呼び出し元へ同じ結果を返す
+
+        Args:
+            key (str): まとめる単位のキー
+            fn (Callable[[], Awaitable[Any]]): 実行するコルーチン関数
+
+        Returns:
+            Any: fn の戻り値
+
+        Raises:
+            Exception: fn が送出した例外（待っている全員に同じ例外を送出）
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # 呼び出し元がキャンセルされても、他の待ち手のために処理自体は続ける
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
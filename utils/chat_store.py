@@ -0,0 +1,216 @@
+"""チャット履歴ストア
+
+チャットの会話履歴をサーバー側で保持します。Cookie セッションには会話 ID だけを
+保存し、履歴本体はこのストアから読み書きします。
+
+バックエンド:
+    - MemoryConversationStore: プロセス内の LRU + TTL キャッシュ
+    - SQLiteConversationStore: SQLite ファイル（ワーカー再起動後も履歴が残る。
+      同じマシンの複数のワーカープロセスで共有できる）。コンテナで動かす場合は
+      CHAT_STORE_PATH を永続化したディレクトリに向ける（deploy.yml では /app/data）。
+      コンテナ内のファイルのままだと、デプロイのたびに全員の履歴が消える
+    - SharedStateConversationStore: 共有ストア（utils.shared_state）。
+      CHAT_STORE=redis で Redis 互換サーバーに保存する
+
+環境変数（任意）:
+    - CHAT_STORE: "sqlite"（デフォルト）、"memory" または "redis"
+    - CHAT_STORE_PATH: SQLite ファイルのパス（デフォルト ./chat_history.db）
+    - CHAT_STORE_TTL: 最終更新からの保持秒数（デフォルト 7 日）
+    - CHAT_STORE_MAX_ENTRIES: memory バックエンドの最大会話数（デフォルト 1000）
+    - CHAT_STORE_URL: redis バックエンドの URL（デフォルト redis://localhost:6379/0）
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils.shared_state import RedisSharedState, SharedState, worker_count
+
+Messages = List[Dict[str, str]]
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+
+
+class ConversationStore(ABC):
+    """会話履歴ストアの基底クラス"""
+
+    @abstractmethod
+    async def load(self, conversation_id: str) -> Optional[Messages]:
+        """会話履歴を取得する（存在しない・期限切れの場合は None）"""
+
+    @abstractmethod
+    async def save(self, conversation_id: str, messages: Messages) -> None:
+        """会話履歴を保存する"""
+
+    @abstractmethod
+    async def delete(self, conversation_id: str) -> None:
+        """会話履歴を削除する"""
+
+
+class MemoryConversationStore(ConversationStore):
+    """プロセス内メモリに保持する LRU + TTL ストア"""
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # conversation_id -> (最終更新時刻, 履歴)。末尾ほど最近使われたもの
+        self._entries: "OrderedDict[str, tuple[float, Messages]]" = OrderedDict()
+
+    def _purge_expired(self, now: float) -> None:
+        # 先頭ほど古いので、期限切れでないものが出た時点で打ち切れる
+        while self._entries:
+            conversation_id, (updated_at, _) = next(iter(self._entries.items()))
+            if now - updated_at < self.ttl:
+                break
+            del self._entries[conversation_id]
+
+    async def load(self, conversation_id: str) -> Optional[Messages]:
+        now = time.monotonic()
+        self._purge_expired(now)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        self._entries[conversation_id] = (now, entry[1])
+        self._entries.move_to_end(conversation_id)
+        return list(entry[1])
+
+    async def save(self, conversation_id: str, messages: Messages) -> None:
+        now = time.monotonic()
+        self._entries[conversation_id] = (now, list(messages))
+        self._entries.move_to_end(conversation_id)
+        self._purge_expired(now)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, conversation_id: str) -> None:
+        self._entries.pop(conversation_id, None)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite ファイルに保持するストア（ブロッキング I/O はスレッドで実行）"""
+
+    # save 何回ごとに期限切れの会話を掃除するか
+    PURGE_INTERVAL = 100
+
+    def __init__(self, path: str = "./chat_history.db", ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._saves = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY,"
+                " messages TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_conversations_updated_at"
+                " ON conversations (updated_at)"
+            )
+            self._conn.commit()
+
+    def _load(self, conversation_id: str) -> Optional[Messages]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT messages FROM conversations WHERE id = ? AND updated_at >= ?",
+                (conversation_id, time.time() - self.ttl),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, conversation_id: str, messages: Messages) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversations (id, messages, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET"
+                " messages = excluded.messages, updated_at = excluded.updated_at",
+                (conversation_id, json.dumps(messages, ensure_ascii=False), now),
+            )
+            self._saves += 1
+            if self._saves % self.PURGE_INTERVAL == 0:
+                self._conn.execute(
+                    "DELETE FROM conversations WHERE updated_at < ?", (now - self.ttl,)
+                )
+            self._conn.commit()
+
+    def _delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM conversations WHERE id = ?", (conversation_id,)
+            )
+            self._conn.commit()
+
+    async def load(self, conversation_id: str) -> Optional[Messages]:
+        return await asyncio.to_thread(self._load, conversation_id)
+
+    async def save(self, conversation_id: str, messages: Messages) -> None:
+        await asyncio.to_thread(self._save, conversation_id, messages)
+
+    async def delete(self, conversation_id: str) -> None:
+        await asyncio.to_thread(self._delete, conversation_id)
+
+
+class SharedStateConversationStore(ConversationStore):
+    """共有ストアに保持するストア（保存するたびに有効期限を延ばす）"""
+
+    def __init__(self, state: SharedState, ttl: float = DEFAULT_TTL):
+        self.state = state
+        self.ttl = ttl
+
+    async def load(self, conversation_id: str) -> Optional[Messages]:
+        data = await self.state.get(f"chat:{conversation_id}")
+        return json.loads(data) if data else None
+
+    async def save(self, conversation_id: str, messages: Messages) -> None:
+        await self.state.set(
+            f"chat:{conversation_id}",
+            json.dumps(messages, ensure_ascii=False),
+            self.ttl,
+        )
+
+    async def delete(self, conversation_id: str) -> None:
+        await self.state.delete(f"chat:{conversation_id}")
+
+
+def create_conversation_store() -> ConversationStore:
+    """
+    環境変数の設定に従って会話履歴ストアを生成する関数
+
+    Returns:
+        ConversationStore: 会話履歴ストア
+
+    Raises:
+        ValueError: CHAT_STORE に未知のバックエンド名が指定された場合
+    """
+    backend = os.getenv("CHAT_STORE", "sqlite")
+    ttl = float(os.getenv("CHAT_STORE_TTL", str(DEFAULT_TTL)))
+
+    if backend == "memory":
+        if worker_count() > 1:
+            logging.warning(
+                "CHAT_STORE=memory の会話履歴はワーカー間で共有されません"
+                "（WEB_CONCURRENCY > 1）"
+            )
+        max_entries = int(os.getenv("CHAT_STORE_MAX_ENTRIES", str(DEFAULT_MAX_ENTRIES)))
+        return MemoryConversationStore(max_entries=max_entries, ttl=ttl)
+    if backend == "sqlite":
+        path = os.getenv("CHAT_STORE_PATH", "./chat_history.db")
+        return SQLiteConversationStore(path=path, ttl=ttl)
+    if backend == "redis":
+        url = os.getenv("CHAT_STORE_URL", "redis://localhost:6379/0")
+        return SharedStateConversationStore(RedisSharedState(url), ttl=ttl)
+    raise ValueError(f"未知の CHAT_STORE です: {backend}")
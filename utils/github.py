@@ -0,0 +1,491 @@
+"""GitHub API クライアント（非同期）
+
+メモリポジトリの操作に使います。プロセスで 1 つのクライアントを共有し、
+keep-alive の接続プールを使い回します。複数ファイルの削除は Git Data API
+（ツリー・コミットの作成）で 1 コミットにまとめて行います。
+
+再試行:
+    接続エラーと、安全に送り直せるリクエストのタイムアウト・5xx は
+    ジッター付きの指数バックオフで最大 GITHUB_MAX_RETRIES 回送り直します。
+
+レート制限:
+    X-RateLimit-Remaining が 0 になった場合は X-RateLimit-Reset まで、
+    403 / 429 で Retry-After が返された場合はその秒数だけ待ってから送り直します。
+    待ち時間が RATE_LIMIT_MAX_WAIT 秒を超える場合は GitHubRateLimited を送出します。
+    1 回のリクエストでの待ち時間の合計も RATE_LIMIT_MAX_WAIT 秒まで、送り直しも
+    GITHUB_MAX_RETRIES 回までです（レート制限を返し続けるサーバーで止まらないように）。
+
+条件付きリクエスト:
+    GET のレスポンスは ETag と一緒に保持し、次回は If-None-Match を付けて送ります。
+    変更がなければ 304（レート制限の消費なし）が返り、保持していた内容を返します。
+
+環境変数（任意）:
+    - GITHUB_TIMEOUT: 読み込みタイムアウト秒数（デフォルト 30）
+    - GITHUB_MAX_CONNECTIONS: 最大同時接続数（デフォルト 10）
+    - GITHUB_MAX_RETRIES: 再試行回数（デフォルト 3）
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from utils.metrics import httpx_event_hooks
+
+GITHUB_API_URL = "https://api.github.com"
+# レート制限で待つ最大秒数（これより長い場合はエラーにする）
+RATE_LIMIT_MAX_WAIT = 60.0
+# ブランチが同時に更新された場合にコミットを作り直す回数
+REF_UPDATE_RETRIES = 3
+# 再試行の待ち時間（BACKOFF_BASE * 2^n 秒を上限とするランダムな秒数）
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# 送り直すレスポンスのステータス
+RETRY_STATUSES = {500, 502, 503, 504}
+# ETag と一緒に保持する GET レスポンスの件数
+ETAG_CACHE_SIZE = 256
+
+
+def _no_progress(stage: str, done: int, total: int) -> None:
+    pass
+
+
+class GitHubError(Exception):
+    """GitHub API がエラーを返した場合の例外"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"GitHub API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class GitHubRateLimited(GitHubError):
+    """レート制限の解除まで待てない場合の例外"""
+
+    def __init__(self, reset_at: float):
+        super().__init__(403, "rate limit exceeded")
+        self.reset_at = reset_at
+
+
+class GitHubClient:
+    """GitHub REST API の非同期クライアント"""
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = GITHUB_API_URL,
+        timeout: float = 30.0,
+        max_connections: int = 10,
+        max_retries: int = 3,
+        rate_limit_max_wait: float = RATE_LIMIT_MAX_WAIT,
+    ):
+        """
+        Args:
+            token (str): GitHub のアクセストークン
+            base_url (str, optional): API の URL
+            timeout (float, optional): 読み込みタイムアウト秒数（接続は 10 秒まで）
+            max_connections (int, optional): 最大同時接続数
+            max_retries (int, optional): 再試行回数
+            rate_limit_max_wait (float, optional): レート制限で待つ最大秒数
+        """
+        self.max_retries = max_retries
+        self.rate_limit_max_wait = rate_limit_max_wait
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"Bearer {token}",
+                "X-GitHub-Api-Version": "2022-11-28",
+            },
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            event_hooks=httpx_event_hooks("github"),
+        )
+        # 残りリクエスト数が 0 になった場合の解除時刻（time.time() 基準）
+        self._blocked_until = 0.0
+        # 直近のレート制限ヘッダの値
+        self.rate_limit_remaining: Optional[int] = None
+        self.rate_limit_reset: Optional[float] = None
+        # URL -> (ETag, JSON)。末尾ほど最近使われたもの
+        self._etags: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+
+    def _rate_limit_wait(self, response: httpx.Response) -> Optional[float]:
+        """レート制限で拒否された場合の待ち秒数（レート制限でなければ None）"""
+        if response.status_code not in (403, 429):
+            return None
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            return float(retry_after)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = float(response.headers.get("X-RateLimit-Reset", time.time()))
+            return max(0.0, reset - time.time())
+        return None
+
+    def _record_rate_limit(self, response: httpx.Response) -> None:
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is not None:
+            self.rate_limit_remaining = int(remaining)
+        if reset is not None:
+            self.rate_limit_reset = float(reset)
+            if remaining == "0":
+                self._blocked_until = float(reset)
+
+    async def _wait(self, seconds: float, waited: float = 0.0) -> None:
+        # waited: 同じリクエストでこれまでに待った秒数
+        if waited + seconds > self.rate_limit_max_wait:
+            raise GitHubRateLimited(time.time() + seconds)
+        await asyncio.sleep(seconds)
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter: 同時に失敗したリクエストが同じ間隔で送り直さないようにする
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+    def _remember_etag(self, key: str, response: httpx.Response, data: Any) -> None:
+        etag = response.headers.get("ETag")
+        if not etag:
+            return
+        self._etags[key] = (etag, data)
+        self._etags.move_to_end(key)
+        while len(self._etags) > ETAG_CACHE_SIZE:
+            self._etags.popitem(last=False)
+
+    async def request(
+        self, method: str, path: str, idempotent: Optional[bool] = None, **kwargs
+    ) -> Any:
+        """
+        API を呼び出して JSON を返す（レート制限中は解除を待ってから送る）
+
+        Args:
+            method (str): HTTP メソッド
+            path (str): API のパス（例: "/repos/{owner}/{repo}/git/trees"）
+            idempotent (bool, optional): タイムアウトや 5xx のときに送り直してよいか。
+                None の場合は GET / HEAD / DELETE のみ送り直す
+            **kwargs: httpx に渡す引数（json, params など）
+
+        Returns:
+            Any: レスポンスの JSON（本文がない場合は None）
+
+        Raises:
+            GitHubRateLimited: レート制限の解除まで待てない場合
+            GitHubError: API がエラーを返した場合
+            httpx.HTTPError: 再試行しても接続できなかった場合
+        """
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD", "DELETE")
+        cache_key = None
+        if method == "GET":
+            cache_key = str(self._client.build_request(method, path, **kwargs).url)
+
+        extra_headers = kwargs.pop("headers", None) or {}
+
+        attempt = 0
+        # レート制限で送り直した回数と待った秒数の合計
+        rate_limited = 0
+        waited = 0.0
+        while True:
+            blocked = self._blocked_until - time.time()
+            if blocked > 0:
+                await self._wait(blocked, waited)
+                waited += blocked
+
+            headers = dict(extra_headers)
+            cached = self._etags.get(cache_key) if cache_key else None
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+
+            try:
+                response = await self._client.request(
+                    method, path, headers=headers, **kwargs
+                )
+            except httpx.TransportError as e:
+                # 接続できなかった場合はリクエストが届いていないので常に送り直せる
+                retryable = idempotent or isinstance(
+                    e, (httpx.ConnectError, httpx.ConnectTimeout)
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            self._record_rate_limit(response)
+            wait = self._rate_limit_wait(response)
+            if wait is not None:
+                if rate_limited >= self.max_retries:
+                    raise GitHubRateLimited(time.time() + wait)
+                await self._wait(wait, waited)
+                rate_limited += 1
+                waited += wait
+                continue
+            if (
+                response.status_code in RETRY_STATUSES
+                and idempotent
+                and attempt < self.max_retries
+            ):
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code == 304 and cached is not None:
+                self._etags.move_to_end(cache_key)
+                return cached[1]
+            if response.is_error:
+                try:
+                    message = response.json().get("message", response.text)
+                except ValueError:
+                    message = response.text
+                raise GitHubError(response.status_code, message)
+
+            data = response.json() if response.content else None
+            if cache_key:
+                self._remember_etag(cache_key, response, data)
+            return data
+
+    # --------------------------------------------------------------
+    # Contents API
+
+    async def get_contents(self, owner: str, repo: str, path: str = "") -> Any:
+        """リポジトリのファイル・ディレクトリ情報を取得する（ETag で 304 を利用）"""
+        return await self.request("GET", f"/repos/{owner}/{repo}/contents/{path}")
+
+    async def put_contents(
+        self, owner: str, repo: str, path: str, data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """ファイルを作成・更新する（data は message, content(Base64), branch など）"""
+        return await self.request(
+            "PUT", f"/repos/{owner}/{repo}/contents/{path}", json=data
+        )
+
+    async def delete_contents(
+        self, owner: str, repo: str, path: str, data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """ファイルを削除する（data は message, sha, branch など）"""
+        return await self.request(
+            "DELETE", f"/repos/{owner}/{repo}/contents/{path}", json=data
+        )
+
+    # --------------------------------------------------------------
+    # Git Data API
+
+    async def get_branch_head(self, owner: str, repo: str, branch: str) -> str:
+        """ブランチの先頭コミットの SHA を返す"""
+        ref = await self.request("GET", f"/repos/{owner}/{repo}/git/ref/heads/{branch}")
+        return ref["object"]["sha"]
+
+    async def get_commit(self, owner: str, repo: str, sha: str) -> Dict[str, Any]:
+        return await self.request("GET", f"/repos/{owner}/{repo}/git/commits/{sha}")
+
+    async def get_tree(self, owner: str, repo: str, sha: str) -> List[Dict[str, Any]]:
+        """ツリー直下のエントリ一覧を返す"""
+        tree = await self.request("GET", f"/repos/{owner}/{repo}/git/trees/{sha}")
+        return tree["tree"]
+
+    async def create_tree(
+        self, owner: str, repo: str, base_tree: str, entries: List[Dict[str, Any]]
+    ) -> str:
+        """base_tree に entries を反映したツリーを作成し、その SHA を返す"""
+        tree = await self.request(
+            "POST",
+            f"/repos/{owner}/{repo}/git/trees",
+            idempotent=True,  # 同じ内容なら同じ SHA になるので送り直しても安全
+            json={"base_tree": base_tree, "tree": entries},
+        )
+        return tree["sha"]
+
+    async def create_commit(
+        self, owner: str, repo: str, message: str, tree: str, parent: str
+    ) -> str:
+        """コミットを作成し、その SHA を返す"""
+        commit = await self.request(
+            "POST",
+            f"/repos/{owner}/{repo}/git/commits",
+            idempotent=True,
+            json={"message": message, "tree": tree, "parents": [parent]},
+        )
+        return commit["sha"]
+
+    async def update_branch(self, owner: str, repo: str, branch: str, sha: str) -> None:
+        """ブランチをコミットに進める（fast-forward できない場合は 422）"""
+        await self.request(
+            "PATCH",
+            f"/repos/{owner}/{repo}/git/refs/heads/{branch}",
+            idempotent=True,
+            json={"sha": sha, "force": False},
+        )
+
+    async def _commit_changes(
+        self,
+        owner: str,
+        repo: str,
+        branch: str,
+        message: str,
+        make_changes: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+        report: Callable[[str, int, int], None],
+    ) -> Tuple[int, Optional[str]]:
+        """
+        ブランチ先頭のツリーに変更を加えた 1 コミットを作成してブランチを進める
+
+        make_changes は現在のルート直下のエントリ一覧を受け取り、ツリー API に渡す
+        変更エントリの一覧を返します（空の場合はコミットしない）。途中で別の
+        コミットが積まれた場合は最新の状態から作り直します。
+
+        Returns:
+            Tuple[int, Optional[str]]: (変更したエントリ数, 作成したコミットの SHA)
+        """
+        for attempt in range(REF_UPDATE_RETRIES):
+            report("preparing", 0, 0)
+            head = await self.get_branch_head(owner, repo, branch)
+            commit = await self.get_commit(owner, repo, head)
+            base_tree = commit["tree"]["sha"]
+            changes = make_changes(await self.get_tree(owner, repo, base_tree))
+            if not changes:
+                report("done", 0, 0)
+                return 0, None
+
+            report("committing", 0, len(changes))
+            tree = await self.create_tree(owner, repo, base_tree, changes)
+            new_commit = await self.create_commit(owner, repo, message, tree, head)
+            try:
+                await self.update_branch(owner, repo, branch, new_commit)
+            except GitHubError as e:
+                if e.status_code == 422 and attempt + 1 < REF_UPDATE_RETRIES:
+                    continue
+                raise
+            report("done", len(changes), len(changes))
+            return len(changes), new_commit
+        raise GitHubError(422, "branch was updated concurrently")
+
+    async def delete_files(
+        self,
+        owner: str,
+        repo: str,
+        should_delete: Callable[[Dict[str, Any]], bool],
+        message: str,
+        branch: str = "main",
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
+    ) -> int:
+        """
+        ルート直下のファイルのうち条件に合うものを 1 コミットで削除する
+
+        Args:
+            owner (str): リポジトリのオーナー名
+            repo (str): リポジトリ名
+            should_delete (Callable[[Dict[str, Any]], bool]):
+                ツリーのエントリ（path, type, sha など）を受け取り、削除するなら True
+            message (str): コミットメッセージ
+            branch (str, optional): 対象のブランチ。デフォルトは"main"
+            on_progress (Callable[[str, int, int], None], optional):
+                (段階名, 処理済み件数, 対象件数) を受け取る進捗通知
+
+        Returns:
+            int: 削除したファイル数
+
+        Raises:
+            GitHubError: API がエラーを返した場合（同時更新の再試行回数超過を含む）
+        """
+
+        def make_changes(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            # base_tree 上のパスに sha: null を指定するとそのファイルが削除される
+            return [
+                {
+                    "path": entry["path"],
+                    "mode": entry["mode"],
+                    "type": "blob",
+                    "sha": None,
+                }
+                for entry in entries
+                if entry["type"] == "blob" and should_delete(entry)
+            ]
+
+        deleted, _ = await self._commit_changes(
+            owner, repo, branch, message, make_changes, on_progress or _no_progress
+        )
+        return deleted
+
+    async def commit_files(
+        self,
+        owner: str,
+        repo: str,
+        files: Dict[str, str],
+        message: str,
+        branch: str = "main",
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
+    ) -> Optional[str]:
+        """
+        複数のテキストファイルを 1 コミットで作成・上書きする
+
+        ファイル数に関係なく API 呼び出しは 5 回（ブランチ・コミット・ツリーの取得、
+        ツリー・コミットの作成、ブランチ更新）です。
+
+        Args:
+            owner (str): リポジトリのオーナー名
+            repo (str): リポジトリ名
+            files (Dict[str, str]): パス -> ファイルの内容
+            message (str): コミットメッセージ
+            branch (str, optional): 対象のブランチ。デフォルトは"main"
+            on_progress (Callable[[str, int, int], None], optional):
+                (段階名, 処理済み件数, 対象件数) を受け取る進捗通知
+
+        Returns:
+            Optional[str]: 作成したコミットの SHA（files が空の場合は None）
+
+        Raises:
+            GitHubError: API がエラーを返した場合（同時更新の再試行回数超過を含む）
+        """
+
+        def make_changes(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            # content を直接指定すると blob をファイルごとに作らずに済む
+            return [
+                {"path": path, "mode": "100644", "type": "blob", "content": content}
+                for path, content in files.items()
+            ]
+
+        _, commit = await self._commit_changes(
+            owner, repo, branch, message, make_changes, on_progress or _no_progress
+        )
+        return commit
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+_github_client: Optional[GitHubClient] = None
+
+
+def get_github_client() -> GitHubClient:
+    """
+    プロセス共有の GitHub クライアントを返す
+
+    Raises:
+        RuntimeError: GITHUB_TOKEN が設定されていない場合
+    """
+    global _github_client
+    if _github_client is None:
+        load_dotenv()
+        github_token = os.getenv("GITHUB_TOKEN")
+        if not github_token:
+            raise RuntimeError("GITHUB_TOKEN is not set in .env")
+        _github_client = GitHubClient(
+            github_token,
+            base_url=os.getenv("GITHUB_API_URL", GITHUB_API_URL),
+            timeout=float(os.getenv("GITHUB_TIMEOUT", "30")),
+            max_connections=int(os.getenv("GITHUB_MAX_CONNECTIONS", "10")),
+            max_retries=int(os.getenv("GITHUB_MAX_RETRIES", "3")),
+        )
+    return _github_client
+
+
+async def close_github_client() -> None:
+    """共有クライアントの接続を閉じる（アプリ終了時用）"""
+    global _github_client
+    if _github_client is not None:
+        await _github_client.close()
+        _github_client = None
@@ -0,0 +1,24 @@
+"""gunicorn のワーカー（gunicorn.conf.py の worker_class）
+
+UvicornWorker は終了時に処理中のリクエスト（ストリーミング応答など）が終わるまで
+待ち続けます。その間に gunicorn の graceful_timeout を過ぎるとワーカーは SIGKILL され、
+アプリの終了処理（DB のチェックポイント・LLM 使用量の保存・ジョブの状態の保存）が
+実行されません。このワーカーは処理中のリクエストを待つ時間を区切り、
+graceful_timeout 内に終了処理まで終わらせます。
+"""
+
+from uvicorn.workers import UvicornWorker
+
+# graceful_timeout のうち、アプリの終了処理（lifespan shutdown）に残す秒数
+SHUTDOWN_HOOK_SECONDS = 5
+
+
+class AppUvicornWorker(UvicornWorker):
+    """処理中のリクエストを graceful_timeout - SHUTDOWN_HOOK_SECONDS 秒まで待つワーカー"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 過ぎたら処理中のリクエストをキャンセルして終了処理に進む
+        self.config.timeout_graceful_shutdown = max(
+            self.cfg.graceful_timeout - SHUTDOWN_HOOK_SECONDS, 1
+        )
@@ -0,0 +1,180 @@
+"""バックグラウンドジョブ
+
+時間のかかる処理（GitHub への一括操作など）をリクエストから切り離して実行し、
+進捗をジョブ ID で問い合わせられるようにします。ジョブは開始したワーカーで実行し、
+状態は共有ストア（utils.shared_state）に書き込むので、どのワーカーからでも
+進捗を問い合わせられます。完了後 JOB_RETENTION 秒で破棄します。
+"""
+
+import asyncio
+import dataclasses
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.shared_state import SharedState
+
+# 完了したジョブを保持する秒数
+JOB_RETENTION = 60 * 60
+# 実行中のジョブの状態を共有ストアに書き込む間隔（秒）
+JOB_SYNC_INTERVAL = 0.5
+# 実行中の印の有効期限（秒）。ワーカーが落ちてもこの時間が過ぎれば次のジョブを始められる
+JOB_LEASE = 30
+
+
+@dataclass
+class Job:
+    """ジョブの状態"""
+
+    id: str
+    kind: str
+    owner: str
+    status: str = "pending"  # pending / running / done / failed
+    stage: str = ""
+    done: int = 0
+    total: int = 0
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def update(self, stage: str, done: int, total: int) -> None:
+        """進捗を更新する"""
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """バックグラウンドジョブを実行・管理するクラス"""
+
+    def __init__(
+        self,
+        state: SharedState,
+        retention: float = JOB_RETENTION,
+        sync_interval: float = JOB_SYNC_INTERVAL,
+        lease: float = JOB_LEASE,
+    ):
+        """
+        Args:
+            state (SharedState): ジョブの状態を書き込む共有ストア
+            retention (float, optional): 完了したジョブを保持する秒数
+            sync_interval (float, optional): 実行中のジョブの状態を書き込む間隔（秒）
+            lease (float, optional): 実行中の印の有効期限（秒）
+        """
+        self.state = state
+        self.retention = retention
+        self.sync_interval = sync_interval
+        self.lease = lease
+        # このワーカーで実行中のジョブ（進捗は共有ストアより新しい）
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _active_key(kind: str, owner: str) -> str:
+        return f"job-active:{kind}:{owner}"
+
+    async def _save(self, job: Job) -> None:
+        await self.state.set(
+            f"job:{job.id}", json.dumps(dataclasses.asdict(job)), self.retention
+        )
+
+    async def start(
+        self, kind: str, owner: str, fn: Callable[[Job], Awaitable[Any]]
+    ) -> Job:
+        """
+        ジョブを開始する（同じ種類のジョブが実行中ならそれを返す）
+
+        同じ種類・同じユーザーのジョブは、別のワーカーで実行中のものも含めて
+        同時に 1 つだけ実行します。
+
+        Args:
+            kind (str): ジョブの種類
+            owner (str): ジョブを開始したユーザー名
+            fn (Callable[[Job], Awaitable[Any]]):
+                Job を受け取って進捗を更新し、結果を返すコルーチン関数
+
+        Returns:
+            Job: 開始した（または実行中の）ジョブ
+        """
+        job = Job(id=uuid.uuid4().hex, kind=kind, owner=owner)
+        active_key = self._active_key(kind, owner)
+        if not await self.state.add(active_key, job.id, self.lease):
+            active_id = await self.state.get(active_key)
+            active = await self.get(active_id) if active_id else None
+            if active is not None and active.status in ("pending", "running"):
+                return active
+            # 実行中の印だけが残っている（ジョブは終わっている）
+            await self.state.set(active_key, job.id, self.lease)
+
+        self._jobs[job.id] = job
+        await self._save(job)
+        self._tasks[job.id] = asyncio.create_task(self._run(job, fn))
+        return job
+
+    async def _sync(self, job: Job) -> None:
+        # 実行中は進捗を定期的に書き込み、実行中の印の期限を延ばす
+        active_key = self._active_key(job.kind, job.owner)
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self._save(job)
+            await self.state.set(active_key, job.id, self.lease)
+
+    async def _run(self, job: Job, fn: Callable[[Job], Awaitable[Any]]) -> None:
+        job.status = "running"
+        sync = asyncio.create_task(self._sync(job))
+        try:
+            job.result = await fn(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            logging.warning(f"ジョブ {job.kind} ({job.id}) が失敗しました: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            sync.cancel()
+            await asyncio.gather(sync, return_exceptions=True)
+            try:
+                await self._save(job)
+                # 期限切れの後に別のワーカーが取った印は消さない
+                await self.state.delete_if(
+                    self._active_key(job.kind, job.owner), job.id
+                )
+            except Exception as e:
+                logging.warning(f"ジョブ {job.id} の状態を保存できませんでした: {e}")
+            self._jobs.pop(job.id, None)
+            self._tasks.pop(job.id, None)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """ジョブを取得する（別のワーカーで実行中・完了したジョブも含む）"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        data = await self.state.get(f"job:{job_id}")
+        return Job(**json.loads(data)) if data else None
+
+    async def stop(self) -> None:
+        """実行中のジョブをキャンセルする（アプリ終了時用）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,215 @@
+"""メモ内リンクのタイトル取得（バックグラウンド処理）
+
+メモは URL をそのままリンクにして即座に保存し、ページタイトルは
+バックグラウンドのワーカーが取得してから本文を書き換えます。
+
+- 共有の aiohttp セッションで複数の URL を並行して取得（ホストごとの同時接続数を制限）
+- レスポンスは <head> 部分だけを読み、本文全体はダウンロードしない
+- 取得結果は TTL 付きでキャッシュし、失敗した URL も短い TTL で記録（ネガティブキャッシュ）
+
+環境変数（任意）:
+    - LINK_TITLE_WORKERS: ワーカー数（デフォルト 4）
+    - LINK_TITLE_CACHE_PATH: タイトルキャッシュの SQLite ファイル（デフォルト ./link_title_cache.db）
+"""
+
+import asyncio
+import html
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from utils.cache import Cache, SQLiteCache
+
+URL_PATTERN = r'https?://[^\s<>"]+|www\.[^\s<>"]+'
+
+# <head> を探すために読み込む最大バイト数
+HEAD_MAX_BYTES = 64 * 1024
+# タイトルを取得できた URL / 取得できなかった URL のキャッシュ秒数
+TITLE_TTL = 7 * 24 * 60 * 60
+NEGATIVE_TTL = 60 * 60
+# 1 ホストあたりの同時接続数と全体の同時接続数
+PER_HOST_LIMIT = 2
+TOTAL_LIMIT = 20
+FETCH_TIMEOUT = 5
+
+_TITLE_RE = re.compile(rb"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+_HEAD_END_RE = re.compile(rb"</head\s*>|<body[\s>]", re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+def find_urls(text: str) -> List[str]:
+    """テキスト内の URL を重複なしで出現順に返す"""
+    return list(dict.fromkeys(re.findall(URL_PATTERN, text)))
+
+
+def render_links(text: str, titles: Optional[Dict[str, str]] = None) -> str:
+    """テキスト内の URL を HTML リンクに変換する（タイトルがあれば表示に使う）"""
+    titles = titles or {}
+
+    def replace_url(match):
+        url = match.group(0)
+        title = titles.get(url)
+        # タイトルは外部ページ由来なのでエスケープしてから埋め込む
+        display_text = f"{html.escape(title)} ({url})" if title else url
+        return (
+            f'<a href="{url}" target="_blank" '
+            f'rel="noopener noreferrer">{display_text}</a>'
+        )
+
+    return re.sub(URL_PATTERN, replace_url, text)
+
+
+def parse_title(head: bytes, charset: Optional[str] = None) -> Optional[str]:
+    """HTML の先頭部分から <title> を取り出す"""
+    match = _TITLE_RE.search(head)
+    if not match:
+        return None
+    if not charset:
+        meta = _META_CHARSET_RE.search(head)
+        charset = meta.group(1).decode("ascii") if meta else "utf-8"
+    try:
+        title = match.group(1).decode(charset, errors="replace")
+    except LookupError:
+        title = match.group(1).decode("utf-8", errors="replace")
+    title = " ".join(html.unescape(title).split())
+    return title or None
+
+
+class LinkTitleResolver:
+    """URL のタイトルを取得するクラス（キャッシュ付き）"""
+
+    def __init__(self, cache: Cache):
+        self.cache = cache
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=TOTAL_LIMIT, limit_per_host=PER_HOST_LIMIT
+                ),
+                timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+                headers={"User-Agent": "Mozilla/5.0"},
+            )
+        return self._session
+
+    async def _fetch_title(self, url: str) -> Optional[str]:
+        target = url if url.startswith("http") else f"http://{url}"
+        async with self._get_session().get(target) as res:
+            res.raise_for_status()
+            if "html" not in res.headers.get("Content-Type", "html"):
+                return None
+            # <head> の終わりが見つかった時点で読み込みをやめる
+            head = b""
+            async for chunk in res.content.iter_chunked(4096):
+                head += chunk
+                if _HEAD_END_RE.search(head) or len(head) >= HEAD_MAX_BYTES:
+                    break
+            return parse_title(head, res.charset)
+
+    async def get_title(self, url: str) -> Optional[str]:
+        """URL のタイトルを返す（取得できない場合は None）"""
+        cached = await self.cache.get(url)
+        if cached is not None:
+            return cached or None
+
+        try:
+            title = await self._fetch_title(url)
+        except Exception:
+            title = None
+
+        if title:
+            await self.cache.set(url, title, TITLE_TTL)
+        else:
+            await self.cache.set(url, "", NEGATIVE_TTL)
+        return title
+
+    async def get_titles(self, urls: List[str]) -> Dict[str, str]:
+        """複数の URL のタイトルを並行して取得する"""
+        titles = await asyncio.gather(*(self.get_title(url) for url in urls))
+        return {url: title for url, title in zip(urls, titles) if title}
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class LinkTitleWorker:
+    """メモ保存後にリンクのタイトルを取得し、本文を書き換えるワーカー"""
+
+    def __init__(
+        self,
+        resolver: LinkTitleResolver,
+        update_content: Callable[[str, str], Awaitable[None]],
+        workers: int = 4,
+        max_queue: int = 1000,
+    ):
+        """
+        Args:
+            resolver (LinkTitleResolver): タイトル取得に使うリゾルバ
+            update_content (Callable[[str, str], Awaitable[None]]):
+                (memo_id, 新しい本文) を受け取ってメモを更新するコルーチン関数
+            workers (int, optional): 並行して処理するメモの数
+            max_queue (int, optional): 待ち行列の最大長
+        """
+        self.resolver = resolver
+        self.update_content = update_content
+        self.workers = workers
+        self.queue: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue(max_queue)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.resolver.close()
+
+    def enqueue(self, memo_id: str, text: str) -> bool:
+        """
+        タイトル取得を予約する（URL がない場合や待ち行列が一杯の場合は False）
+
+        Args:
+            memo_id (str): メモ ID
+            text (str): リンク変換前のメモ本文
+        """
+        if not find_urls(text):
+            return False
+        try:
+            self.queue.put_nowait((memo_id, text))
+        except asyncio.QueueFull:
+            logging.warning(f"リンクタイトル取得の待ち行列が一杯です: {memo_id}")
+            return False
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            memo_id, text = await self.queue.get()
+            try:
+                titles = await self.resolver.get_titles(find_urls(text))
+                if titles:
+                    await self.update_content(memo_id, render_links(text, titles))
+            except Exception as e:
+                logging.warning(f"リンクタイトルの反映に失敗しました: {memo_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+def create_link_title_worker(
+    update_content: Callable[[str, str], Awaitable[None]],
+) -> LinkTitleWorker:
+    """環境変数の設定に従ってワーカーを生成する関数"""
+    cache = SQLiteCache(os.getenv("LINK_TITLE_CACHE_PATH", "./link_title_cache.db"))
+    return LinkTitleWorker(
+        LinkTitleResolver(cache),
+        update_content,
+        workers=int(os.getenv("LINK_TITLE_WORKERS", "4")),
+    )
@@ -0,0 +1,254 @@
+"""Sukebei.nyaa.si の検索結果ページのパーサ
+
+検索結果テーブルの各行から name / link / size / date / seeders / leechers を取り出し、
+ListingRow として返します。サイズは "1.5 GiB" のような表記をバイト数（int）に
+変換済みです。ページの解析がスクレイピングの CPU コストの大半を占めるため、
+利用できる最速のバックエンドを使います。
+
+バックエンド（DL_PARSER で指定。デフォルトは auto = 上から順に利用可能なもの）:
+    - selectolax: C 実装の HTML5 パーサ lexbor（最速）
+    - lxml: libxml2 ベースのパーサ
+    - bs4: BeautifulSoup + html.parser（追加パッケージ不要のフォールバック）
+
+どのバックエンドも 1 行につきセルを 1 回走査するだけで行データを作ります。
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:  # selectolax はオプション（古い版は Modest バックエンドのみ）
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:  # lxml はオプション
+    lxml = None
+
+
+@dataclass(slots=True)
+class ListingRow:
+    """検索結果の 1 行（__slots__ を使い 1 行あたりのメモリを抑える）"""
+
+    name: str
+    link: str
+    size: int  # バイト数
+    date: str
+    seeders: int
+    leechers: int
+
+    # 送信時の列の順番（クライアントには最初に 1 回だけ送る）
+    FIELDS = ("name", "link", "size", "date", "seeders", "leechers")
+
+    def to_list(self) -> list:
+        """FIELDS の順に値を並べたリスト（列形式で送るとき用）"""
+        return [
+            self.name,
+            self.link,
+            self.size,
+            self.date,
+            self.seeders,
+            self.leechers,
+        ]
+
+
+# サイズの単位（nyaa の表記は 2 進接頭辞）
+SIZE_UNITS = {
+    "bytes": 1,
+    "b": 1,
+    "kib": 1024,
+    "mib": 1024**2,
+    "gib": 1024**3,
+    "tib": 1024**4,
+    "pib": 1024**5,
+}
+_SIZE_RE = re.compile(r"([\d.]+)\s*([A-Za-z]+)")
+
+
+def parse_size(text: str) -> int:
+    """
+    "1.5 GiB" のようなサイズ表記をバイト数に変換する
+
+    Args:
+        text (str): サイズ表記
+
+    Returns:
+        int: バイト数（解釈できない場合は 0）
+    """
+    match = _SIZE_RE.fullmatch(text.strip())
+    if match is None:
+        return 0
+    unit = SIZE_UNITS.get(match.group(2).lower())
+    if unit is None:
+        return 0
+    try:
+        return int(float(match.group(1)) * unit)
+    except ValueError:
+        return 0
+
+
+def _make_row(
+    name: str,
+    magnet: Optional[str],
+    href: Optional[str],
+    size: str,
+    date: str,
+    seeders: str,
+    leechers: str,
+    base_url: str,
+) -> ListingRow:
+    if magnet:
+        link = magnet
+    elif href:
+        link = urljoin(base_url, href)
+    else:
+        link = ""
+    return ListingRow(name, link, parse_size(size), date, int(seeders), int(leechers))
+
+
+def _parse_selectolax(html: str, base_url: str) -> List[ListingRow]:
+    rows = []
+    for tr in HTMLParser(html).css("table tbody tr"):
+        tds = [node for node in tr.iter() if node.tag == "td"]
+        if len(tds) < 7:
+            continue
+        magnet = href = None
+        for a in tds[2].css("a"):
+            attrs = a.attributes
+            if attrs.get("title") == "Magnet link":
+                magnet = attrs.get("href")
+                break
+            if href is None and attrs.get("href") is not None:
+                href = attrs["href"]
+        rows.append(
+            _make_row(
+                tds[1].text(deep=True, separator="", strip=True),
+                magnet,
+                href,
+                tds[3].text(strip=True),
+                tds[4].text(strip=True),
+                tds[5].text(strip=True),
+                tds[6].text(strip=True),
+                base_url,
+            )
+        )
+    return rows
+
+
+def _lxml_text(element) -> str:
+    # BeautifulSoup の get_text(strip=True) と同じく、各テキストを strip して連結
+    return "".join(text.strip() for text in element.itertext())
+
+
+def _parse_lxml(html: str, base_url: str) -> List[ListingRow]:
+    rows = []
+    document = lxml.html.fromstring(html)
+    for tr in document.iterfind(".//table/tbody/tr"):
+        tds = tr.findall("td")
+        if len(tds) < 7:
+            continue
+        magnet = href = None
+        for a in tds[2].iter("a"):
+            if a.get("title") == "Magnet link":
+                magnet = a.get("href")
+                break
+            if href is None and a.get("href") is not None:
+                href = a.get("href")
+        rows.append(
+            _make_row(
+                _lxml_text(tds[1]),
+                magnet,
+                href,
+                _lxml_text(tds[3]),
+                _lxml_text(tds[4]),
+                _lxml_text(tds[5]),
+                _lxml_text(tds[6]),
+                base_url,
+            )
+        )
+    return rows
+
+
+def _parse_bs4(html: str, base_url: str) -> List[ListingRow]:
+    rows = []
+    soup = BeautifulSoup(html, "html.parser")
+    for tr in soup.select("table tbody tr"):
+        tds = tr.find_all("td", recursive=False)
+        if len(tds) < 7:
+            continue
+        magnet = href = None
+        for a in tds[2].find_all("a"):
+            if a.get("title") == "Magnet link":
+                magnet = a.get("href")
+                break
+            if href is None and a.get("href") is not None:
+                href = a["href"]
+        rows.append(
+            _make_row(
+                tds[1].get_text(strip=True),
+                magnet,
+                href,
+                tds[3].get_text(strip=True),
+                tds[4].get_text(strip=True),
+                tds[5].get_text(strip=True),
+                tds[6].get_text(strip=True),
+                base_url,
+            )
+        )
+    return rows
+
+
+BACKENDS: Dict[str, Callable[[str, str], List[ListingRow]]] = {}
+if HTMLParser is not None:
+    BACKENDS["selectolax"] = _parse_selectolax
+if lxml is not None:
+    BACKENDS["lxml"] = _parse_lxml
+BACKENDS["bs4"] = _parse_bs4
+
+
+def get_parser(backend: Optional[str] = None) -> Callable[[str, str], List[ListingRow]]:
+    """
+    パーサ関数を返す
+
+    Args:
+        backend (str, optional): "selectolax"、"lxml"、"bs4" または "auto"。
+            None の場合は環境変数 DL_PARSER（デフォルト auto）
+
+    Returns:
+        Callable[[str, str], List[ListingRow]]: (HTML, ページ URL) を受け取り行データを返す関数
+
+    Raises:
+        ValueError: 未知のバックエンド名、またはインストールされていない場合
+    """
+    backend = backend or os.getenv("DL_PARSER", "auto")
+    if backend == "auto":
+        return next(iter(BACKENDS.values()))
+    if backend not in BACKENDS:
+        raise ValueError(f"利用できない DL_PARSER です: {backend}")
+    return BACKENDS[backend]
+
+
+def parse_listing(
+    html: str, base_url: str, backend: Optional[str] = None
+) -> List[ListingRow]:
+    """
+    検索結果ページの HTML から行データを取り出す
+
+    Args:
+        html (str): ページの HTML
+        base_url (str): ページの URL（相対リンクの解決に使う）
+        backend (str, optional): 使用するバックエンド（get_parser を参照）
+
+    Returns:
+        List[ListingRow]: 行データ
+    """
+    return get_parser(backend)(html, base_url)
@@ -0,0 +1,317 @@
+"""OpenAI API 呼び出しの使用量・所要時間の記録
+
+chat.completions.create の呼び出しはすべて create_chat_completion
+（同期クライアントは create_chat_completion_sync）を通し、1 回ごとに
+
+    - モデル・トークン数（prompt / completion）・費用（config.json の LLM_PRICES から計算）
+    - 全体の所要時間と、ストリーミングでは最初のトークンが届くまでの時間（TTFT）
+    - 呼び出し元のユーザー・ルート・会話 ID（処理中のリクエストから取得）
+
+を記録します。記録はプロセス内でユーザー・ルートごとに集計し（usage_recorder.summary）、
+数秒ごとにまとめて SQLite の llm_usage テーブルに保存します。
+
+環境変数（任意）:
+    - LLM_USAGE_FLUSH_INTERVAL: SQLite に保存する間隔（秒、デフォルト 5）
+    - LLM_USAGE_MAX_PENDING: 保存待ちにしておける件数（超えた分は保存しない。デフォルト 10000）
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from models.llm_usage import LLMUsage, save_llm_usage
+from utils.metrics import Histogram, current_request_scope, route_label
+from utils.settings import get_settings
+
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds",
+    "OpenAI API 呼び出し全体の所要時間（ストリーミングは最後のチャンクまで）",
+    ("operation", "model"),
+)
+LLM_TTFT = Histogram(
+    "llm_time_to_first_token_seconds",
+    "ストリーミングで最初のトークンが届くまでの時間",
+    ("operation", "model"),
+)
+
+
+@dataclass
+class UsageStats:
+    """使用量の集計"""
+
+    calls: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+    ttft_total: float = 0.0
+    ttft_count: int = 0
+
+    def add(self, record: LLMUsage) -> None:
+        self.calls += 1
+        if record.status != "ok":
+            self.errors += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cost_usd += record.cost_usd or 0.0
+        self.latency_total += record.latency_seconds
+        self.latency_max = max(self.latency_max, record.latency_seconds)
+        if record.ttft_seconds is not None:
+            self.ttft_total += record.ttft_seconds
+            self.ttft_count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "avg_latency_seconds": round(self.latency_total / (self.calls or 1), 3),
+            "max_latency_seconds": round(self.latency_max, 3),
+            "avg_ttft_seconds": (
+                round(self.ttft_total / self.ttft_count, 3) if self.ttft_count else None
+            ),
+        }
+
+
+def estimate_cost(
+    model: str, prompt_tokens: int, completion_tokens: int
+) -> Optional[float]:
+    """config.json の LLM_PRICES から費用（USD）を計算する（単価が無ければ None）"""
+    prices = get_settings().llm_prices
+    # "gpt-4.1-2025-04-14" のような日付付きのモデル名は前方一致で単価を探す
+    price = prices.get(model) or next(
+        (p for name, p in prices.items() if model.startswith(name)), None
+    )
+    if price is None:
+        return None
+    return (
+        prompt_tokens * price.get("prompt", 0.0)
+        + completion_tokens * price.get("completion", 0.0)
+    ) / 1_000_000
+
+
+class UsageRecorder:
+    """使用量をプロセス内で集計し、定期的に SQLite に保存するクラス"""
+
+    def __init__(self, flush_interval: float = 5.0, max_pending: int = 10000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.by_user: Dict[str, UsageStats] = {}
+        self.by_route: Dict[str, UsageStats] = {}
+        self.dropped = 0
+        self._pending: List[LLMUsage] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, record: LLMUsage) -> None:
+        """1 回分の記録を追加する"""
+        self.by_user.setdefault(record.username or "-", UsageStats()).add(record)
+        self.by_route.setdefault(record.route, UsageStats()).add(record)
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(record)
+
+    def summary(self) -> Dict[str, Any]:
+        """プロセス起動後の集計（このワーカーの分だけ）"""
+        return {
+            "worker": os.getpid(),
+            "by_user": {k: v.to_dict() for k, v in self.by_user.items()},
+            "by_route": {k: v.to_dict() for k, v in self.by_route.items()},
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+        }
+
+    async def flush(self) -> None:
+        """保存待ちの記録を SQLite に保存する"""
+        if not self._pending:
+            return
+        # 循環 import を避けるためここで読み込む
+        from database import AsyncSessionLocal
+
+        records, self._pending = self._pending, []
+        try:
+            async with AsyncSessionLocal() as session:
+                await save_llm_usage(session, records)
+        except Exception as e:
+            logging.warning(
+                f"LLM の使用量を保存できませんでした ({len(records)} 件): {e}"
+            )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def stop(self) -> None:
+        """定期保存を止め、残りを保存する（アプリ終了時用）"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+usage_recorder = UsageRecorder(
+    flush_interval=float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "5")),
+    max_pending=int(os.getenv("LLM_USAGE_MAX_PENDING", "10000")),
+)
+
+
+class LLMCall:
+    """1 回の API 呼び出しの計測"""
+
+    def __init__(self, operation: str, model: str):
+        self.operation = operation
+        self.model = model
+        self.started = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.status = "ok"
+        self._finished = False
+        # 呼び出し元のリクエスト（バックグラウンド処理なら None）
+        scope = current_request_scope.get()
+        session = (scope or {}).get("session") or {}
+        self.username: Optional[str] = session.get("username")
+        self.conversation_id: Optional[str] = session.get("conversation_id")
+        self.route = route_label(scope) if scope is not None else "background"
+
+    def first_token(self) -> None:
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def set_usage(self, usage: Any, model: Optional[str] = None) -> None:
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens or 0
+            self.completion_tokens = usage.completion_tokens or 0
+        if model:
+            self.model = model  # 実際に使われたモデル（日付付きの名前）
+
+    def finish(self) -> None:
+        """計測を終えて記録する（何度呼んでもよい）"""
+        if self._finished:
+            return
+        self._finished = True
+        latency = time.perf_counter() - self.started
+        LLM_LATENCY.observe(latency, self.operation, self.model)
+        if self.ttft is not None:
+            LLM_TTFT.observe(self.ttft, self.operation, self.model)
+        usage_recorder.record(
+            LLMUsage(
+                username=self.username,
+                route=self.route,
+                conversation_id=self.conversation_id,
+                operation=self.operation,
+                model=self.model,
+                status=self.status,
+                prompt_tokens=self.prompt_tokens,
+                completion_tokens=self.completion_tokens,
+                cost_usd=estimate_cost(
+                    self.model, self.prompt_tokens, self.completion_tokens
+                ),
+                latency_seconds=round(latency, 4),
+                ttft_seconds=None if self.ttft is None else round(self.ttft, 4),
+            )
+        )
+
+
+class TrackedStream:
+    """ストリーミング応答を包み、最初のトークンの時刻と最後の使用量を記録する"""
+
+    def __init__(self, stream: Any, call: LLMCall):
+        self._stream = stream
+        self._call = call
+        self._completed = False
+
+    async def __aenter__(self) -> "TrackedStream":
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            await self._stream.__aexit__(exc_type, exc, tb)
+        finally:
+            self._finish()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._stream:
+                if chunk.usage is not None:
+                    # stream_options.include_usage により最後のチャンクで届く
+                    self._call.set_usage(chunk.usage, chunk.model)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    self._call.first_token()
+                yield chunk
+            self._completed = True
+        except Exception:
+            self._call.status = "error"
+            raise
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if not self._completed and self._call.status == "ok":
+            self._call.status = (
+                "cancelled"  # 途中で読むのをやめた（クライアントの切断など）
+            )
+        self._call.finish()
+
+
+async def create_chat_completion(client: Any, operation: str, **kwargs) -> Any:
+    """
+    chat.completions.create を呼び、使用量と所要時間を記録する
+
+    stream=True の場合は最後のチャンクで使用量を受け取るよう stream_options を付け、
+    反復し終えた（または閉じた）時点で記録する TrackedStream を返します。
+
+    Args:
+        client (AsyncOpenAI): OpenAI クライアント
+        operation (str): 呼び出しの種類（chat / chat_stream / reply / summary など）
+        **kwargs: chat.completions.create に渡す引数
+
+    Returns:
+        Any: ChatCompletion、または stream=True の場合は TrackedStream
+    """
+    call = LLMCall(operation, kwargs.get("model", ""))
+    stream = kwargs.get("stream", False)
+    if stream:
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    try:
+        response = await client.chat.completions.create(**kwargs)
+    except Exception:
+        call.status = "error"
+        call.finish()
+        raise
+    if stream:
+        return TrackedStream(response, call)
+    call.set_usage(response.usage, response.model)
+    call.finish()
+    return response
+
+
+def create_chat_completion_sync(client: Any, operation: str, **kwargs) -> Any:
+    """create_chat_completion の同期クライアント版（ストリーミングには対応しない）"""
+    call = LLMCall(operation, kwargs.get("model", ""))
+    try:
+        response = client.chat.completions.create(**kwargs)
+    except Exception:
+        call.status = "error"
+        call.finish()
+        raise
+    call.set_usage(response.usage, response.model)
+    call.finish()
+    return response
@@ -0,0 +1,217 @@
+"""イベントループのブロッキング検出（開発・ステージング用）
+
+async def の中で同期的に重い処理（bcrypt・同期 DB・requests など）を行うと、
+その間イベントループが止まり、ほかの全リクエストが待たされます。
+このウォッチドッグは、イベントループ上で一定間隔の心拍（call_later）を打ち、
+別スレッドから心拍が threshold 秒以上途絶えていないかを監視します。
+途絶えた場合はその時点のイベントループのスレッドのスタックを取得し、
+ループが再開したときに、止まっていた時間・実行中だったルート・スタックを
+ログに出力して /debug/loop-stalls（管理者ユーザーのみ）で参照できるように保持します。
+
+環境変数（任意）:
+    - LOOP_WATCHDOG: 1 で有効にする（デフォルト無効。本番では有効にしない想定）
+    - LOOP_WATCHDOG_THRESHOLD: 止まっているとみなす秒数（デフォルト 0.1）
+    - LOOP_WATCHDOG_MAX_REPORTS: 保持する検出結果の件数（デフォルト 100）
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+from utils.metrics import route_label
+
+# このアプリのディレクトリ（スタックの位置を相対パスで表示する）
+PROJECT_DIR = str(Path(__file__).resolve().parent.parent)
+# 標準ライブラリ・インストール済みパッケージのディレクトリ（原因の特定では飛ばす）
+LIBRARY_DIRS = tuple(
+    {
+        path
+        for name, path in sysconfig.get_paths().items()
+        if name in ("stdlib", "platstdlib", "purelib", "platlib")
+    }
+)
+# 保持するスタックの深さ（内側から）
+STACK_LIMIT = 30
+
+
+def _culprit(frames: List[traceback.FrameSummary]) -> str:
+    """スタックの中で最も内側にある、ライブラリ以外のコードの位置"""
+    for frame in reversed(frames):
+        if frame.filename.startswith(LIBRARY_DIRS) or frame.filename.startswith("<"):
+            continue
+        path = frame.filename
+        if path.startswith(PROJECT_DIR):
+            path = os.path.relpath(path, PROJECT_DIR)
+        return f"{path}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+class LoopWatchdog:
+    """イベントループが止まったことを検出し、原因のスタックを記録するクラス"""
+
+    def __init__(
+        self, enabled: bool = False, threshold: float = 0.1, max_reports: int = 100
+    ):
+        """
+        Args:
+            enabled (bool, optional): 有効にするか
+            threshold (float, optional): 止まっているとみなす秒数
+            max_reports (int, optional): 保持する検出結果の件数
+        """
+        self.enabled = enabled
+        self.threshold = threshold
+        self.interval = threshold / 2  # 心拍の間隔
+        self.reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        self.by_route: Dict[str, Dict[str, Any]] = {}
+        # リクエストを処理しているタスク → (scope, ルーティング前の root_path)
+        self._task_scopes: "weakref.WeakKeyDictionary[asyncio.Task, tuple]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._captured_beat = 0.0  # スタックを取得済みの心拍（1 回の停止で 1 回だけ）
+        self._pending: Optional[Dict[str, Any]] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """監視を開始する（イベントループ上で呼ぶ。無効な場合は何もしない）"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+        logging.warning(
+            f"イベントループのウォッチドッグを有効にしました（閾値 {self.threshold} 秒）"
+        )
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def track(self, scope: dict) -> None:
+        """現在のタスクが処理しているリクエストを記録する（ルートの特定用）"""
+        task = asyncio.current_task()
+        if task is not None:
+            self._task_scopes[task] = (scope, scope.get("root_path", ""))
+
+    # --------------------------------------------------------------
+    # イベントループ側
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            # 前回の心拍から、本来の間隔を超えて遅れた時間が止まっていた時間
+            pending["duration"] = round(now - self._last_beat - self.interval, 3)
+            self._record(pending)
+        self._last_beat = now
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _record(self, report: Dict[str, Any]) -> None:
+        task = report.pop("task")
+        scope = self._task_scopes.get(task) if task is not None else None
+        if scope is not None:
+            report["method"] = scope[0].get("method", "WS")
+            report["route"] = route_label(*scope)
+            report["path"] = scope[0].get("path")
+        else:
+            # リクエスト以外（バックグラウンドタスクやコールバック）
+            report["route"] = f"task:{task.get_name()}" if task else "callback"
+        report["task"] = task.get_name() if task else None
+        self.reports.append(report)
+
+        stats = self.by_route.setdefault(
+            report["route"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        stats["count"] += 1
+        stats["total_seconds"] = round(stats["total_seconds"] + report["duration"], 3)
+        stats["max_seconds"] = max(stats["max_seconds"], report["duration"])
+        stats["last_culprit"] = report["culprit"]
+
+        logging.warning(
+            f"イベントループが {report['duration']:.3f} 秒止まりました: "
+            f"{report['route']} ({report['culprit']})\n" + "".join(report["stack"])
+        )
+
+    # --------------------------------------------------------------
+    # 監視スレッド側
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            last_beat = self._last_beat
+            if last_beat == self._captured_beat or self._pending is not None:
+                continue
+            if time.monotonic() - last_beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame)[-STACK_LIMIT:]
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                task = None
+            self._captured_beat = last_beat
+            # ルートの特定とログ出力はループが再開してから（ループのスレッドで）行う
+            self._pending = {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "culprit": _culprit(frames),
+                "stack": traceback.format_list(frames),
+                "task": task,
+            }
+
+    def summary(self) -> Dict[str, Any]:
+        """検出結果（新しい順）とルートごとの集計を返す（このワーカーの分だけ）"""
+        return {
+            "worker": os.getpid(),
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "by_route": self.by_route,
+            "stalls": list(reversed(self.reports)),
+        }
+
+
+class LoopWatchdogMiddleware:
+    """リクエストを処理するタスクとルートを対応付ける ASGI ミドルウェア"""
+
+    def __init__(self, app, watchdog: "LoopWatchdog"):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            self.watchdog.track(scope)
+        await self.app(scope, receive, send)
+
+
+loop_watchdog = LoopWatchdog(
+    enabled=os.getenv("LOOP_WATCHDOG", "0") == "1",
+    threshold=float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.1")),
+    max_reports=int(os.getenv("LOOP_WATCHDOG_MAX_REPORTS", "100")),
+)
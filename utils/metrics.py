@@ -0,0 +1,508 @@
+"""リクエストのレイテンシ・スループットの計測
+
+外部ライブラリを使わずに Prometheus のテキスト形式でメトリクスを出力します
+（app.py の /metrics）。1 リクエストあたりの処理は時刻の取得 2 回と
+ヒストグラムのバケット探索（二分探索）だけなので、計測自体のコストは小さく抑えています。
+
+主なメトリクス:
+    - http_request_duration_seconds{method, route, status}: ルート・ステータスごとの処理時間
+      （route はパスそのものではなく "/memo/{memo_id}" のようなルートのテンプレート）
+    - http_requests_in_flight / websocket_connections: 処理中のリクエスト数・接続数
+    - event_loop_lag_seconds: イベントループの遅れ（ブロッキング処理の検出用）
+    - upstream_request_duration_seconds{service, operation, outcome}:
+      外部呼び出し（openai / github / scraper / bcrypt / sqlite）にかかった時間
+
+メトリクスはワーカープロセスごとに記録されます。複数のワーカーで動かす場合
+（gunicorn.conf.py）は METRICS_DIR を設定すると、各ワーカーが自分の値を
+METRICS_DIR/<pid>.json に定期的に書き出し、/metrics は全ワーカーの値を合算して返します。
+
+環境変数（任意）:
+    - METRICS_TOKEN: 設定すると /metrics に Authorization: Bearer <token> を要求する
+    - METRICS_LOOP_LAG_INTERVAL: イベントループの遅れを測る間隔（秒、デフォルト 0.5）
+    - METRICS_DIR: ワーカーごとの値を書き出すディレクトリ（gunicorn.conf.py が設定する）
+    - METRICS_SYNC_INTERVAL: METRICS_DIR に書き出す間隔（秒、デフォルト 5）
+"""
+
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# レイテンシ用のバケット（秒）。LLM の応答を含むので長めまで用意する
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# イベントループの遅れ用のバケット（秒）
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY: List["Metric"] = []
+
+# 処理中のリクエストの ASGI scope（外部呼び出しをユーザー・ルートに結び付ける用。
+# SessionMiddleware やルーティングが同じ scope に session / route を書き込む）
+current_request_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "current_request_scope", default=None
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """メトリクスの基底クラス（生成すると REGISTRY に登録される）"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # スレッドプール（bcrypt・同期の DB セッション）からも記録されるのでロックで守る
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(サフィックス, ラベル文字列, 値) を返す"""
+
+    @abstractmethod
+    def snapshot(self) -> Any:
+        """ワーカー間で合算するための値（JSON にできる形）"""
+
+    @abstractmethod
+    def merged_samples(
+        self, snapshots: List[Tuple[bool, Any]]
+    ) -> Iterator[Tuple[str, str, float]]:
+        """各ワーカーの (動いているか, snapshot()) を合算した samples を返す"""
+
+    def render(self, samples: Optional[Iterator[Tuple[str, str, float]]] = None) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        if samples is None:
+            samples = self.samples()
+        for suffix, labels, value in samples:
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Gauge(Metric):
+    """増減する値（callback を渡すと出力時にその戻り値を使う）"""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Optional[Callable[[], float]] = None,
+        mode: str = "sum",
+    ):
+        """
+        Args:
+            name (str): メトリクス名
+            documentation (str): 説明
+            callback (Callable[[], float], optional): 出力時に値を返す関数
+            mode (str, optional): ワーカー間の合算方法（"sum" または "max"）。
+                終了したワーカーの値は含めない
+        """
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.mode = mode
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        yield "", "", self.snapshot()
+
+    def snapshot(self) -> float:
+        return self.callback() if self.callback is not None else self._value
+
+    def merged_samples(
+        self, snapshots: List[Tuple[bool, Any]]
+    ) -> Iterator[Tuple[str, str, float]]:
+        values = [value for alive, value in snapshots if alive]
+        if self.mode == "max":
+            yield "", "", max(values, default=0.0)
+        else:
+            yield "", "", sum(values)
+
+
+class Histogram(Metric):
+    """値の分布（バケットごとの件数・合計・件数）"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケットごとの件数（累積していない）..., +Inf の件数, 合計]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        return self._samples(values)
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [
+                [list(labels), list(counts)] for labels, counts in self._values.items()
+            ]
+
+    def merged_samples(
+        self, snapshots: List[Tuple[bool, Any]]
+    ) -> Iterator[Tuple[str, str, float]]:
+        # 件数・合計は累積値なので、終了したワーカーの分も含めて足す
+        merged: Dict[Tuple[str, ...], List[float]] = {}
+        for _, values in snapshots:
+            for labels, counts in values:
+                total = merged.setdefault(tuple(labels), [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        return self._samples(list(merged.items()))
+
+    def _samples(
+        self, values: List[Tuple[Tuple[str, ...], List[float]]]
+    ) -> Iterator[Tuple[str, str, float]]:
+        names = self.labelnames + ("le",)
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield "_bucket", _format_labels(names, labels + (le,)), cumulative
+            plain = _format_labels(self.labelnames, labels)
+            yield "_sum", plain, counts[-1]
+            yield "_count", plain, cumulative
+
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # 別ユーザーのプロセス（動いている）
+    return True
+
+
+def write_snapshot(directory: str) -> None:
+    """このワーカーの値を directory/<pid>.json に書き出す"""
+    pid = os.getpid()
+    data = {"pid": pid, "metrics": {m.name: m.snapshot() for m in REGISTRY}}
+    path = os.path.join(directory, f"{pid}.json")
+    # 読み込み中のワーカーが書きかけのファイルを読まないよう、書いてから置き換える
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _render_merged(directory: str) -> str:
+    write_snapshot(directory)
+    snapshots: Dict[str, List[Tuple[bool, Any]]] = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # 書き出し直後に消されたなど
+        alive = _pid_alive(data["pid"])
+        for name, value in data["metrics"].items():
+            snapshots.setdefault(name, []).append((alive, value))
+    return "\n".join(
+        metric.render(metric.merged_samples(snapshots.get(metric.name, [])))
+        for metric in REGISTRY
+    )
+
+
+def render() -> str:
+    """
+    登録されている全メトリクスを Prometheus のテキスト形式で返す
+
+    METRICS_DIR が設定されていれば全ワーカーの値を合算します（ファイルを読むので
+    イベントループからはスレッドで呼び出す）。
+    """
+    if METRICS_DIR:
+        return _render_merged(METRICS_DIR) + "\n"
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# ----------------------------------------------------------------------
+# メトリクス
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP リクエストの処理時間（レスポンスを送り終えるまで）",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "処理中の HTTP リクエスト数")
+WEBSOCKET_CONNECTIONS = Gauge("websocket_connections", "接続中の WebSocket の数")
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "イベントループの遅れ", buckets=LAG_BUCKETS
+)
+LOOP_LAG_LAST = Gauge(
+    "event_loop_lag_last_seconds",
+    "直近に測ったイベントループの遅れ（複数ワーカーでは最大値）",
+    mode="max",
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "外部呼び出し（OpenAI・GitHub・スクレイピング・bcrypt・SQLite）の処理時間",
+    ("service", "operation", "outcome"),
+)
+
+
+@contextlib.contextmanager
+def track_upstream(service: str, operation: str) -> Iterator[None]:
+    """
+    ブロック内の処理時間を外部呼び出しの時間として記録する
+
+    例外で抜けた場合は outcome="error" として記録します。
+
+    Args:
+        service (str): 呼び出し先（openai / github / scraper / bcrypt / sqlite）
+        operation (str): 操作の種類（HTTP メソッドや関数名など、種類が限られるもの）
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_DURATION.observe(
+            time.perf_counter() - started, service, operation, outcome
+        )
+
+
+def httpx_event_hooks(
+    service: str, operation: Callable[..., str] = lambda request: request.method
+) -> Dict[str, list]:
+    """
+    httpx クライアントの event_hooks に渡すと、レスポンスヘッダを受け取るまでの
+    時間を外部呼び出しの時間として記録する
+
+    Args:
+        service (str): 呼び出し先
+        operation (Callable[[httpx.Request], str], optional):
+            リクエストから操作の種類を返す関数（デフォルトは HTTP メソッド）
+
+    Returns:
+        Dict[str, list]: httpx の event_hooks
+    """
+
+    async def on_request(request) -> None:
+        request.extensions["metrics_started"] = time.perf_counter()
+
+    async def on_response(response) -> None:
+        started = response.request.extensions.get("metrics_started")
+        if started is None:
+            return
+        outcome = "error" if response.status_code >= 500 else "ok"
+        UPSTREAM_DURATION.observe(
+            time.perf_counter() - started,
+            service,
+            operation(response.request),
+            outcome,
+        )
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+# ----------------------------------------------------------------------
+# ミドルウェア
+
+
+def route_label(scope: dict, root_path: str = "") -> str:
+    """
+    リクエストのルートのテンプレート（"/memo/{memo_id}" など）を返す
+
+    パスをそのままラベルにすると種類が際限なく増えるので、ルーティング後に
+    scope に入るルートのパスを使います。
+
+    Args:
+        scope (dict): ASGI の scope（ルーティング後）
+        root_path (str, optional): ルーティング前の root_path
+
+    Returns:
+        str: ルートのテンプレート、マウント先のパス、または "unmatched"
+    """
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    mounted = scope.get("root_path", "")
+    if mounted != root_path:
+        return mounted[len(root_path) :]  # /static などのマウント先
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """リクエストごとの処理時間・処理中の件数を記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            current_request_scope.set(scope)
+        if scope["type"] == "websocket":
+            WEBSOCKET_CONNECTIONS.inc()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                WEBSOCKET_CONNECTIONS.dec()
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        root_path = scope.get("root_path", "")
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route_label(scope, root_path),
+                str(status_code),
+            )
+
+
+class LoopLagMonitor:
+    """一定間隔で sleep し、予定より遅れた時間をイベントループの遅れとして記録する"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - started - self.interval, 0.0)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+loop_lag_monitor = LoopLagMonitor(float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5")))
+
+
+class SnapshotWriter:
+    """METRICS_DIR にこのワーカーの値を定期的に書き出す（ほかのワーカーの /metrics 用）"""
+
+    def __init__(self, directory: Optional[str], interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.directory and self._task is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(write_snapshot, self.directory)
+            except OSError as e:
+                logging.warning(f"メトリクスを書き出せませんでした: {e}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            # 終了するまでの分を残す（ヒストグラムは終了したワーカーの分も合算する）
+            with contextlib.suppress(OSError):
+                write_snapshot(self.directory)
+
+
+snapshot_writer = SnapshotWriter(
+    METRICS_DIR, float(os.getenv("METRICS_SYNC_INTERVAL", "5"))
+)
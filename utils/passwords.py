@@ -0,0 +1,167 @@
+"""パスワードのハッシュ化・検証（専用スレッドプールで実行）
+
+bcrypt は意図的に重い処理（1 回数百ミリ秒）なので、イベントループ上で直接
+実行すると同時ログインの間ほかのリクエストがすべて止まります。
+ここではサイズを制限した専用スレッドプールで実行し（bcrypt の計算中は GIL が
+解放されるためスレッドで並列に動きます）、待ち行列が一杯の場合はすぐに
+PasswordPoolBusy を送出して 503 で断ります。
+
+環境変数（任意）:
+    - PASSWORD_HASH_WORKERS: スレッド数（デフォルト min(4, CPU 数)）
+    - PASSWORD_HASH_MAX_QUEUE: スレッドの空き待ちを許す件数（デフォルト 32）
+    - PASSWORD_BCRYPT_ROUNDS: bcrypt のコスト（デフォルト 12。これより低いコストの
+      ハッシュはログイン成功時に作り直す）
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from passlib.context import CryptContext
+
+from utils.metrics import Gauge, track_upstream
+
+T = TypeVar("T")
+
+# bcrypt のコスト（2 の指数。1 増やすと計算時間が約 2 倍）
+BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+# 既定以外の方式（deprecated="auto"）やコスト不足（min_rounds 未満）のハッシュは
+# 検証成功時に verify_and_update が作り直したハッシュを返す
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordPoolBusy(Exception):
+    """パスワード処理の待ち行列が一杯のときに送出される例外"""
+
+
+class PasswordHasher:
+    """パスワード処理をサイズ制限付きのスレッドプールで実行するクラス"""
+
+    def __init__(
+        self,
+        context: CryptContext = pwd_context,
+        workers: int = 4,
+        max_queue: int = 32,
+    ):
+        """
+        Args:
+            context (CryptContext, optional): ハッシュ方式の設定
+            workers (int, optional): 同時に実行する処理の数
+            max_queue (int, optional): スレッドの空き待ちを許す件数
+        """
+        self.context = context
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password"
+        )
+        self._lock = threading.Lock()
+        # 受け付け済み（実行中＋待ち）の件数
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    async def _submit(self, fn: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise PasswordPoolBusy("パスワード処理の待ち行列が一杯です")
+            self._pending += 1
+        submitted_at = time.perf_counter()
+
+        def run() -> T:
+            started_at = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self._wait_total += started_at - submitted_at
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._run_total += time.perf_counter() - started_at
+
+        def release(_: Future) -> None:
+            # 待っていたリクエストがキャンセルされても実行中の処理は止まらないので、
+            # 枠は処理が終わった（または実行前に取り消された）ときに返す
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+
+        future = self._executor.submit(run)
+        future.add_done_callback(release)
+        # 待ち行列で待った時間も含めて記録する（リクエストが待たされる時間）
+        with track_upstream("bcrypt", fn.__name__):
+            return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        """
+        パスワードをハッシュ化する
+
+        Raises:
+            PasswordPoolBusy: 待ち行列が一杯の場合
+        """
+        return await self._submit(self.context.hash, password)
+
+    async def verify_and_update(
+        self, password: str, hashed: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        パスワードを検証し、ハッシュが古い設定なら作り直したハッシュも返す
+
+        Args:
+            password (str): 入力されたパスワード
+            hashed (str): 保存されているハッシュ
+
+        Returns:
+            Tuple[bool, Optional[str]]: (検証結果, 新しいハッシュ。作り直し不要なら None)
+
+        Raises:
+            PasswordPoolBusy: 待ち行列が一杯の場合
+        """
+        return await self._submit(self.context.verify_and_update, password, hashed)
+
+    def stats(self) -> Dict[str, float]:
+        """待ち行列の長さや処理時間などの統計を返す"""
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": self._wait_total / completed,
+                "avg_run_seconds": self._run_total / completed,
+            }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_password_hasher() -> PasswordHasher:
+    """環境変数の設定に従ってパスワード処理用のプールを生成する関数"""
+    workers = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    max_queue = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+    return PasswordHasher(workers=workers, max_queue=max_queue)
+
+
+password_hasher = create_password_hasher()
+
+Gauge(
+    "password_hash_queued",
+    "スレッドの空きを待っているパスワード処理の数",
+    callback=lambda: password_hasher.stats()["queued"],
+)
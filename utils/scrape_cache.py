@@ -0,0 +1,399 @@
+"""スクレイピング結果の共有キャッシュ
+
+同じ検索条件（キー）のスクレイピング結果を全接続で共有し、上流への取得と
+解析を接続数に関係なく 1 回にまとめます。
+
+- 同じキーのスクレイピングは同時に 1 つだけ実行する（single-flight）。
+  実行中に来た接続は、それまでに取得できた行を受け取り、以降の行を一緒に受け取る
+- 取得から ttl 秒以内の結果は上流に取りに行かずそのまま返す
+- ttl を過ぎた結果もすぐに返し、裏で取得し直す（stale-while-revalidate）。
+  誰も購読していないまま ttl + stale_ttl 秒経った結果は破棄する
+- 購読中の接続がある間は ttl ごとに取得し直し、内容が変わったときだけ差分を送る。
+  取得に失敗した場合は間隔を倍々に延ばす（上限 max_retry_delay 秒）
+
+スクレイピング関数はキーを受け取り、送信用のメッセージ
+（rows / page_error / progress）を順に返す非同期ジェネレータです。
+以前に取得した結果を返す場合は、最初に {"type": "fetched", "age": 取得からの秒数} を
+返します（購読者には送らず、結果の取得時刻として使う）。
+購読者は send(message)（送れるまで待つ）と send_nowait(message)（詰まっていれば
+捨てる）を持つオブジェクトです（routers/dl.py の ScrapeSession）。
+
+ListingCache はワーカープロセスごとに持つので、複数のワーカーで動かす場合は
+スクレイピング関数を shared_scraper で包み、取得結果を共有ストア経由で
+ワーカー間でも使い回します。
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import operator
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from utils.shared_state import SharedState
+
+Row = Any  # utils.listing_parser.ListingRow など
+Scraper = Callable[[str], AsyncIterator[Dict[str, Any]]]
+
+
+@dataclass(eq=False)
+class CacheEntry:
+    """1 つのキーのキャッシュ"""
+
+    key: str
+    # ページ番号ごとの行（購読者の手元にある内容と常に一致させる）
+    pages: Dict[int, List[Row]] = field(default_factory=dict)
+    has_data: bool = False  # 一度でもスクレイピングが終わったか
+    fetched_at: Optional[float] = None  # 全ページを取得できた時刻
+    checked_at: Optional[float] = None  # 最後にスクレイピングが終わった時刻
+    failures: int = 0  # 連続して失敗した回数（失敗したページがある場合も含む）
+    subscribers: Set[Any] = field(default_factory=set)
+    task: Optional[asyncio.Task] = None  # 実行中のスクレイピング
+    refresher: Optional[asyncio.Task] = None
+
+
+class ListingCache:
+    """検索結果のスクレイピングをキーごとに共有・キャッシュするクラス"""
+
+    def __init__(
+        self,
+        scrape: Scraper,
+        ttl: float = 60.0,
+        stale_ttl: float = 600.0,
+        chunk_size: int = 10,
+        row_key: Callable[[Row], Any] = operator.attrgetter("link"),
+        max_retry_delay: float = 600.0,
+    ):
+        """
+        Args:
+            scrape (Scraper): キーを受け取りメッセージを返す非同期ジェネレータ関数
+            ttl (float, optional): 結果を新しいとみなす秒数
+            stale_ttl (float, optional): ttl を過ぎた結果を保持しておく秒数
+            chunk_size (int, optional): キャッシュ済みの行を送るときの 1 メッセージの行数
+            row_key (Callable[[Row], Any], optional):
+                差分を取るときに行を識別する値を返す関数（デフォルトは row.link）
+            max_retry_delay (float, optional): 失敗が続いたときの再取得間隔の上限（秒）
+        """
+        self.scrape = scrape
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.chunk_size = chunk_size
+        self.row_key = row_key
+        self.max_retry_delay = max_retry_delay
+        self._entries: Dict[str, CacheEntry] = {}
+
+    def _rows(self, pages: Dict[int, List[Row]]) -> List[Row]:
+        """ページ順の行（ページをまたいで重複した行は最初のものだけ）"""
+        rows = []
+        seen = set()
+        for page in sorted(pages):
+            for row in pages[page]:
+                key = self.row_key(row)
+                if key not in seen:
+                    seen.add(key)
+                    rows.append(row)
+        return rows
+
+    def _is_fresh(self, entry: CacheEntry) -> bool:
+        return (
+            entry.fetched_at is not None
+            and time.monotonic() - entry.fetched_at < self.ttl
+        )
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if (
+                not entry.subscribers
+                and entry.task is None
+                and entry.checked_at is not None
+                and now - entry.checked_at > self.ttl + self.stale_ttl
+            ):
+                del self._entries[key]
+
+    def _entry(self, key: str) -> CacheEntry:
+        self._purge()
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = CacheEntry(key)
+        return entry
+
+    def _refresh(self, entry: CacheEntry) -> asyncio.Task:
+        """スクレイピングを開始する（実行中ならそのタスクを返す）"""
+        if entry.task is None:
+            entry.task = asyncio.create_task(self._scrape(entry))
+            # 差分を送り終えるまでを 1 回のスクレイピングとみなす
+            entry.task.add_done_callback(lambda _: setattr(entry, "task", None))
+        return entry.task
+
+    async def watch(self, key: str, subscriber: Any) -> None:
+        """
+        キーの結果を購読する
+
+        キャッシュ済みの行をすぐに送り、以降は内容が変わるたびに差分を送ります。
+        キャンセルされる（接続が閉じられる）まで戻りません。
+
+        Args:
+            key (str): 検索条件
+            subscriber (Any): send / send_nowait を持つ送信先
+        """
+        entry = self._entry(key)
+        # 手元の行の取り出しと購読の登録の間に await を挟まない
+        # （その間に届いた行を取りこぼしたり二重に送ったりしないため）
+        snapshot = self._rows(entry.pages)
+        cached = entry.has_data
+        entry.subscribers.add(subscriber)
+        if entry.refresher is None:
+            entry.refresher = asyncio.create_task(self._refresh_loop(entry))
+        try:
+            for i in range(0, len(snapshot), self.chunk_size):
+                chunk = snapshot[i : i + self.chunk_size]
+                await subscriber.send({"type": "rows", "data": chunk})
+            if cached:
+                age = time.monotonic() - (entry.fetched_at or entry.checked_at)
+                await subscriber.send(
+                    {
+                        "type": "done",
+                        "total": len(snapshot),
+                        "cached": True,
+                        "age": round(age, 1),
+                    }
+                )
+            await asyncio.Event().wait()
+        finally:
+            entry.subscribers.discard(subscriber)
+            if not entry.subscribers and entry.refresher is not None:
+                entry.refresher.cancel()
+                entry.refresher = None
+
+    def _retry_delay(self, entry: CacheEntry) -> float:
+        """最後の取得から次の取得までの秒数（失敗が続くほど長くする）"""
+        if entry.failures == 0:
+            return self.ttl
+        delay = self.ttl * 2 ** (entry.failures - 1)
+        return min(delay, max(self.ttl, self.max_retry_delay))
+
+    async def _refresh_loop(self, entry: CacheEntry) -> None:
+        # 購読者がいる間、ttl ごとに取得し直す（古ければすぐに）
+        while True:
+            if entry.task is not None or not self._is_fresh(entry):
+                await asyncio.shield(self._refresh(entry))
+            # 取得できていれば結果の取得時刻（別のワーカーの結果なら最後に試した時刻より
+            # 前）から、失敗した場合は最後に試した時刻から数える
+            # （失敗が続いても取得し直しを繰り返さない）
+            base = entry.checked_at if entry.failures else entry.fetched_at
+            delay = base + self._retry_delay(entry)
+            await asyncio.sleep(max(delay - time.monotonic(), 0.0))
+
+    async def _publish(self, entry: CacheEntry, message: Dict[str, Any]) -> None:
+        """全購読者に送る（送れなかった購読者は外す）"""
+        subscribers = list(entry.subscribers)
+        results = await asyncio.gather(
+            *(subscriber.send(message) for subscriber in subscribers),
+            return_exceptions=True,
+        )
+        for subscriber, result in zip(subscribers, results):
+            if isinstance(result, Exception):
+                entry.subscribers.discard(subscriber)
+
+    async def _scrape(self, entry: CacheEntry) -> None:
+        # 初回は取得できた行をそのまま流し、2 回目以降は終わってから差分だけ送る
+        streaming = not entry.has_data
+        pages = entry.pages if streaming else {}
+        failed_pages = set()
+        failed = False
+        fetched_at = None  # 以前に取得した結果の場合はその取得時刻
+        try:
+            async with contextlib.aclosing(self.scrape(entry.key)) as messages:
+                async for message in messages:
+                    kind = message["type"]
+                    if kind == "fetched":
+                        fetched_at = time.monotonic() - message["age"]
+                        continue
+                    if kind == "rows":
+                        pages.setdefault(message["page"], []).extend(message["data"])
+                    elif kind == "page_error":
+                        failed_pages.add(message["page"])
+                    if not streaming:
+                        continue
+                    if kind == "progress":
+                        for subscriber in list(entry.subscribers):
+                            subscriber.send_nowait(message)
+                    else:
+                        await self._publish(entry, message)
+        except Exception as e:
+            logging.warning(f"スクレイピングに失敗しました ({entry.key}): {e}")
+            failed = True
+            if streaming:
+                await self._publish(entry, {"type": "error", "message": str(e)})
+        finally:
+            entry.checked_at = time.monotonic()
+
+        if not failed and not failed_pages:
+            entry.fetched_at = entry.checked_at if fetched_at is None else fetched_at
+            entry.failures = 0
+        else:
+            entry.failures += 1
+        if streaming:
+            entry.has_data = True
+            await self._publish(
+                entry, {"type": "done", "total": len(self._rows(entry.pages))}
+            )
+            return
+
+        # 取得できなかったページは前回の行を残す
+        old_rows = self._rows(entry.pages)
+        for page in failed_pages:
+            if page in entry.pages:
+                pages.setdefault(page, entry.pages[page])
+        if failed:
+            return  # 途中で失敗した場合は前回の内容を保つ
+        entry.pages = dict(sorted(pages.items()))
+        diff = self._diff(old_rows, self._rows(entry.pages))
+        if diff is not None:
+            await self._publish(entry, diff)
+
+    def _diff(self, old: List[Row], new: List[Row]) -> Optional[Dict[str, Any]]:
+        """行の差分メッセージ（変化がなければ None）"""
+        old_by_key = {self.row_key(row): row for row in old}
+        new_by_key = {self.row_key(row): row for row in new}
+        added = [row for key, row in new_by_key.items() if key not in old_by_key]
+        updated = [
+            row
+            for key, row in new_by_key.items()
+            if key in old_by_key and old_by_key[key] != row
+        ]
+        removed = [key for key in old_by_key if key not in new_by_key]
+        if not (added or updated or removed):
+            return None
+        return {
+            "type": "diff",
+            "added": added,
+            "updated": updated,
+            "removed": removed,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            key: {
+                "rows": len(self._rows(entry.pages)),
+                "subscribers": len(entry.subscribers),
+                "age": (
+                    None
+                    if entry.fetched_at is None
+                    else round(now - entry.fetched_at, 1)
+                ),
+                "refreshing": entry.task is not None,
+            }
+            for key, entry in self._entries.items()
+        }
+
+    async def close(self) -> None:
+        """実行中のスクレイピングと再取得をキャンセルする（アプリ終了時用）"""
+        tasks = []
+        for entry in self._entries.values():
+            tasks.extend(task for task in (entry.task, entry.refresher) if task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def shared_scraper(
+    scrape: Scraper,
+    state: SharedState,
+    ttl: float,
+    encode_row: Callable[[Row], Any],
+    decode_row: Callable[[Any], Row],
+    lock_ttl: float = 60.0,
+    poll_interval: float = 0.25,
+) -> Scraper:
+    """
+    スクレイピングの結果をワーカー間で共有するよう scrape を包む
+
+    - 別のワーカーが ttl 秒以内に取得した結果があれば、上流に取りに行かずに
+      その時のメッセージをそのまま返す
+    - 取得は同時に 1 つのワーカーだけが行い（共有ストアの add で排他）、
+      ほかのワーカーはその結果が保存されるのを待つ
+    - 全ページを取得できた結果だけを保存する（失敗したページがあれば各ワーカーが取り直す）
+
+    Args:
+        scrape (Scraper): 元のスクレイピング関数
+        state (SharedState): 結果を置く共有ストア
+        ttl (float): 保存した結果を使い回す秒数
+        encode_row (Callable[[Row], Any]): 行を JSON にできる値にする関数
+        decode_row (Callable[[Any], Row]): encode_row の逆
+        lock_ttl (float, optional): 取得中の印の有効期限（秒。取得にかかる時間の上限）
+        poll_interval (float, optional): 別のワーカーの結果を待つときの確認間隔（秒）
+
+    Returns:
+        Scraper: 包んだスクレイピング関数
+    """
+
+    async def load(snapshot_key: str) -> Optional[List[Dict[str, Any]]]:
+        data = await state.get(snapshot_key)
+        if data is None:
+            return None
+        snapshot = json.loads(data)
+        age = time.time() - snapshot["fetched_at"]
+        if age >= ttl:
+            return None
+        messages = snapshot["messages"]
+        for message in messages:
+            if message["type"] == "rows":
+                message["data"] = [decode_row(row) for row in message["data"]]
+        # 取得した時刻を伝える（ListingCache が今取得した結果として扱わないように）
+        return [{"type": "fetched", "age": max(age, 0.0)}] + messages
+
+    async def scrape_shared(key: str) -> AsyncIterator[Dict[str, Any]]:
+        snapshot_key = f"scrape:{key}"
+        lock_key = f"scrape-lock:{key}"
+        # 取得中の印には自分だけの値を入れ、自分の印だけを消す
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        owned = False
+        deadline = time.monotonic() + lock_ttl
+        while True:
+            messages = await load(snapshot_key)
+            if messages is not None:
+                for message in messages:
+                    yield message
+                return
+            owned = await state.add(lock_key, token, lock_ttl)
+            if owned:
+                break
+            if time.monotonic() >= deadline:
+                break  # 取得中のワーカーが応答しない（印の期限内に終わらない）ので自分で取る
+            await asyncio.sleep(poll_interval)
+
+        recorded = []
+        complete = False
+        try:
+            async with contextlib.aclosing(scrape(key)) as messages:
+                async for message in messages:
+                    if message["type"] == "page_error":
+                        recorded = None
+                    elif recorded is not None:
+                        if message["type"] == "rows":
+                            rows = [encode_row(row) for row in message["data"]]
+                            recorded.append({**message, "data": rows})
+                        else:
+                            recorded.append(message)
+                    yield message
+            complete = recorded is not None
+        finally:
+            try:
+                if complete:
+                    snapshot = {"fetched_at": time.time(), "messages": recorded}
+                    await state.set(snapshot_key, json.dumps(snapshot), ttl)
+                if owned:
+                    await state.delete_if(lock_key, token)
+            except Exception as e:
+                logging.warning(
+                    f"スクレイピング結果を共有できませんでした ({key}): {e}"
+                )
+
+    return scrape_shared
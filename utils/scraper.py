@@ -0,0 +1,174 @@
+"""複数ページのスクレイピング
+
+共有の aiohttp セッションで複数ページを並行して取得し、取得できたページから
+順に返します（全ページの完了を待たない）。
+
+- 同時に取得するページ数を制限（Semaphore）
+- 同じホストへのリクエストは最低 min_interval 秒の間隔を空ける（相手サーバーへの配慮）
+- 接続エラー・タイムアウト・429 / 5xx はジッター付きの指数バックオフで再試行
+  （429 / 503 で Retry-After が返された場合はその秒数を待つ）
+"""
+
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.metrics import track_upstream
+
+# 再試行するレスポンスのステータス
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+
+class PageFetchError(Exception):
+    """再試行してもページを取得できなかった場合の例外"""
+
+    def __init__(self, url: str, cause: Exception):
+        super().__init__(f"{url}: {cause}")
+        self.url = url
+        self.cause = cause
+
+
+class HostRateLimiter:
+    """ホストごとにリクエストの開始間隔を空けるクラス"""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last: Dict[str, float] = {}
+
+    async def wait(self, host: str) -> None:
+        """前回のリクエストから min_interval 秒経つまで待つ"""
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self._last.get(host, 0.0) + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last[host] = time.monotonic()
+
+
+class PageFetcher:
+    """複数ページを並行して取得するクラス"""
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        min_interval: float = 0.2,
+        retries: int = 2,
+        timeout: float = 30.0,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            concurrency (int, optional): 同時に取得するページ数
+            min_interval (float, optional): 同じホストへのリクエスト間隔（秒）
+            retries (int, optional): 再試行回数
+            timeout (float, optional): 1 リクエストのタイムアウト秒数
+            headers (Dict[str, str], optional): 全リクエストに付けるヘッダ
+        """
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.headers = headers or {"User-Agent": "Mozilla/5.0"}
+        self.rate_limiter = HostRateLimiter(min_interval)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.concurrency * 2, limit_per_host=self.concurrency
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+        return self._session
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+    async def fetch(self, url: str, params: Optional[Dict[str, str]] = None) -> str:
+        """
+        ページの HTML を取得する（同時取得数・ホストごとの間隔を守り、失敗時は再試行）
+
+        Args:
+            url (str): 取得する URL
+            params (Dict[str, str], optional): クエリパラメータ
+
+        Returns:
+            str: レスポンス本文
+
+        Raises:
+            PageFetchError: 再試行しても取得できなかった場合
+        """
+        host = urlsplit(url).netloc
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await self.rate_limiter.wait(host)
+                retry_after = None
+                try:
+                    with track_upstream("scraper", "GET"):
+                        async with self._get_session().get(url, params=params) as res:
+                            if res.status in RETRY_STATUSES and attempt < self.retries:
+                                retry_after = res.headers.get("Retry-After")
+                                raise aiohttp.ClientResponseError(
+                                    res.request_info, res.history, status=res.status
+                                )
+                            res.raise_for_status()
+                            return await res.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retryable = not isinstance(e, aiohttp.ClientResponseError) or (
+                        e.status in RETRY_STATUSES
+                    )
+                    if not retryable or attempt >= self.retries:
+                        raise PageFetchError(url, e) from e
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+                attempt += 1
+
+    async def fetch_all(
+        self, urls: Iterable[Tuple[int, str]]
+    ) -> AsyncIterator[Tuple[int, str, Optional[str], Optional[Exception]]]:
+        """
+        複数ページを並行して取得し、取得できた順に返す非同期ジェネレータ
+
+        途中で呼び出し元がやめた場合（クライアント切断など）は残りの取得を中止します。
+
+        Args:
+            urls (Iterable[Tuple[int, str]]): (ページ番号, URL) の一覧
+
+        Yields:
+            Tuple[int, str, Optional[str], Optional[Exception]]:
+                (ページ番号, URL, 本文, 失敗した場合の例外)
+        """
+
+        async def fetch_page(page: int, url: str):
+            try:
+                return page, url, await self.fetch(url), None
+            except PageFetchError as e:
+                return page, url, None, e
+
+        tasks = [asyncio.create_task(fetch_page(page, url)) for page, url in urls]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
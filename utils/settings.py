@@ -0,0 +1,96 @@
+"""アプリ設定（config.json）の読み込み
+
+config.json は起動時に一度だけ読み込み、以後はメモリ上の Settings を返します。
+ファイルの更新時刻を一定間隔で確認し、変更されていれば読み込み直します
+（SIGHUP を受けた場合も読み込み直します）。再起動せずに showLLMGreeting などを
+切り替えられます。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+CONFIG_PATH = "config.json"
+# 更新時刻を確認する最短間隔（秒）
+CHECK_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class Settings:
+    """config.json の内容"""
+
+    show_llm_greeting: bool = True
+    chat_model: str = "gpt-4.1"
+    search_model: str = "gpt-4o-search-preview"
+    # モデルごとの単価（100 万トークンあたりの USD）: {"gpt-4.1": {"prompt": 2.0, "completion": 8.0}}
+    llm_prices: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "Settings":
+        return cls(
+            show_llm_greeting=bool(config.get("showLLMGreeting", True)),
+            chat_model=config.get("OPEN_AI_CHAT_MODEL", "gpt-4.1"),
+            search_model=config.get("OPEN_AI_SERARCH_MODEL", "gpt-4o-search-preview"),
+            llm_prices=dict(config.get("LLM_PRICES", {})),
+        )
+
+
+class SettingsLoader:
+    """config.json を読み込み、変更があれば自動で読み込み直すクラス"""
+
+    def __init__(self, path: str = CONFIG_PATH, check_interval: float = CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._settings: Optional[Settings] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def _stat_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def reload(self) -> Settings:
+        """config.json を読み込み直す（失敗した場合は直前の設定を維持）"""
+        with self._lock:
+            mtime = self._stat_mtime()
+            try:
+                with open(self.path, "r") as f:
+                    settings = Settings.from_dict(json.load(f))
+            except Exception as e:
+                if self._settings is None:
+                    settings = Settings()
+                else:
+                    logging.warning(f"config.json の読み込みに失敗しました: {e}")
+                    settings = self._settings
+            self._settings = settings
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+            return settings
+
+    def get(self) -> Settings:
+        """現在の設定を返す（更新時刻の確認は check_interval 秒に 1 回だけ）"""
+        settings = self._settings
+        if settings is None:
+            return self.reload()
+
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self._stat_mtime() != self._mtime:
+                return self.reload()
+        return settings
+
+
+settings_loader = SettingsLoader()
+
+
+def get_settings() -> Settings:
+    """プロセス共有の設定を返す"""
+    return settings_loader.get()
@@ -0,0 +1,280 @@
+"""ワーカープロセス間で共有する状態
+
+複数のワーカープロセス（gunicorn.conf.py）で動かすと、プロセス内のメモリに置いた
+状態はワーカーごとに別々になります。ジョブの進捗やスクレイピング結果のように
+どのワーカーからも見える必要がある状態は、この共有ストアに置きます。
+
+値は文字列（JSON など）で、キーごとに有効期限を付けられます。add は
+キーが無い（または期限切れの）場合だけ書き込むので、ワーカー間の排他
+（1 つのワーカーだけが処理を実行する）に使えます。
+
+バックエンド:
+    - MemorySharedState: プロセス内のメモリ（ワーカーが 1 つの場合だけ）
+    - SQLiteSharedState: SQLite ファイル（同じマシンのワーカー間で共有）
+    - RedisSharedState: Redis 互換サーバー（redis パッケージが必要）
+
+環境変数（任意）:
+    - SHARED_STATE: "sqlite"（デフォルト）、"memory" または "redis"
+    - SHARED_STATE_PATH: SQLite ファイルのパス（デフォルト ./shared_state.db）
+    - SHARED_STATE_URL: Redis の URL（デフォルト redis://localhost:6379/0）
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+
+def worker_count() -> int:
+    """起動するワーカープロセス数（WEB_CONCURRENCY。gunicorn.conf.py が設定する）"""
+    return int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+class SharedState(ABC):
+    """共有ストアの基底クラス"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """値を取得する（存在しない・期限切れの場合は None）"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """値を保存する（ttl 秒後に期限切れ。None なら期限なし）"""
+
+    @abstractmethod
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """キーが無い（または期限切れの）場合だけ保存し、保存できたかを返す"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """値を削除する"""
+
+    @abstractmethod
+    async def delete_if(self, key: str, value: str) -> bool:
+        """値が value のときだけ削除し、削除したかを返す（自分が取った印だけを消す）"""
+
+    async def close(self) -> None:
+        """接続を閉じる（アプリ終了時用）"""
+
+
+class MemorySharedState(SharedState):
+    """プロセス内のメモリに保持するストア（ワーカーが 1 つの場合だけ使える）"""
+
+    def __init__(self):
+        # key -> (値, 期限の時刻)。期限切れの値は読むときに消す
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def _alive(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        return None if ttl is None else time.monotonic() + ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._alive(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._values[key] = (value, self._expires_at(ttl))
+
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if self._alive(key) is not None:
+            return False
+        self._values[key] = (value, self._expires_at(ttl))
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        if self._alive(key) != value:
+            return False
+        del self._values[key]
+        return True
+
+
+class SQLiteSharedState(SharedState):
+    """SQLite ファイルに保持するストア（ブロッキング I/O はスレッドで実行）"""
+
+    # set 何回ごとに期限切れの値を掃除するか
+    PURGE_INTERVAL = 200
+
+    def __init__(self, path: str = "./shared_state.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        # 別プロセスが書き込み中なら busy_timeout まで待つ
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL)"
+            )
+            self._conn.commit()
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        # プロセス間で比べるので monotonic ではなく time.time() を使う
+        return None if ttl is None else time.time() + ttl
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_state"
+                " WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: Optional[float], only_new: bool) -> bool:
+        now = time.time()
+        sql = (
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET"
+            " value = excluded.value, expires_at = excluded.expires_at"
+        )
+        params = (key, value, self._expires_at(ttl))
+        if only_new:
+            # 既存の値は期限切れの場合だけ上書きする
+            sql += " WHERE expires_at IS NOT NULL AND expires_at <= ?"
+            params += (now,)
+        with self._lock:
+            changed = self._conn.execute(sql, params).rowcount > 0
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                self._conn.execute(
+                    "DELETE FROM shared_state WHERE expires_at <= ?", (now,)
+                )
+            self._conn.commit()
+        return changed
+
+    def _delete(self, key: str, value: Optional[str] = None) -> bool:
+        sql = "DELETE FROM shared_state WHERE key = ?"
+        params: Tuple[str, ...] = (key,)
+        if value is not None:
+            sql += " AND value = ?"
+            params += (value,)
+        with self._lock:
+            deleted = self._conn.execute(sql, params).rowcount > 0
+            self._conn.commit()
+        return deleted
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl, False)
+
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return await asyncio.to_thread(self._set, key, value, ttl, True)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        return await asyncio.to_thread(self._delete, key, value)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSharedState(SharedState):
+    """Redis 互換サーバーに保持するストア（複数のマシンでも共有できる）"""
+
+    # 値の比較と削除を 1 回の操作で行う（その間に別のワーカーが書き換えないように）
+    DELETE_IF_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "app:"):
+        """
+        Args:
+            url (str, optional): Redis の URL
+            prefix (str, optional): キーの接頭辞（ほかのアプリとの衝突を避ける）
+
+        Raises:
+            RuntimeError: redis パッケージがインストールされていない場合
+        """
+        # redis はオプション（読み込むだけでメモリを使うので、使うときだけ読み込む）
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            raise RuntimeError("Redis のバックエンドには redis パッケージが必要です")
+        self.prefix = prefix
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+
+    def _ttl_ms(self, ttl: Optional[float]) -> Optional[int]:
+        return None if ttl is None else max(int(ttl * 1000), 1)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        await self._client.set(self.prefix + key, value, px=self._ttl_ms(ttl))
+
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return bool(
+            await self._client.set(
+                self.prefix + key, value, px=self._ttl_ms(ttl), nx=True
+            )
+        )
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self.prefix + key)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        deleted = await self._client.eval(
+            self.DELETE_IF_SCRIPT, 1, self.prefix + key, value
+        )
+        return bool(deleted)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_shared_state() -> SharedState:
+    """
+    環境変数の設定に従って共有ストアを生成する関数
+
+    Returns:
+        SharedState: 共有ストア
+
+    Raises:
+        ValueError: SHARED_STATE に未知のバックエンド名が指定された場合
+    """
+    backend = os.getenv("SHARED_STATE", "sqlite")
+    if backend == "memory":
+        if worker_count() > 1:
+            logging.warning(
+                "SHARED_STATE=memory はワーカー間で共有されません（WEB_CONCURRENCY > 1）"
+            )
+        return MemorySharedState()
+    if backend == "sqlite":
+        return SQLiteSharedState(os.getenv("SHARED_STATE_PATH", "./shared_state.db"))
+    if backend == "redis":
+        return RedisSharedState(
+            os.getenv("SHARED_STATE_URL", "redis://localhost:6379/0")
+        )
+    raise ValueError(f"未知の SHARED_STATE です: {backend}")
+
+
+@lru_cache(maxsize=None)
+def get_shared_state() -> SharedState:
+    """アプリ全体で共有する共有ストア（最初の呼び出しで生成する）"""
+    return create_shared_state()
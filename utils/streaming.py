@@ -0,0 +1,120 @@
+"""SSE ストリーミング用ヘルパ
+
+上流（OpenAI など）から届くトークンを別タスクで受信して有界キューに積み、
+時間・サイズの予算でまとめてから SSE フレームとして送り出します。
+
+- キューが一杯になると上流の読み込みを止める（バックプレッシャー）
+- 細かい差分を 1 フレームにまとめてフレーム数を減らす
+- 下流（クライアント）が切断されると上流のリクエストもキャンセルする
+"""
+
+import asyncio
+import json
+from contextlib import suppress
+from typing import Any, AsyncIterator, Dict
+
+# 1 フレームにまとめる最大文字数
+FRAME_MAX_CHARS = 256
+# 最初の差分を受け取ってからフレームを送り出すまでの最大待ち時間（秒）
+FRAME_MAX_INTERVAL = 0.05
+# 上流と下流の間に溜めておける差分の最大数
+QUEUE_MAX_SIZE = 64
+
+_DONE = object()
+
+
+def sse_event(data: Dict[str, Any]) -> str:
+    """辞書を SSE の data フレームに変換する"""
+    return f"data: {json.dumps(data)}\n\n"
+
+
+async def coalesce_stream(
+    source: AsyncIterator[str],
+    max_chars: int = FRAME_MAX_CHARS,
+    max_interval: float = FRAME_MAX_INTERVAL,
+    queue_size: int = QUEUE_MAX_SIZE,
+) -> AsyncIterator[str]:
+    """
+    上流の差分を時間・サイズの予算でまとめて返す非同期ジェネレータ
+
+    Args:
+        source (AsyncIterator[str]): 差分文字列を返す上流の非同期イテレータ
+        max_chars (int, optional): 1 フレームの最大文字数
+        max_interval (float, optional): フレームを送り出すまでの最大待ち時間（秒）
+        queue_size (int, optional): 上流と下流の間のキューの長さ
+
+    Yields:
+        str: まとめられた差分文字列
+
+    Raises:
+        Exception: 上流で発生した例外はそのまま呼び出し元へ送出されます
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def pump() -> None:
+        # 上流を読み続ける。キューが一杯なら put で待つので上流も止まる
+        try:
+            async for delta in source:
+                if delta:
+                    await queue.put(delta)
+        except Exception as e:
+            await queue.put(e)
+            return
+        finally:
+            # キャンセル時も上流のジェネレータを閉じて HTTP 接続を解放する
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        await queue.put(_DONE)
+
+    producer = asyncio.create_task(pump())
+    getter: asyncio.Future | None = None
+    buffer: list[str] = []
+    buffered_chars = 0
+    deadline = 0.0
+
+    try:
+        while True:
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if not done:
+                # 時間予算を使い切ったので溜まっている分を送り出す
+                yield "".join(buffer)
+                buffer.clear()
+                buffered_chars = 0
+                continue
+
+            item = getter.result()
+            getter = None
+
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                if buffer:
+                    yield "".join(buffer)
+                    buffer.clear()
+                raise item
+
+            if not buffer:
+                deadline = loop.time() + max_interval
+            buffer.append(item)
+            buffered_chars += len(item)
+
+            if buffered_chars >= max_chars:
+                yield "".join(buffer)
+                buffer.clear()
+                buffered_chars = 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # 下流が切断された場合などは上流の読み込みをキャンセルする
+        if getter is not None:
+            getter.cancel()
+        producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
@@ -1,14 +1,34 @@
 import base64
+import hashlib
 import json
 import os
+import uuid
+from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Dict, Optional
-from urllib.parse import urljoin
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 
-import requests
-from bs4 import BeautifulSoup
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
+
+from utils.cache import (
+    Cache,
+    MemoryCache,
+    SingleFlight,
+    SQLiteCache,
+    make_cache_key,
+    normalize_prompt,
+)
+from utils.github import get_github_client
+from utils.llm_usage import create_chat_completion, create_chat_completion_sync
+from utils.metrics import httpx_event_hooks
+from utils.settings import get_settings
+
+try:
+    import tiktoken
+except ImportError:  # 未インストールの場合は文字数からの概算で代用する
+    tiktoken = None
 
 # ------------------------------------------------------------------
 # GPT 生成ヘルパ
@@ -16,14 +36,79 @@ from openai import OpenAI
 SYSTEM_PROMPT = """あなたはシステムとユーザーをつなぐアシスタントです。
 """
 
+# ------------------------------------------------------------------
+# 非同期 OpenAI クライアント（プロセス共有）
+
+_async_openai_client: Optional[AsyncOpenAI] = None
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    プロセス全体で共有する AsyncOpenAI クライアントを返す関数
+
+    初回呼び出し時に接続数の上限付きの HTTP クライアントを 1 つだけ生成し、
+    以後は同じインスタンスを使い回します。イベントループをブロックせずに
+    複数のチャットを並行して処理できます。
+
+    環境変数（任意）:
+        - OPENAI_MAX_CONNECTIONS: 同時接続数の上限（デフォルト 20）
+        - OPENAI_MAX_KEEPALIVE_CONNECTIONS: 保持する keep-alive 接続数（デフォルト 10）
+        - OPENAI_TIMEOUT: リクエストのタイムアウト秒数（デフォルト 120）
+
+    Returns:
+        AsyncOpenAI: 共有クライアント
+
+    Raises:
+        RuntimeError: OPENAI_API_KEY が設定されていない場合
+    """
+    global _async_openai_client
+
+    if _async_openai_client is None:
+        load_dotenv()
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set in .env")
+
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(
+                os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10")
+            ),
+        )
+        _async_openai_client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=float(os.getenv("OPENAI_TIMEOUT", "120")),
+            http_client=DefaultAsyncHttpxClient(
+                limits=limits,
+                # エンドポイント（/v1/chat/completions など）ごとに応答時間を記録
+                event_hooks=httpx_event_hooks("openai", lambda r: r.url.path),
+            ),
+        )
+
+    return _async_openai_client
+
+
+async def close_async_openai_client() -> None:
+    """共有 AsyncOpenAI クライアントの接続プールを閉じる（アプリ終了時用）"""
+    global _async_openai_client
+
+    if _async_openai_client is not None:
+        await _async_openai_client.close()
+        _async_openai_client = None
+
+
 # ------------------------------------------------------------------
 # GitHub API ヘルパ
 
 
-def get_github_repo_contents(owner: str, repo: str, path: str = "") -> Dict[str, Any]:
+async def get_github_repo_contents(
+    owner: str, repo: str, path: str = ""
+) -> Dict[str, Any]:
     """
     GitHubのリポジトリコンテンツを取得する関数
 
+    前回と内容が変わっていなければ 304 が返り、保持している内容を返します。
+
     Args:
         owner (str): リポジトリのオーナー名
         repo (str): リポジトリ名
@@ -34,28 +119,12 @@ def get_github_repo_contents(owner: str, repo: str, path: str = "") -> Dict[str,
 
     Raises:
         RuntimeError: 必要な環境変数が設定されていない場合
-        requests.exceptions.RequestException: APIリクエストが失敗した場合
+        GitHubError: APIリクエストが失敗した場合
     """
-    load_dotenv()
-    github_token = os.getenv("GITHUB_TOKEN")
-
-    if not github_token:
-        raise RuntimeError("GITHUB_TOKEN is not set in .env")
-
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {github_token}",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
+    return await get_github_client().get_contents(owner, repo, path)
 
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
 
-    return response.json()
-
-
-def create_github_file(
+async def create_github_file(
     owner: str, repo: str, content: str, branch: str = "main"
 ) -> Dict[str, Any]:
     """
@@ -72,23 +141,12 @@ def create_github_file(
 
     Raises:
         RuntimeError: 必要な環境変数が設定されていない場合
-        requests.exceptions.RequestException: APIリクエストが失敗した場合
+        GitHubError: APIリクエストが失敗した場合
     """
-    load_dotenv()
-    github_token = os.getenv("GITHUB_TOKEN")
-
-    if not github_token:
-        raise RuntimeError("GITHUB_TOKEN is not set in .env")
-
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {github_token}",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
-
     # 現在のタイムスタンプをファイル名として使用（YYYY_MM_DD_HH_MM_SS形式）
+    # 同じ秒に作成しても衝突しないようにランダムな接尾辞を付ける
     timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    path = f"memo_{timestamp}.md"
+    path = f"memo_{timestamp}_{uuid.uuid4().hex[:8]}.md"
 
     # コンテンツをBase64エンコード
     content_bytes = content.encode("utf-8")
@@ -99,15 +157,10 @@ def create_github_file(
         "content": content_base64,
         "branch": branch,
     }
+    return await get_github_client().put_contents(owner, repo, path, data)
 
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-    response = requests.put(url, headers=headers, json=data)
-    response.raise_for_status()
-
-    return response.json()
 
-
-def delete_github_file(
+async def delete_github_file(
     owner: str, repo: str, path: str, sha: str, branch: str = "main"
 ) -> Dict[str, Any]:
     """
@@ -125,31 +178,14 @@ def delete_github_file(
 
     Raises:
         RuntimeError: 必要な環境変数が設定されていない場合
-        requests.exceptions.RequestException: APIリクエストが失敗した場合
+        GitHubError: APIリクエストが失敗した場合
     """
-    load_dotenv()
-    github_token = os.getenv("GITHUB_TOKEN")
-
-    if not github_token:
-        raise RuntimeError("GITHUB_TOKEN is not set in .env")
-
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {github_token}",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
-
     data = {
         "message": f"Delete file: {path}",
         "sha": sha,
         "branch": branch,
     }
-
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-    response = requests.delete(url, headers=headers, json=data)
-    response.raise_for_status()
-
-    return response.json()
+    return await get_github_client().delete_contents(owner, repo, path, data)
 
 
 # ------------------------------------------------------------------
@@ -197,13 +233,8 @@ def initialize_clients():
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY is not set in .env")
 
-    # config.json からモデル名を取得
-    try:
-        with open("config.json", "r") as f:
-            config = json.load(f)
-            OPEN_AI_CHAT_MODEL = config.get("OPEN_AI_CHAT_MODEL", "gpt-4.1")
-    except Exception:
-        OPEN_AI_CHAT_MODEL = "gpt-4.1"
+    # config.json（キャッシュ済みの設定）からモデル名を取得
+    OPEN_AI_CHAT_MODEL = get_settings().chat_model
 
     # ------------------------------------------------------------------
     # API クライアント
@@ -217,9 +248,9 @@ def initialize_clients():
     )
 
 
-def generate_ai_reply(user_prompt: str, temperature: float) -> str:
+async def generate_ai_reply(user_prompt: str, temperature: float) -> str:
     """
-    OpenAI APIを使用してメッセージを生成します。
+    OpenAI APIを使用してメッセージを生成します（共有の非同期クライアントを使用）。
 
     Args:
         user_prompt (str): ユーザーからのプロンプト
@@ -228,52 +259,357 @@ def generate_ai_reply(user_prompt: str, temperature: float) -> str:
     Returns:
         str: 生成されたメッセージ
     """
-    response = openai_client.chat.completions.create(
-        model=OPEN_AI_CHAT_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": user_prompt,
-            },
-        ],
-        max_tokens=32000,
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": user_prompt,
+        },
+    ]
+    response = await create_chat_completion(
+        get_async_openai_client(),
+        "reply",
+        model=get_settings().chat_model,
+        messages=messages,
+        max_tokens=completion_token_limit(messages),
         temperature=temperature,
     )
     return response.choices[0].message.content.strip()
 
 
-def get_url_title(url: str) -> Optional[str]:
-    """URLからタイトルを取得する"""
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        title = soup.title.string if soup.title else None
-        return title.strip() if title else None
-    except Exception:
-        return None
+def create_ai_reply_cache() -> Cache:
+    """
+    環境変数の設定に従って generate_ai_reply 用のキャッシュを生成する関数
+
+    環境変数（任意）:
+        - AI_REPLY_CACHE: "memory"（デフォルト）または "sqlite"
+        - AI_REPLY_CACHE_PATH: SQLite ファイルのパス（デフォルト ./ai_reply_cache.db）
+        - AI_REPLY_CACHE_MAX_ENTRIES: memory バックエンドの最大件数（デフォルト 1024）
+
+    Raises:
+        ValueError: AI_REPLY_CACHE に未知のバックエンド名が指定された場合
+    """
+    backend = os.getenv("AI_REPLY_CACHE", "memory")
+    if backend == "memory":
+        return MemoryCache(int(os.getenv("AI_REPLY_CACHE_MAX_ENTRIES", "1024")))
+    if backend == "sqlite":
+        return SQLiteCache(os.getenv("AI_REPLY_CACHE_PATH", "./ai_reply_cache.db"))
+    raise ValueError(f"未知の AI_REPLY_CACHE です: {backend}")
+
+
+_ai_reply_cache: Optional[Cache] = None
+_ai_reply_flight = SingleFlight()
+
+
+async def cached_ai_reply(user_prompt: str, temperature: float, ttl: float) -> str:
+    """
+    generate_ai_reply の結果をキャッシュして返します。
+
+    キーは正規化したプロンプト・モデル名・temperature から作るため、
+    時間帯やユーザー名をプロンプトに含めればその単位でキャッシュされます。
+    同じキーへの同時リクエストは 1 回の API 呼び出しにまとめます。
+
+    Args:
+        user_prompt (str): ユーザーからのプロンプト
+        temperature (float): 生成のランダム性を制御するパラメータ（0.0-1.0）
+        ttl (float): キャッシュの有効秒数
+
+    Returns:
+        str: 生成されたメッセージ
+    """
+    global _ai_reply_cache
+    if _ai_reply_cache is None:
+        _ai_reply_cache = create_ai_reply_cache()
+
+    key = make_cache_key(
+        normalize_prompt(user_prompt), get_settings().chat_model, f"{temperature:.3f}"
+    )
+    cached = await _ai_reply_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def fetch() -> str:
+        reply = await generate_ai_reply(user_prompt, temperature)
+        await _ai_reply_cache.set(key, reply, ttl)
+        return reply
+
+    return await _ai_reply_flight.do(key, fetch)
+
+
+# ------------------------------------------------------------------
+# コンテキストウィンドウ管理
+
+# 1 メッセージあたりの区切りなどのオーバーヘッド（トークン。role の分は別に数える）
+MESSAGE_TOKEN_OVERHEAD = 3
+# 応答の開始（assistant）の分として 1 リクエストごとに加わるトークン
+REPLY_PRIMING_TOKENS = 3
+
+# モデルのコンテキスト長（入力と出力の合計の上限）と 1 回の応答の上限（トークン）
+MODEL_CONTEXT_TOKENS = int(os.getenv("CHAT_MODEL_CONTEXT_TOKENS", "128000"))
+MAX_COMPLETION_TOKENS = int(os.getenv("CHAT_MAX_COMPLETION_TOKENS", "32000"))
+
+SUMMARY_PREFIX = "これまでの会話の要約:\n"
+
+SUMMARY_PROMPT = """以下はユーザーとアシスタントの会話の古い部分です。
+これまでの要約があればそれも踏まえて、後の会話に必要な事実・決定事項・前提を
+箇条書きで簡潔にまとめてください。"""
+
+# 古い会話の要約キャッシュ（キー: 要約対象の会話から計算したハッシュ）
+_summary_cache: "OrderedDict[str, str]" = OrderedDict()
+SUMMARY_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    return tiktoken.get_encoding("o200k_base") if tiktoken else None
+
+
+def _count_text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # UTF-8 で 3 バイトになる文字（日本語など）の数をバイト長の差から概算
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    return -(-(len(text) - non_ascii) // 4) + non_ascii
+
+
+@lru_cache(maxsize=8192)
+def count_message_tokens(role: str, content: str) -> int:
+    """
+    1 メッセージ分のトークン数を返す関数（結果はメッセージ単位でキャッシュ）
+
+    本文に加えて role とメッセージの区切りの分も数えます。
+    tiktoken が利用できない場合は、ASCII 4 文字 ≒ 1 トークン、
+    それ以外（日本語など）1 文字 ≒ 1 トークンとして概算します。
+    """
+    return (
+        _count_text_tokens(role) + _count_text_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+    )
+
+
+def count_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """API に送るメッセージ全体のトークン数（応答の開始の分を含む）"""
+    return (
+        sum(count_message_tokens(m["role"], m["content"]) for m in messages)
+        + REPLY_PRIMING_TOKENS
+    )
+
+
+def completion_token_limit(messages: List[Dict[str, str]]) -> int:
+    """
+    送るメッセージに対して指定する max_tokens を返す関数
+
+    コンテキスト長から入力の分を引いた残り（MAX_COMPLETION_TOKENS まで）を
+    応答に割り当てます。
+
+    Args:
+        messages (List[Dict[str, str]]): API に送るメッセージ
+
+    Returns:
+        int: 応答の最大トークン数
+    """
+    remaining = MODEL_CONTEXT_TOKENS - count_prompt_tokens(messages)
+    return max(1, min(MAX_COMPLETION_TOKENS, remaining))
+
+
+class ContextWindow:
+    """
+    API に送るメッセージをトークン予算内に収めるクラス
+
+    システムプロンプトは常に残し、残りの予算に収まる範囲で新しい順に
+    メッセージを選びます。summarize=True の場合は、予算からあふれた古い会話を
+    summary_chunk 件単位で要約に畳み込み、システムメッセージとして先頭に添えます。
+    要約はキャッシュされるため、会話が長くなっても追加の要約は新しいチャンク分だけです。
+    あふれた会話はチャンクの境界まで広げて要約するので、要約にも送る履歴にも
+    含まれない会話はありません。
+
+    token_budget は入力（送るメッセージ）の予算です。応答の max_tokens は
+    completion_token_limit でコンテキスト長の残りから決めます。
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 16000,
+        summarize: bool = False,
+        summary_chunk: int = 8,
+        summary_max_tokens: int = 800,
+    ):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_chunk = summary_chunk
+        self.summary_max_tokens = summary_max_tokens
+
+    @staticmethod
+    def count(message: Dict[str, str]) -> int:
+        return count_message_tokens(message["role"], message["content"])
+
+    async def build(
+        self,
+        messages: List[Dict[str, str]],
+        client: Optional[AsyncOpenAI] = None,
+        model: Optional[str] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        予算内に収めたメッセージリストを返す
+
+        Args:
+            messages (List[Dict[str, str]]): 全履歴（先頭はシステムプロンプト）
+            client (AsyncOpenAI, optional): 要約に使うクライアント
+            model (str, optional): 要約に使うモデル名
+
+        Returns:
+            List[Dict[str, str]]: API に送るメッセージ
+        """
+        if messages and messages[0]["role"] == "system":
+            system, history = messages[:1], messages[1:]
+        else:
+            system, history = [], messages
+
+        budget = (
+            self.token_budget
+            - REPLY_PRIMING_TOKENS
+            - sum(self.count(m) for m in system)
+        )
+        use_summary = self.summarize and client is not None and model is not None
+        if use_summary:
+            budget -= self.summary_max_tokens + count_message_tokens(
+                "system", SUMMARY_PREFIX
+            )
+
+        # 新しいメッセージから順に、予算に収まるだけ残す（最新の 1 件は必ず残す）
+        kept = 0
+        used = 0
+        for message in reversed(history):
+            tokens = self.count(message)
+            if kept and used + tokens > budget:
+                break
+            kept += 1
+            used += tokens
+
+        cut = len(history) - kept
+        if cut and use_summary:
+            # 要約はチャンク単位でキャッシュするので、あふれた分をチャンクの境界まで
+            # 広げる（最新のメッセージは残す。届かない分は _summarize が続けて畳み込む）
+            aligned = -(-cut // self.summary_chunk) * self.summary_chunk
+            cut = min(aligned, len(history) - 1)
+        window = history[cut:]
+        dropped = history[:cut]
+        if not dropped or not use_summary:
+            return system + window
+
+        summary = await self._summarize(dropped, client, model)
+        if not summary:
+            return system + window
+        summary_message = {
+            "role": "system",
+            "content": SUMMARY_PREFIX + summary,
+        }
+        return system + [summary_message] + window
+
+    async def _summarize(
+        self, dropped: List[Dict[str, str]], client: AsyncOpenAI, model: str
+    ) -> Optional[str]:
+        # チャンク境界に揃えることで、毎ターン要約し直さずキャッシュを再利用する
+        chunk = self.summary_chunk
+        chunks = [
+            dropped[i : i + chunk]
+            for i in range(0, len(dropped) // chunk * chunk, chunk)
+        ]
+        # チャンクに満たない残り（最新のメッセージを残すために境界まで広げられない場合）
+        tail = dropped[len(chunks) * chunk :]
+
+        # 各チャンクまでの要約のキー（前のキー + チャンク内容のハッシュ）
+        keys = []
+        key = ""
+        for c in chunks:
+            key = hashlib.sha256(
+                (key + json.dumps(c, ensure_ascii=False)).encode("utf-8")
+            ).hexdigest()
+            keys.append(key)
+
+        # キャッシュ済みの最も新しい要約から続きを畳み込む
+        start = 0
+        summary = ""
+        for i in range(len(keys) - 1, -1, -1):
+            if keys[i] in _summary_cache:
+                _summary_cache.move_to_end(keys[i])
+                summary = _summary_cache[keys[i]]
+                start = i + 1
+                break
+
+        for i in range(start, len(chunks)):
+            summary = await self._fold(summary, chunks[i], client, model)
+            _summary_cache[keys[i]] = summary
+            while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+                _summary_cache.popitem(last=False)
+
+        # 残りはターンごとに変わるのでキャッシュせずに畳み込む
+        if tail:
+            summary = await self._fold(summary, tail, client, model)
+        return summary or None
+
+    async def _fold(
+        self,
+        summary: str,
+        messages: List[Dict[str, str]],
+        client: AsyncOpenAI,
+        model: str,
+    ) -> str:
+        """これまでの要約に messages を畳み込んだ要約を返す"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = f"これまでの要約:\n{summary or '（なし）'}\n\n会話:\n{transcript}"
+        response = await create_chat_completion(
+            client,
+            "summary",
+            model=model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=self.summary_max_tokens,
+            temperature=0,
+        )
+        return (response.choices[0].message.content or "").strip()
 
 
 class ChatBot:
     """チャットボットクラス"""
 
-    def __init__(self, temperature: float = 0.1):
-        """メッセージ履歴を保持するリストを初期化"""
-        self.messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    def __init__(
+        self,
+        temperature: float = 0.1,
+        messages: Optional[list] = None,
+        context: Optional[ContextWindow] = None,
+    ):
+        """メッセージ履歴を保持するリストを初期化（保存済みの履歴があれば引き継ぐ）"""
+        self.messages = messages or [{"role": "system", "content": SYSTEM_PROMPT}]
         self.temperature = temperature
 
         load_dotenv()
-        self.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         self.OPENAI_CHAT_MODEL = os.getenv("OPEN_AI_CHAT_MODEL", "gpt-4.1")
-        self.openai_client = OpenAI(api_key=self.OPENAI_API_KEY)
+        # 接続プールはプロセス内の全 ChatBot で共有する
+        self.openai_client = get_async_openai_client()
+        # API に送る履歴はトークン予算内に収める（self.messages は全履歴のまま）
+        self.context = context or ContextWindow(
+            token_budget=int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "16000")),
+            summarize=os.getenv("CHAT_CONTEXT_SUMMARY", "0") == "1",
+        )
 
-    def get_ai_messages(self, user_message):
+    async def _context_messages(self):
+        return await self.context.build(
+            self.messages, self.openai_client, self.OPENAI_CHAT_MODEL
+        )
+
+    async def get_ai_messages(self, user_message):
+        """AIの応答を一括で取得（非同期版）"""
         self.messages.append({"role": "user", "content": user_message})
-        response = self.openai_client.chat.completions.create(
+        messages = await self._context_messages()
+        response = await create_chat_completion(
+            self.openai_client,
+            "chat",
             model=self.OPENAI_CHAT_MODEL,
-            messages=self.messages,
-            max_tokens=32000,
+            messages=messages,
+            max_tokens=completion_token_limit(messages),
             temperature=self.temperature,
         )
         ai_response = response.choices[0].message.content.strip()
@@ -288,30 +624,38 @@ class ChatBot:
     async def get_ai_messages_stream(self, user_message):
         """ストリーミング形式でAIの応答を取得（非同期版）"""
         self.messages.append({"role": "user", "content": user_message})
-        stream = self.openai_client.chat.completions.create(
+        messages = await self._context_messages()
+        stream = await create_chat_completion(
+            self.openai_client,
+            "chat_stream",
             model=self.OPENAI_CHAT_MODEL,
-            messages=self.messages,
-            max_tokens=32000,
+            messages=messages,
+            max_tokens=completion_token_limit(messages),
             temperature=self.temperature,
             stream=True,
         )
 
         collected_messages = []
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                collected_messages.append(content)
-                yield content
-
-        # 完全な応答をメッセージ履歴に追加
-        full_response = "".join(collected_messages)
-
-        self.messages.append(
-            {
-                "role": "assistant",
-                "content": full_response,
-            }
-        )
+        try:
+            # async with で抜けると上流の HTTP レスポンスも閉じられる
+            async with stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    if chunk.choices[0].delta.content is not None:
+                        content = chunk.choices[0].delta.content
+                        collected_messages.append(content)
+                        yield content
+        finally:
+            # 完全な応答（切断で中断された場合は受信済みの部分）をメッセージ履歴に追加
+            full_response = "".join(collected_messages)
+
+            self.messages.append(
+                {
+                    "role": "assistant",
+                    "content": full_response,
+                }
+            )
 
     def clear_messages(self):
         self.messages = [{"role": "system", "content": SYSTEM_PROMPT}]
@@ -323,14 +667,11 @@ def search_web(query):
     global openai_client
     if "openai_client" not in globals() or openai_client is None:
         _, _, openai_client, _ = initialize_clients()
-    # config.jsonからモデル名を取得
-    try:
-        with open("config.json", "r") as f:
-            config = json.load(f)
-            search_model = config.get("OPEN_AI_SERARCH_MODEL", "gpt-4o-search-preview")
-    except Exception:
-        search_model = "gpt-4o-search-preview"
-    response = openai_client.chat.completions.create(
+    # config.json（キャッシュ済みの設定）からモデル名を取得
+    search_model = get_settings().search_model
+    response = create_chat_completion_sync(
+        openai_client,
+        "search",
         model=search_model,
         web_search_options={
             "search_context_size": "medium",  # 検索深度